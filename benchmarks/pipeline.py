@@ -0,0 +1,127 @@
+"""
+Benchmark of the image pipeline: the DataFrame round trips it used to make against the ndarray
+pipeline, for the upload (JSON columns to stored rows) and read (stored rows to colorized image)
+paths.
+
+Each case runs in its own process so that peak RSS is not shared between cases. Copies are
+reported as the peak of Python-traced allocations during the request, in multiples of the size
+of the uint8 image.
+
+Usage:
+    python -m benchmarks.pipeline [--rows 10000] [--width 200] [--repeat 3]
+"""
+import argparse
+import json
+import multiprocessing
+import resource
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+import cv2
+import numpy as np
+import pandas as pd
+
+from services.database import DatabaseService, create_db_engine
+from services.image_processing import ImageProcessingService
+
+
+def _columns(rows: int, width: int) -> Dict[str, List[Any]]:
+    generator = np.random.default_rng(0)
+    pixels = generator.integers(0, 256, size=(rows, width), dtype=np.uint8)
+    data: Dict[str, List[Any]] = {str(column): pixels[:, column].tolist() for column in range(width)}
+    data["depth"] = (1000.0 + np.arange(rows) * 0.1).tolist()
+    data["image_name"] = ["bench"] * rows
+    return data
+
+
+def upload_dataframe(data: Dict[str, List[Any]]) -> np.ndarray:
+    """The previous upload path: DataFrame, PIL image, array, then back to a DataFrame for to_sql."""
+    df = pd.DataFrame(data)
+    image = ImageProcessingService.dataframe_to_image(df)
+    frame = ImageProcessingService.image_to_dataframe(image)
+    frame["depth"] = df["depth"]
+    frame["image_name"] = df["image_name"]
+    return frame.drop(columns=["depth", "image_name"]).to_numpy(dtype=np.uint8)
+
+
+def upload_ndarray(data: Dict[str, List[Any]]) -> np.ndarray:
+    """The ndarray upload path."""
+    _, pixels = ImageProcessingService.columns_to_arrays(data)
+    return pixels
+
+
+def read_dataframe(database_service: DatabaseService) -> np.ndarray:
+    """The previous read path: ORM rows, DataFrame, drop, array, then cv2."""
+    with database_service.connection() as connection:
+        result = connection.execute(
+            database_service._range_query("bench", 0.0, 1e9, "images")  # pylint: disable=protected-access
+        )
+        dataframe = pd.DataFrame(result.all(), columns=list(result.keys()))
+    dataframe = dataframe.drop(columns=["depth"])
+    return cv2.applyColorMap(np.array(dataframe.values, dtype=np.uint8), cv2.COLORMAP_JET)
+
+
+def read_ndarray(database_service: DatabaseService) -> np.ndarray:
+    """The ndarray read path."""
+    return database_service.get_image_data(0.0, 1e9, "COLORMAP_JET", "bench")
+
+
+def _measure(name: str, function: Callable[[Any], np.ndarray], argument: Any, repeat: int) -> Dict[str, Any]:
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    seconds = []
+    tracemalloc.start()
+    for _ in range(repeat):
+        tracemalloc.reset_peak()
+        started = time.perf_counter()
+        image = function(argument)
+        seconds.append(time.perf_counter() - started)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    image_bytes = int(np.prod(image.shape[:2]))
+    return {
+        "case": name,
+        "seconds": round(min(seconds), 4),
+        "peak_traced_bytes": peak,
+        "peak_copies": round(peak / image_bytes, 1),
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_growth_bytes": (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline_rss) * 1024,
+    }
+
+
+def _run_case(name: str, rows: int, width: int, repeat: int, results: "multiprocessing.Queue[Any]") -> None:
+    if name.startswith("upload"):
+        argument: Any = _columns(rows, width)
+        function = upload_dataframe if name == "upload_dataframe" else upload_ndarray
+    else:
+        argument = DatabaseService(engine=create_db_engine("sqlite://"), storage_mode="wide")
+        pixels = np.random.default_rng(0).integers(0, 256, size=(rows, width), dtype=np.uint8)
+        argument.store_image("bench", 1000.0 + np.arange(rows) * 0.1, pixels)
+        function = read_dataframe if name == "read_dataframe" else read_ndarray
+    results.put(_measure(name, function, argument, repeat))
+
+
+CASES = ["upload_dataframe", "upload_ndarray", "read_dataframe", "read_ndarray"]
+
+
+def main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--width", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    context = multiprocessing.get_context("spawn")
+    report = []
+    for name in CASES:
+        results = context.Queue()
+        process = context.Process(target=_run_case, args=(name, args.rows, args.width, args.repeat, results))
+        process.start()
+        report.append(results.get())
+        process.join()
+    print(json.dumps({"rows": args.rows, "width": args.width, "cases": report}, indent=2))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
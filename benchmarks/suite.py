@@ -0,0 +1,326 @@
+"""
+Benchmark suite of the ingest, query and render paths, on synthetic depth logs of several sizes.
+
+For every size (rows x pixel columns) a synthetic log is written as a CSV, then run through the real
+ImageProcessingService and image store code, stage by stage:
+
+    csv_ingest   CSV parsing and cleaning into depths and uint8 pixel rows
+    resample     resampling to IMAGE_WIDTH columns
+    insert       storing the image in the store
+    range_query  loading random depth windows of --window-rows rows
+    colorize     applying a colormap to a window
+    encode_json  base64 encoding a colorized window, as the JSON responses do
+    encode_png   PNG encoding a colorized window
+    encode_webp  WebP encoding a colorized window
+
+Each stage reports its latency percentiles, its throughput in rows and bytes per second, the peak of
+Python-traced allocations (measured in one extra run, so tracing does not skew the timings) and the peak
+RSS growth. Every size runs in its own process so that peak RSS is not shared between sizes.
+
+The store is a SQLite file in a temporary directory unless --db-url is given, or the memmap store with
+--store memmap. Results are written as JSON to --output, along with the versions and settings of the run;
+--compare prints the median latency ratio of every stage against a previous results file.
+
+Usage:
+    python -m benchmarks.suite [--sizes 2000x150,20000x150] [--output results.json] [--compare old.json]
+"""
+import argparse
+import base64
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+import pandas as pd
+import sqlalchemy
+
+from services.colormaps import get_colormap_registry
+from services.config import IMAGE_WIDTH, PNG_COMPRESSION, RESAMPLING_FILTER, WEBP_QUALITY
+from services.database import DatabaseService, create_db_engine
+from services.image_processing import ImageProcessingService
+from services.memmap_store import MemmapImageStore
+
+IMAGE_NAME = "bench"
+TABLE_NAME = "bench"
+
+
+def parse_size(size: str) -> Tuple[int, int]:
+    """Parse a ROWSxCOLUMNS size."""
+    rows, _, width = size.lower().partition("x")
+    return int(rows), int(width)
+
+
+def write_log(path: str, rows: int, width: int, seed: int = 0) -> None:
+    """Write a synthetic depth log CSV, in the layout of image/img.csv: a depth column then col1..colN."""
+    generator = np.random.default_rng(seed)
+    # Smooth bands with noise, closer to a real log than uniform noise for the encoders
+    bands = np.sin(np.linspace(0, 20, rows))[:, None] * np.cos(np.linspace(0, 3, width))[None, :]
+    pixels = np.clip(127 + 100 * bands + generator.normal(0, 12, size=(rows, width)), 0, 255).astype(np.uint8)
+    frame = pd.DataFrame(pixels, columns=[f"col{column + 1}" for column in range(width)])
+    frame.insert(0, "depth", np.round(9000.0 + np.arange(rows) * 0.1, 1))
+    frame.to_csv(path, index=False)
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    return round(float(np.percentile(values, percent)), 6)
+
+
+def measure(
+        stage: str,
+        function: Callable[[int], Any],
+        runs: int,
+        rows: int,
+        nbytes: int,
+) -> Dict[str, Any]:
+    """
+    Time runs calls of a stage, then trace the allocations of one more call.
+
+    Args:
+        stage (str): The stage name.
+        function (Callable[[int], Any]): The stage, called with the run number.
+        runs (int): The number of timed runs.
+        rows (int): The pixel rows handled per call.
+        nbytes (int): The bytes of pixels handled per call.
+
+    Returns:
+        Dict[str, Any]: The latency percentiles, throughput and peak memory of the stage.
+    """
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    seconds = []
+    for run in range(runs):
+        started = time.perf_counter()
+        function(run)
+        seconds.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    function(runs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    median = float(np.median(seconds))
+    return {
+        "stage": stage,
+        "runs": runs,
+        "rows": rows,
+        "bytes": nbytes,
+        "seconds": {
+            "min": round(min(seconds), 6),
+            "mean": round(float(np.mean(seconds)), 6),
+            "p50": _percentile(seconds, 50),
+            "p90": _percentile(seconds, 90),
+            "p99": _percentile(seconds, 99),
+            "max": round(max(seconds), 6),
+        },
+        "rows_per_second": round(rows / median, 1) if median > 0 else None,
+        "bytes_per_second": round(nbytes / median, 1) if median > 0 else None,
+        "peak_traced_bytes": peak,
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_growth_bytes": (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline_rss) * 1024,
+    }
+
+
+def _open_store(args: argparse.Namespace, workdir: str) -> Any:
+    if args.store == "memmap":
+        return MemmapImageStore(root=os.path.join(workdir, "store"))
+    db_url = args.db_url or "sqlite:///" + os.path.join(workdir, "bench.sqlite")
+    return DatabaseService(engine=create_db_engine(db_url), storage_mode=args.storage_mode)
+
+
+def run_size(rows: int, width: int, args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """
+    Run every stage on a synthetic log of the given size.
+
+    Args:
+        rows (int): The depth rows of the log.
+        width (int): The pixel columns of the log.
+        args (argparse.Namespace): The command line arguments.
+
+    Returns:
+        List[Dict[str, Any]]: The measures of every stage.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        csv_path = os.path.join(workdir, "log.csv")
+        write_log(csv_path, rows, width)
+
+        def csv_ingest(_: int) -> Tuple[np.ndarray, np.ndarray]:
+            cleaner = ImageProcessingService(csv_path)
+            return cleaner.frame_to_arrays(cleaner.clean_data())
+
+        log_depths, log_pixels = csv_ingest(0)
+        results.append(measure("csv_ingest", csv_ingest, args.repeat, rows, log_pixels.nbytes))
+
+        def resample(_: int) -> Tuple[np.ndarray, np.ndarray]:
+            return ImageProcessingService.resample(
+                log_pixels, log_depths, width=IMAGE_WIDTH, method=RESAMPLING_FILTER
+            )
+
+        depths, pixels = resample(0)
+        results.append(measure("resample", resample, args.repeat, rows, log_pixels.nbytes))
+
+        store = _open_store(args, workdir)
+
+        def insert(_: int) -> Any:
+            return store.store_image(IMAGE_NAME, depths, pixels, table_name=TABLE_NAME)
+
+        results.append(measure("insert", insert, args.repeat, rows, pixels.nbytes))
+
+        window_rows = min(args.window_rows, rows)
+        generator = np.random.default_rng(1)
+        starts = generator.integers(0, rows - window_rows + 1, size=args.queries + 1)
+
+        def range_query(run: int) -> Tuple[np.ndarray, np.ndarray]:
+            start = starts[run]
+            return store.load_image(
+                IMAGE_NAME, depths[start], depths[start + window_rows - 1], table_name=TABLE_NAME
+            )
+
+        _, window = range_query(0)
+        window = np.ascontiguousarray(window)
+        results.append(measure("range_query", range_query, args.queries, window_rows, window.nbytes))
+
+        colormaps = get_colormap_registry()
+
+        def colorize(_: int) -> np.ndarray:
+            return colormaps.apply(window, args.colormap)
+
+        image = colorize(0)
+        results.append(measure("colorize", colorize, args.repeat * 10, window_rows, window.nbytes))
+
+        encoders: Dict[str, Callable[[int], Any]] = {
+            "encode_json": lambda _: base64.b64encode(image.tobytes()).decode("utf-8"),
+            "encode_png": lambda _: ImageProcessingService.encode_image(
+                image, "png", png_compression=PNG_COMPRESSION
+            ),
+            "encode_webp": lambda _: ImageProcessingService.encode_image(
+                image, "webp", webp_quality=WEBP_QUALITY
+            ),
+        }
+        for stage, encoder in encoders.items():
+            results.append(measure(stage, encoder, args.repeat * 10, window_rows, image.nbytes))
+    return results
+
+
+def _run_size(rows: int, width: int, args: argparse.Namespace, queue: "multiprocessing.Queue[Any]") -> None:
+    try:
+        queue.put(run_size(rows, width, args))
+    except Exception as exc:  # pylint: disable=broad-except
+        queue.put(exc)
+
+
+def environment() -> Dict[str, Any]:
+    """Describe the code, library versions and machine a run was made with."""
+    try:
+        commit: Optional[str] = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "opencv": cv2.__version__,
+        "sqlalchemy": sqlalchemy.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def compare(current: Dict[str, Any], previous: Dict[str, Any]) -> List[str]:
+    """
+    Compare the median latency of every stage of two runs.
+
+    Args:
+        current (Dict[str, Any]): The results of this run.
+        previous (Dict[str, Any]): The results of the previous run.
+
+    Returns:
+        List[str]: One line per stage measured in both runs, with the ratio of this run's median latency
+        to the previous one: below 1 is faster.
+    """
+    previous_stages = {
+        (size["size"], stage["stage"]): stage["seconds"]["p50"]
+        for size in previous["sizes"]
+        for stage in size["stages"]
+    }
+    lines = []
+    for size in current["sizes"]:
+        for stage in size["stages"]:
+            before = previous_stages.get((size["size"], stage["stage"]))
+            if before:
+                lines.append(
+                    "{:>12} {:<12} {:>10.6f}s -> {:>10.6f}s  x{:.2f}".format(
+                        size["size"], stage["stage"], before, stage["seconds"]["p50"], stage["seconds"]["p50"] / before
+                    )
+                )
+    return lines
+
+
+def main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="2000x150,20000x150,20000x600", help="comma separated ROWSxCOLUMNS")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs of the ingest and insert stages")
+    parser.add_argument("--queries", type=int, default=50, help="timed range queries")
+    parser.add_argument("--window-rows", type=int, default=1000, help="rows per range query")
+    parser.add_argument("--colormap", default="COLORMAP_JET")
+    parser.add_argument("--store", choices=["database", "memmap"], default="database")
+    parser.add_argument("--storage-mode", choices=["packed", "wide"], default="packed")
+    parser.add_argument("--db-url", default=None, help="database to benchmark instead of a temporary SQLite file")
+    parser.add_argument("--output", default=None, help="JSON file the results are written to")
+    parser.add_argument("--compare", default=None, help="JSON results of a previous run to compare with")
+    args = parser.parse_args(argv)
+
+    context = multiprocessing.get_context("spawn")
+    sizes = []
+    for size in args.sizes.split(","):
+        rows, width = parse_size(size)
+        queue = context.Queue()
+        process = context.Process(target=_run_size, args=(rows, width, args, queue))
+        process.start()
+        stages = queue.get()
+        process.join()
+        if isinstance(stages, Exception):
+            raise stages
+        sizes.append({"size": f"{rows}x{width}", "rows": rows, "width": width, "stages": stages})
+        for stage in stages:
+            print(
+                "{:>12} {:<12} p50 {:>10.6f}s  p99 {:>10.6f}s  {:>14,.0f} rows/s  peak {:>12,} B".format(
+                    f"{rows}x{width}",
+                    stage["stage"],
+                    stage["seconds"]["p50"],
+                    stage["seconds"]["p99"],
+                    stage["rows_per_second"] or 0,
+                    stage["peak_traced_bytes"],
+                ),
+                file=sys.stderr,
+            )
+
+    settings = {key: value for key, value in vars(args).items() if key not in ("output", "compare", "db_url")}
+    report = {"environment": environment(), "settings": settings, "sizes": sizes}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            previous = json.load(file)
+        print("\n".join(compare(report, previous)), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -56,3 +56,15 @@ class ColorMapError(Exception):
     """Exception raised for errors in the ColorMap class."""
 
     pass
+
+
+class ServiceBusyError(Exception):
+    """Exception raised when the worker pool is saturated and cannot accept more work."""
+
+    pass
+
+
+class UploadTooLargeError(Exception):
+    """Exception raised when an upload body exceeds the configured size limit."""
+
+    pass
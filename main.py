@@ -4,13 +4,21 @@ It includes startup event to clean and load image data into the database,
 endpoints to fetch image data based on depth range, and exception handlers for database errors.
 """
 
+import asyncio
 import base64
+import hashlib
+import hmac
+import json
 import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple, Union
 
+import numpy as np
 import pandas as pd
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI, Header, Query
 from starlette.requests import Request
-from starlette.responses import JSONResponse
+from starlette.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
 
 from exceptions.exceptions import (
     DatabaseConnectionError,
@@ -18,15 +26,71 @@ from exceptions.exceptions import (
     DatabaseCreationError,
     DatabaseServiceError,
     ColorMapError,
+    ImageProcessingError,
+    ServiceBusyError,
+    UploadTooLargeError,
 )
 from models.models import (
+    ImageDepthRangeBatchRequest,
     ImageDepthRangeResponse,
     ImageDepthRangeRequest,
     DataFrameRequest,
     ImageDataFrameResponse,
+    IngestJobResponse,
+)
+from services.cache import LRUCache
+from services.colormaps import RAW, ColormapRegistry, get_colormap_registry
+from services.concurrency import BlockingExecutor, heartbeat, prefetch
+from services.config import (
+    BLOCKING_QUEUE_SIZE,
+    BLOCKING_QUEUE_TIMEOUT,
+    BLOCKING_WORKERS,
+    COLORMAPS_FILE,
+    DEPTH_STEP,
+    IMAGE_STORAGE_MODE,
+    IMAGE_STORE_BACKEND,
+    IMAGE_WIDTH,
+    INGEST_CHUNK_ROWS,
+    INGEST_JOB_CHUNK_ROWS,
+    INGEST_JOB_QUEUE_SIZE,
+    INGEST_JOB_WORKERS,
+    INGEST_JOBS_KEPT,
+    MEMMAP_STORE_PATH,
+    PNG_COMPRESSION,
+    PROFILE_DIR,
+    PROFILE_MAX_FILES,
+    PROFILE_SAMPLE_RATE,
+    PROFILE_TOKEN,
+    PYRAMID_LEVELS,
+    PYRAMID_MIN_WIDTH,
+    RESAMPLING_FILTER,
+    RESPONSE_CACHE_MAX_BYTES,
+    RESPONSE_CACHE_TTL,
+    SEED_CLAIM_TIMEOUT,
+    SEED_FILE,
+    SEED_IN_BACKGROUND,
+    SEED_POLL_INTERVAL,
+    STREAM_STRIP_ROWS,
+    TILE_CACHE_MAX_BYTES,
+    TILE_CACHE_TTL,
+    TILE_DEPTH,
+    UPLOAD_MAX_BYTES,
+    WEBP_QUALITY,
+)
+from services.database import (
+    SEED_CLAIMED,
+    SEED_READY,
+    DatabaseService,
+    create_db_engine,
+    merge_depth_windows,
+    pick_level,
 )
-from services.database import DatabaseService
 from services.image_processing import ImageProcessingService
+from services.jobs import IngestJob, IngestJobManager
+from services.memmap_store import MemmapImageStore
+from services.metrics import MetricsMiddleware, get_metrics_registry, stage_timer
+from services.profiling import ProfileStore, ProfilingMiddleware
+from services.tiles import DepthTileCache
 
 # Configure logging
 logging.basicConfig(
@@ -34,85 +98,957 @@ logging.basicConfig(
 )
 logger = logging.getLogger()
 
-app = FastAPI()
+# Both stores offer the same image API, IMAGE_STORE_BACKEND picks the one the endpoints use
+ImageStore = Union[DatabaseService, MemmapImageStore]
 
 
-@app.on_event("startup")
-async def startup_event() -> None:
+def store_image_pyramid(
+    database_service: ImageStore, image_name: str, depths: np.ndarray, pixels: np.ndarray
+) -> None:
     """
-    This function is executed at the startup of the FastAPI application.
-    It cleans the image data and loads it into the database.
+    Build the resolution pyramid of an image and store all of its levels.
+    """
+    pyramid = ImageProcessingService.build_pyramid(
+        pixels, depths, levels=PYRAMID_LEVELS, min_width=PYRAMID_MIN_WIDTH
+    )
+    database_service.store_pyramid(image_name=image_name, levels=pyramid, table_name="images")
+
+
+def stored_width(pixels: np.ndarray) -> int:
+    """
+    Width an image is stored at: IMAGE_WIDTH, or its own width when narrower, as images are never upscaled.
     """
-    input_file_path = "image/img.csv"
-    data_cleaner = ImageProcessingService(input_file_path)
+    return min(IMAGE_WIDTH, pixels.shape[1])
+
+
+def resize_image(depths: np.ndarray, pixels: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Downsample an image to IMAGE_WIDTH, and resample it onto a regular depth grid when DEPTH_STEP is set.
+    The depths are resampled together with the pixel rows.
+    """
+    return ImageProcessingService.resample(
+        pixels,
+        depths,
+        width=stored_width(pixels),
+        depth_step=DEPTH_STEP or None,
+        method=RESAMPLING_FILTER,
+    )
+
+
+def store_resized_image(
+    database_service: ImageStore, image_name: str, depths: np.ndarray, pixels: np.ndarray
+) -> None:
+    """
+    Resample an image with resize_image and store its pyramid.
+    """
+    resized_depths, resized_pixels = resize_image(depths, pixels)
+    store_image_pyramid(database_service, image_name=image_name, depths=resized_depths, pixels=resized_pixels)
+
+
+SEED_IMAGE_NAME = "test_image"
+
+
+def seed_fingerprint(path: str) -> str:
+    """
+    Hash the seed file together with the settings that shape the stored image, so that changing either
+    one seeds the image again.
+    """
+    settings = {
+        "image_width": IMAGE_WIDTH,
+        "resampling_filter": RESAMPLING_FILTER,
+        "depth_step": DEPTH_STEP if INGEST_CHUNK_ROWS <= 0 else None,
+        "pyramid_levels": PYRAMID_LEVELS,
+        "pyramid_min_width": PYRAMID_MIN_WIDTH,
+        "store": IMAGE_STORE_BACKEND,
+        "storage_mode": IMAGE_STORAGE_MODE,
+    }
+    digest = hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8"))
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def seed_database(database_service: ImageStore) -> bool:
+    """
+    Seed the image store from SEED_FILE, once per deployment and only when the file or the settings
+    shaping the image changed since the last seed.
+
+    The first worker to claim the seed loads the image while the others wait for it to finish.
+    The claim is renewed from a heartbeat thread during the whole load, so that a load running
+    longer than SEED_CLAIM_TIMEOUT is not taken over by another worker.
+    Returns whether this worker loaded the image.
+    """
+    fingerprint = seed_fingerprint(SEED_FILE)
+    while True:
+        claim = database_service.claim_seed(SEED_IMAGE_NAME, fingerprint, stale_after=SEED_CLAIM_TIMEOUT)
+        if claim == SEED_READY:
+            logger.info("Seed image is up to date, skipping the seed.")
+            return False
+        if claim == SEED_CLAIMED:
+            break
+        logger.info("Another worker is seeding the image, waiting for it...")
+        time.sleep(SEED_POLL_INTERVAL)
+
+    try:
+        with heartbeat(
+            lambda: database_service.refresh_seed(SEED_IMAGE_NAME, fingerprint), SEED_CLAIM_TIMEOUT / 4
+        ):
+            load_seed_file(database_service)
+    except BaseException:
+        database_service.finish_seed(SEED_IMAGE_NAME, fingerprint, success=False)
+        raise
+    database_service.finish_seed(SEED_IMAGE_NAME, fingerprint, success=True)
+    return True
+
+
+def load_seed_file(database_service: ImageStore) -> None:
+    """
+    Clean the image data and load it into the database.
+    """
+    data_cleaner = ImageProcessingService(SEED_FILE)
+    if INGEST_CHUNK_ROWS > 0:
+        stream_seed_image(database_service, data_cleaner)
+        return
+
     cleaned_data: pd.DataFrame = data_cleaner.clean_data()
 
-    image_depth_identifier = cleaned_data["depth"]
-    cleaned_data = cleaned_data.drop(columns=["depth"])
+    # Pandas stops at the CSV boundary, the rest of the pipeline works on uint8 arrays
+    depths, pixels = data_cleaner.frame_to_arrays(cleaned_data)
+    store_resized_image(database_service, image_name=SEED_IMAGE_NAME, depths=depths, pixels=pixels)
 
-    image = data_cleaner.dataframe_to_image(cleaned_data)
 
-    resized_image = data_cleaner.resize_image(image, new_width=150)
-    resized_data = data_cleaner.image_to_dataframe(resized_image)
+def stream_seed_image(database_service: ImageStore, data_cleaner: ImageProcessingService) -> None:
+    """
+    Load the image data into the database in chunks of INGEST_CHUNK_ROWS rows, with bounded memory.
 
-    resized_data["depth"] = image_depth_identifier
-    resized_data["image_name"] = "test_image"
-    database_service = DatabaseService()
-    database_service.insert_data(table_name="images", dataframe=resized_data)
-    logger.info("Startup complete.! Image loaded to database successfully.")
+    Chunks are parsed, cleaned, resized and turned into pyramid levels in a background thread while
+    the previous chunk is being written. Rows are resampled in width only, so every chunk keeps its
+    depths; chunks hold a multiple of 2 ** (PYRAMID_LEVELS - 1) rows so that each can be halved
+    on its own into the same pyramid as the whole image. DEPTH_STEP does not apply here.
+    """
+    if DEPTH_STEP:
+        logger.warning("DEPTH_STEP is ignored when seeding in chunks, rows keep their CSV depths.")
 
+    def build_chunk(depths: np.ndarray, pixels: np.ndarray) -> List[Tuple[np.ndarray, np.ndarray]]:
+        depths, pixels = ImageProcessingService.resample(
+            pixels, depths, width=stored_width(pixels), method=RESAMPLING_FILTER
+        )
+        return ImageProcessingService.build_pyramid(
+            pixels, depths, levels=PYRAMID_LEVELS, min_width=PYRAMID_MIN_WIDTH
+        )
 
-@app.get("/image-depth-range", response_model=ImageDepthRangeResponse)
-async def get_image_data(request: ImageDepthRangeRequest) -> ImageDepthRangeResponse:
+    block_rows = 2 ** (PYRAMID_LEVELS - 1)
+    chunks = (
+        build_chunk(depths, pixels)
+        for depths, pixels in data_cleaner.iter_image_chunks(INGEST_CHUNK_ROWS, block_rows=block_rows)
+    )
+    stats = database_service.store_pyramid_chunks(
+        image_name=SEED_IMAGE_NAME, chunks=prefetch(chunks), table_name="images"
+    )
+    logger.info("Streamed image into the database: %s", stats)
+
+
+async def startup_event(database_service: ImageStore, executor: BlockingExecutor, state: Any) -> None:
     """
-    This endpoint fetches image data from the database based on the depth range and colormap provided in the request.
+    This function is executed at the startup of the FastAPI application.
+    It seeds the image store unless it is up to date, and records the outcome for /health.
+    """
+    state.seed_status = "seeding"
+    try:
+        seeded = await executor.run(seed_database, database_service)
+    except Exception as exc:
+        state.seed_status = "failed"
+        state.seed_error = str(exc)
+        raise
+    # The seed replaced the image, whichever worker wrote it, so this worker's caches of it are stale
+    state.response_cache.invalidate(SEED_IMAGE_NAME)
+    if state.tile_cache is not None:
+        state.tile_cache.invalidate("images", SEED_IMAGE_NAME)
+    state.seed_status = "ready"
+    if seeded:
+        logger.info("Startup complete.! Image loaded to database successfully.")
+    else:
+        logger.info("Startup complete.! Image already up to date.")
+
+
+async def background_startup(database_service: ImageStore, executor: BlockingExecutor, state: Any) -> None:
+    """
+    Run the startup seed while the application serves, logging its failure instead of stopping the worker.
+    """
+    try:
+        await startup_event(database_service, executor, state)
+    except Exception as exc:  # pylint: disable=broad-except
+        logger.error(f"Error occurred while seeding the image store: {exc}")
+
+
+@asynccontextmanager
+async def lifespan(application: FastAPI) -> AsyncIterator[None]:
+    """
+    Create the worker-wide database engine, thread pool, ingest job pool, tile cache, response cache and
+    colormap registry, seed the database and release the engine and thread pools on shutdown.
+    """
+    application.state.colormaps = get_colormap_registry()
+    if COLORMAPS_FILE:
+        names = application.state.colormaps.load_file(COLORMAPS_FILE)
+        logger.info("Registered colormaps %s from %s.", ", ".join(names), COLORMAPS_FILE)
+    application.state.db_engine = create_db_engine() if IMAGE_STORE_BACKEND == "database" else None
+    application.state.tile_cache = (
+        DepthTileCache(tile_depth=TILE_DEPTH, max_bytes=TILE_CACHE_MAX_BYTES, ttl=TILE_CACHE_TTL)
+        if TILE_CACHE_MAX_BYTES > 0
+        else None
+    )
+    application.state.response_cache = LRUCache(
+        max_bytes=RESPONSE_CACHE_MAX_BYTES, ttl=RESPONSE_CACHE_TTL
+    )
+    application.state.executor = BlockingExecutor(
+        max_workers=BLOCKING_WORKERS,
+        max_pending=BLOCKING_QUEUE_SIZE,
+        queue_timeout=BLOCKING_QUEUE_TIMEOUT,
+    )
+    application.state.ingest_jobs = IngestJobManager(
+        max_workers=INGEST_JOB_WORKERS,
+        max_pending=INGEST_JOB_QUEUE_SIZE,
+        max_finished=INGEST_JOBS_KEPT,
+    )
+    try:
+        application.state.seed_status = "pending"
+        application.state.seed_error = None
+        seed_task = None
+        if SEED_IN_BACKGROUND:
+            seed_task = asyncio.create_task(
+                background_startup(
+                    create_image_store(application.state), application.state.executor, application.state
+                )
+            )
+        else:
+            await startup_event(
+                create_image_store(application.state), application.state.executor, application.state
+            )
+        yield
+        if seed_task is not None:
+            seed_task.cancel()
+    finally:
+        application.state.ingest_jobs.shutdown()
+        application.state.executor.shutdown()
+        if application.state.db_engine is not None:
+            application.state.db_engine.dispose()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
+profile_store = ProfileStore(PROFILE_DIR, PROFILE_MAX_FILES)
+app.add_middleware(
+    ProfilingMiddleware, store=profile_store, token=PROFILE_TOKEN, sample_rate=PROFILE_SAMPLE_RATE
+)
+
+
+def create_image_store(state: Any) -> ImageStore:
+    """
+    Build the image store selected by IMAGE_STORE_BACKEND from the worker-wide application state.
+
+    The memmap store reads slices of memory-mapped files, so it needs neither the database engine
+    nor the tile cache.
+    """
+    if IMAGE_STORE_BACKEND == "memmap":
+        return MemmapImageStore(root=MEMMAP_STORE_PATH, colormaps=state.colormaps)
+    if IMAGE_STORE_BACKEND != "database":
+        raise DatabaseServiceError(f"Unknown image store backend: {IMAGE_STORE_BACKEND}.")
+    return DatabaseService(
+        engine=state.db_engine,
+        tile_cache=state.tile_cache,
+        colormaps=state.colormaps,
+    )
+
+
+def get_database_service(request: Request) -> ImageStore:
     """
-    database_service = DatabaseService()
-    logger.info("Fetching image data from database...")
+    FastAPI dependency handing out the image store: a DatabaseService bound to the worker-wide pooled
+    engine, tile cache and colormap registry, unless IMAGE_STORE_BACKEND selects the memmap store.
+    """
+    return create_image_store(request.app.state)
+
+
+def get_executor(request: Request) -> BlockingExecutor:
+    """
+    FastAPI dependency handing out the worker-wide thread pool for blocking work.
+    """
+    return request.app.state.executor
+
+
+def get_ingest_jobs(request: Request) -> IngestJobManager:
+    """
+    FastAPI dependency handing out the worker-wide pool of background ingest jobs.
+    """
+    return request.app.state.ingest_jobs
+
+
+def get_response_cache(request: Request) -> LRUCache:
+    """
+    FastAPI dependency handing out the worker-wide cache of rendered depth ranges.
+    """
+    return request.app.state.response_cache
+
+
+def get_colormaps(request: Request) -> ColormapRegistry:
+    """
+    FastAPI dependency handing out the worker-wide colormap registry.
+    """
+    return request.app.state.colormaps
+
+
+def render_image(
+    database_service: ImageStore, request: ImageDepthRangeRequest, image_format: str = "json"
+) -> Tuple[Union[str, bytes], Tuple[int, ...]]:
+    """
+    Fetch the colorized image of a depth range, from the smallest pyramid level that satisfies
+    the requested output size, and encode it in the response format.
+
+    Returns the payload, base64 text for JSON responses and bytes otherwise, and the image shape.
+    """
+    level = database_service.select_level(
+        image_name=request.image_name,
+        depth_min=request.depth_min,
+        depth_max=request.depth_max,
+        target_height=request.target_height,
+        target_width=request.target_width,
+    )
     image = database_service.get_image_data(
         depth_min=request.depth_min,
         depth_max=request.depth_max,
         colormap=request.colormap,
         image_name=request.image_name,
+        level=level,
+    )
+    return encode_rendered(image, image_format, request.colormap), image.shape
+
+
+def encode_rendered(image: np.ndarray, image_format: str, colormap: str) -> Union[str, bytes]:
+    """
+    Encode a colorized image in a response format: base64 text of its pixels for JSON, bytes otherwise.
+    Stored color images returned by the RAW colormap are RGB(A), and are encoded as such in PNG and WebP.
+    """
+    if image_format == "json":
+        # Encoding the image data in base64
+        with stage_timer("base64") as measure:
+            payload = base64.b64encode(image.tobytes()).decode("utf-8")
+            measure["size"] = (image.shape[0], len(payload))
+        return payload
+    return ImageProcessingService.encode_image(
+        image,
+        image_format,
+        png_compression=PNG_COMPRESSION,
+        webp_quality=WEBP_QUALITY,
+        rgb=channel_order(colormap, image.shape).startswith("RGB"),
     )
 
-    # Encoding the image data in base64
-    encoded_image = base64.b64encode(image.tobytes()).decode("utf-8")
 
-    return ImageDepthRangeResponse(image=encoded_image)
+def response_cache_key(request: ImageDepthRangeRequest, image_format: str) -> Tuple[Any, ...]:
+    """
+    Key a rendered depth range in the response cache, by its resolved colormap.
+    """
+    return (
+        request.image_name,
+        request.depth_min,
+        request.depth_max,
+        request.colormap,
+        request.target_height,
+        request.target_width,
+        image_format,
+    )
 
 
-@app.post("/upload-image", response_model=ImageDataFrameResponse)
-async def upload_image(request: DataFrameRequest) -> ImageDataFrameResponse:
+def render_batch_group(
+    database_service: ImageStore,
+    image_name: str,
+    windows: List[Tuple[int, ImageDepthRangeRequest]],
+    image_format: str,
+) -> List[Tuple[int, Union[Tuple[Union[str, bytes], Tuple[int, ...]], Exception]]]:
+    """
+    Render depth windows of one image with as few range queries as possible.
+
+    The pyramid level of every window is picked from a single read of the image levels, then the
+    overlapping windows of each level are merged into one range query and cut back out of its rows.
+
+    Returns the index of every window with its payload and shape, or with the error it failed with.
+    """
+    levels = None
+    windows_by_level: Dict[int, List[Tuple[int, ImageDepthRangeRequest]]] = {}
+    for index, window in windows:
+        level = 0
+        if window.target_height is not None or window.target_width is not None:
+            if levels is None:
+                levels = database_service.image_levels(image_name)
+            level = pick_level(
+                levels, window.depth_min, window.depth_max, window.target_height, window.target_width
+            )
+        windows_by_level.setdefault(level, []).append((index, window))
+
+    results = []
+    for level, level_windows in windows_by_level.items():
+        ranges = merge_depth_windows([(window.depth_min, window.depth_max) for _, window in level_windows])
+        for depth_min, depth_max, members in ranges:
+            depths, pixels = database_service.load_image(image_name, depth_min, depth_max, level=level)
+            for member in members:
+                index, window = level_windows[member]
+                # Rows come back sorted by depth, so every window is a slice of the merged range
+                start = np.searchsorted(depths, window.depth_min, side="left")
+                stop = np.searchsorted(depths, window.depth_max, side="right")
+                if start >= stop:
+                    results.append((index, DatabaseQueryError(
+                        "Failed to get image data: No data found for the provided depth range."
+                    )))
+                    continue
+                image = database_service.colormaps.apply(pixels[start:stop], window.colormap)
+                results.append((index, (encode_rendered(image, image_format, window.colormap), image.shape)))
+    return results
+
+
+def render_strips(
+    database_service: ImageStore, request: ImageDepthRangeRequest, level: int
+) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Stream the colorized image of a depth range in strips of STREAM_STRIP_ROWS rows, with their depths.
+    """
+    for depths, pixels in database_service.iter_image(
+        image_name=request.image_name,
+        depth_min=request.depth_min,
+        depth_max=request.depth_max,
+        level=level,
+        strip_rows=STREAM_STRIP_ROWS,
+    ):
+        yield depths, database_service.colormaps.apply(pixels, request.colormap)
+
+
+def strip_chunk(strip: Tuple[np.ndarray, np.ndarray], image_format: str) -> bytes:
+    """
+    Encode a colorized strip as a chunk of the streamed body: its pixels, or a line of JSON.
+    """
+    depths, image = strip
+    if image_format == "raw":
+        return image.tobytes()
+    line = {
+        "depth_min": float(depths[0]),
+        "depth_max": float(depths[-1]),
+        "image": base64.b64encode(image.tobytes()).decode("utf-8"),
+        "shape": list(image.shape),
+    }
+    return (json.dumps(line) + "\n").encode("utf-8")
+
+
+BATCH_ERROR_STATUS = {
+    DatabaseQueryError: 400,
+    ColorMapError: 400,
+    ServiceBusyError: 503,
+}
+
+
+def batch_line(index: int, rendered: Union[Tuple[Union[str, bytes], Tuple[int, ...]], Exception]) -> bytes:
+    """
+    Serialize the result of one batch window as a line of newline-delimited JSON.
+
+    Binary payloads are base64-encoded; failed windows carry the HTTP status the single-window
+    endpoint would have answered with.
+    """
+    if isinstance(rendered, Exception):
+        status = next(
+            (code for error, code in BATCH_ERROR_STATUS.items() if isinstance(rendered, error)), 500
+        )
+        line = {"index": index, "status": status, "message": str(rendered)}
+    else:
+        payload, shape = rendered
+        if isinstance(payload, bytes):
+            payload = base64.b64encode(payload).decode("utf-8")
+        line = {"index": index, "image": payload, "shape": list(shape)}
+    return (json.dumps(line) + "\n").encode("utf-8")
+
+
+RESPONSE_MEDIA_TYPES = {
+    "json": "application/json",
+    "png": "image/png",
+    "webp": "image/webp",
+    "raw": "application/octet-stream",
+}
+
+
+def channel_order(colormap: str, shape: Tuple[int, ...]) -> str:
+    """
+    Name the channel order of a rendered image: colorized images are BGR, stored color images RGB(A).
+    """
+    if len(shape) == 2 or shape[2] == 1:
+        return "GRAY"
+    if colormap == RAW:
+        return "RGBA" if shape[2] == 4 else "RGB"
+    return "BGR"
+
+
+def negotiate_format(accept: Optional[str]) -> str:
+    """
+    Pick the response format of /image-depth-range from an Accept header, JSON by default.
+
+    Media types are tried by decreasing quality value, in header order on ties.
+    """
+    formats = {media_type: image_format for image_format, media_type in RESPONSE_MEDIA_TYPES.items()}
+    candidates = []
+    for position, item in enumerate((accept or "").split(",")):
+        media_type, *params = [part.strip() for part in item.split(";")]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if media_type.lower() in formats and quality > 0:
+            candidates.append((-quality, position, formats[media_type.lower()]))
+    return min(candidates)[2] if candidates else "json"
+
+
+def store_uploaded_image(database_service: ImageStore, data: Dict[str, List[Any]]) -> str:
+    """
+    Resize an uploaded image, store it in the database and return its name.
+    """
+    # Convert the request columns straight into the depths and uint8 pixel rows
+    depths, pixels = ImageProcessingService.columns_to_arrays(data)
+
+    # Store the image with its name (taken from the first row as it is consistent)
+    image_name = str(data["image_name"][0])
+    store_resized_image(database_service, image_name, depths, pixels)
+    return image_name
+
+
+def decode_binary_image(
+    body: bytearray,
+    image_format: str,
+    width: Optional[int],
+    channels: int,
+    depth_count: Optional[int],
+    depth_start: Optional[float],
+    depth_step: Optional[float],
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Decode a binary upload into its depths and pixel rows.
+
+    The depths either lead the body as depth_count little-endian float64 values, or are sampled
+    regularly from depth_start every depth_step.
+    """
+    if depth_count is not None:
+        depths, body = ImageProcessingService.split_depths(body, depth_count)
+    pixels = ImageProcessingService.decode_image(body, image_format, width=width, channels=channels)
+    if depth_count is None:
+        if depth_start is None or depth_step is None:
+            raise ImageProcessingError("Either depth_count or both depth_start and depth_step are required.")
+        depths = depth_start + depth_step * np.arange(pixels.shape[0], dtype=np.float64)
+    if len(depths) != pixels.shape[0]:
+        raise ImageProcessingError(
+            f"Got {len(depths)} depths for an image of {pixels.shape[0]} pixel rows."
+        )
+    return depths, pixels
+
+
+def store_binary_image(
+    database_service: ImageStore,
+    body: bytearray,
+    image_name: str,
+    image_format: str,
+    width: Optional[int],
+    channels: int,
+    depth_count: Optional[int],
+    depth_start: Optional[float],
+    depth_step: Optional[float],
+) -> int:
+    """
+    Decode a binary upload, store it in the database and return its number of pixel rows.
+    """
+    depths, pixels = decode_binary_image(
+        body, image_format, width, channels, depth_count, depth_start, depth_step
+    )
+    store_resized_image(database_service, image_name, depths, pixels)
+    return pixels.shape[0]
+
+
+def ingest_image_job(
+    job: IngestJob,
+    database_service: ImageStore,
+    response_cache: LRUCache,
+    decode: Callable[..., Tuple[np.ndarray, np.ndarray]],
+    *args: Any,
+) -> None:
+    """
+    Decode, resize and store an uploaded image in the background, reporting progress to its job.
+
+    The pyramid is written INGEST_JOB_CHUNK_ROWS full-resolution rows per transaction under a staging
+    name and swapped in at the end, so readers keep seeing the previous image until the job succeeds.
+    """
+    job.set_stage("decode")
+    depths, pixels = decode(*args)
+    job.set_stage("resample")
+    depths, pixels = resize_image(depths, pixels)
+    job.set_stage("pyramid")
+    pyramid = ImageProcessingService.build_pyramid(
+        pixels, depths, levels=PYRAMID_LEVELS, min_width=PYRAMID_MIN_WIDTH
+    )
+    job.start_writing(sum(len(level_depths) for level_depths, _ in pyramid))
+
+    def chunks() -> Iterator[List[Tuple[np.ndarray, np.ndarray]]]:
+        for chunk in ImageProcessingService.split_pyramid(pyramid, INGEST_JOB_CHUNK_ROWS):
+            yield chunk
+            # The store asks for the next chunk once the previous one is written
+            job.add_rows(sum(len(level_depths) for level_depths, _ in chunk))
+        job.set_stage("swap")
+
+    database_service.store_pyramid_chunks(image_name=job.image_name, chunks=chunks(), table_name="images")
+    response_cache.invalidate(job.image_name)
+
+
+def queue_ingest_job(
+    ingest_jobs: IngestJobManager,
+    image_name: str,
+    database_service: ImageStore,
+    response_cache: LRUCache,
+    decode: Callable[..., Tuple[np.ndarray, np.ndarray]],
+    *args: Any,
+) -> JSONResponse:
+    """
+    Queue the ingest of an upload and answer 202 with the job id and its status URL.
+    """
+    job = ingest_jobs.submit(image_name, ingest_image_job, database_service, response_cache, decode, *args)
+    status_url = f"/ingest-jobs/{job.job_id}"
+    content = IngestJobResponse(
+        message=f"Queued the ingest of {image_name}.", job_id=job.job_id, status_url=status_url
+    )
+    return JSONResponse(status_code=202, content=content.model_dump(), headers={"Location": status_url})
+
+
+async def read_body(request: Request, max_bytes: int) -> bytearray:
+    """
+    Read a request body as it streams in, into a single buffer sized from its Content-Length.
+
+    Raises:
+        UploadTooLargeError: If the body exceeds max_bytes.
+    """
+    content_length = request.headers.get("content-length")
+    expected = int(content_length) if content_length and content_length.isdigit() else None
+    if expected is not None and expected > max_bytes:
+        raise UploadTooLargeError(f"The body of {expected} bytes exceeds the {max_bytes}-byte limit.")
+
+    body = bytearray(expected or 0)
+    received = 0
+    async for chunk in request.stream():
+        if received + len(chunk) > max_bytes:
+            raise UploadTooLargeError(f"The body exceeds the {max_bytes}-byte limit.")
+        if received + len(chunk) <= len(body):
+            body[received:received + len(chunk)] = chunk
+        else:
+            del body[received:]
+            body += chunk
+        received += len(chunk)
+    del body[received:]
+    return body
+
+
+@app.get("/image-depth-range", response_model=ImageDepthRangeResponse)
+async def get_image_data(
+    request: ImageDepthRangeRequest,
+    image_format: Optional[str] = Query(default=None, alias="format", pattern="^(json|png|webp|raw)$"),
+    accept: Optional[str] = Header(default=None),
+    database_service: ImageStore = Depends(get_database_service),
+    executor: BlockingExecutor = Depends(get_executor),
+    response_cache: LRUCache = Depends(get_response_cache),
+    colormaps: ColormapRegistry = Depends(get_colormaps),
+) -> Union[ImageDepthRangeResponse, Response]:
+    """
+    This endpoint fetches image data from the database based on the depth range and colormap provided in the request.
+
+    The image is returned in base64 inside JSON by default, or as a binary PNG, WebP or raw body when
+    asked for by the format query parameter or the Accept header. Raw bodies carry their shape in the
+    X-Image-Shape header. The GRAYSCALE and RAW colormaps return the stored values uncolorized.
+    """
+    image_format = image_format or negotiate_format(accept)
+    request.colormap = colormaps.resolve(request.colormap)
+    cache_key = response_cache_key(request, image_format)
+    rendered = response_cache.get(cache_key)
+    if rendered is None:
+        generation = response_cache.generation(request.image_name)
+        logger.info("Fetching image data from database...")
+        rendered = await executor.run(render_image, database_service, request, image_format)
+        response_cache.put(
+            cache_key,
+            rendered,
+            size=len(rendered[0]),
+            tag=request.image_name,
+            generation=generation,
+        )
+
+    payload, shape = rendered
+    if image_format == "json":
+        return ImageDepthRangeResponse(image=payload, shape=list(shape))
+    return Response(
+        content=payload,
+        media_type=RESPONSE_MEDIA_TYPES[image_format],
+        headers={
+            "X-Image-Shape": ",".join(str(size) for size in shape),
+            "X-Image-Dtype": "uint8",
+            "X-Image-Channel-Order": channel_order(request.colormap, shape),
+            "Vary": "Accept",
+        },
+    )
+
+
+@app.get("/image-depth-range/stream")
+async def stream_image_data(
+    request: ImageDepthRangeRequest,
+    image_format: str = Query(default="raw", alias="format", pattern="^(raw|json)$"),
+    database_service: ImageStore = Depends(get_database_service),
+    executor: BlockingExecutor = Depends(get_executor),
+    colormaps: ColormapRegistry = Depends(get_colormaps),
+) -> StreamingResponse:
+    """
+    This endpoint streams the image of a depth range strip by strip, for ranges too deep to render at once.
+
+    Rows are read and colorized in strips of STREAM_STRIP_ROWS rows, one query per strip, each sent as
+    soon as it is ready in a chunked response, so memory stays bounded whatever the range. The body is raw
+    uint8 pixels, row-major, with an X-Image-Shape header whose height is -1, or with format=json
+    newline-delimited JSON with one {"depth_min", "depth_max", "image", "shape"} line per strip.
+    Streamed ranges are not cached.
+    """
+    request.colormap = colormaps.resolve(request.colormap)
+    level = await executor.run(
+        database_service.select_level,
+        request.image_name,
+        request.depth_min,
+        request.depth_max,
+        request.target_height,
+        request.target_width,
+    )
+    # The strips are read and closed by a single pool thread, which releases their connection
+    # before the response ends, even when the client goes away early
+    strips = executor.iterate(render_strips(database_service, request, level))
+    # The first strip is read before answering, so that errors still get a proper status code
     try:
-        # Convert the request data into a DataFrame
-        df = pd.DataFrame(request.data)
+        first = await strips.__anext__()
+    except StopAsyncIteration:
+        raise DatabaseQueryError("Failed to get image data: No data found for the provided depth range.") from None
+    except BaseException:
+        await strips.aclose()
+        raise
+
+    async def chunks() -> AsyncIterator[bytes]:
+        try:
+            yield strip_chunk(first, image_format)
+            async for strip in strips:
+                yield strip_chunk(strip, image_format)
+        except Exception as exc:
+            # The status line has been sent, all that is left is cutting the body short
+            logger.error(f"Error occurred while streaming {request.image_name}: {exc}")
+            raise
+        finally:
+            await strips.aclose()
+
+    shape = first[1].shape
+    if image_format == "json":
+        return StreamingResponse(chunks(), media_type="application/x-ndjson")
+    return StreamingResponse(
+        chunks(),
+        media_type=RESPONSE_MEDIA_TYPES["raw"],
+        headers={
+            "X-Image-Shape": ",".join(str(size) for size in (-1,) + shape[1:]),
+            "X-Image-Dtype": "uint8",
+            "X-Image-Channel-Order": channel_order(request.colormap, shape),
+        },
+    )
+
 
-        # Convert the entire dataframe data into an image
-        image = ImageProcessingService.dataframe_to_image(df)
+@app.post("/image-depth-range/batch")
+async def get_image_data_batch(
+    request: ImageDepthRangeBatchRequest,
+    image_format: str = Query(default="json", alias="format", pattern="^(json|png|webp|raw)$"),
+    database_service: ImageStore = Depends(get_database_service),
+    executor: BlockingExecutor = Depends(get_executor),
+    response_cache: LRUCache = Depends(get_response_cache),
+    colormaps: ColormapRegistry = Depends(get_colormaps),
+) -> StreamingResponse:
+    """
+    This endpoint renders many depth windows, of one or several images, in a single call.
+
+    Windows already in the response cache are answered first. The others are grouped per image, and
+    overlapping windows of an image share a single range query. Results are streamed as
+    newline-delimited JSON in completion order, one line per window with its index in the request:
+    {"index", "image", "shape"} with the image base64-encoded in the requested format, or
+    {"index", "status", "message"} when the window failed.
+    """
 
-        # Resize the image
-        resized_image = ImageProcessingService.resize_image(image, new_width=150)
+    async def lines() -> AsyncIterator[bytes]:
+        pending: Dict[str, List[Tuple[int, ImageDepthRangeRequest]]] = {}
+        for index, window in enumerate(request.windows):
+            try:
+                window.colormap = colormaps.resolve(window.colormap)
+            except ColorMapError as exc:
+                yield batch_line(index, exc)
+                continue
+            rendered = response_cache.get(response_cache_key(window, image_format))
+            if rendered is not None:
+                yield batch_line(index, rendered)
+            else:
+                pending.setdefault(window.image_name, []).append((index, window))
 
-        # Convert the resized image back to a dataframe
-        resized_data_df = ImageProcessingService.image_to_dataframe(resized_image)
+        for image_name, windows in pending.items():
+            generation = response_cache.generation(image_name)
+            logger.info("Fetching %d windows of %s from database...", len(windows), image_name)
+            try:
+                results = await executor.run(
+                    render_batch_group, database_service, image_name, windows, image_format
+                )
+            except Exception as exc:  # pylint: disable=broad-except
+                # The response has started, so errors are reported per window
+                logger.error(f"Error occurred while rendering windows of {image_name}: {exc}")
+                for index, _ in windows:
+                    yield batch_line(index, exc)
+                continue
+            for index, rendered in results:
+                if not isinstance(rendered, Exception):
+                    response_cache.put(
+                        response_cache_key(request.windows[index], image_format),
+                        rendered,
+                        size=len(rendered[0]),
+                        tag=image_name,
+                        generation=generation,
+                    )
+                yield batch_line(index, rendered)
 
-        # Assign the image name and depth (taken from the first row as they are consistent)
-        resized_data_df["image_name"] = df["image_name"][0]
-        resized_data_df["depth"] = df["depth"][0]
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
 
-        # Store the resized image data in the database
-        database_service = DatabaseService()
-        database_service.insert_data(table_name="images", dataframe=resized_data_df)
+
+@app.post("/upload-image", response_model=ImageDataFrameResponse)
+async def upload_image(
+    request: DataFrameRequest,
+    job: bool = Query(default=False),
+    database_service: ImageStore = Depends(get_database_service),
+    executor: BlockingExecutor = Depends(get_executor),
+    ingest_jobs: IngestJobManager = Depends(get_ingest_jobs),
+    response_cache: LRUCache = Depends(get_response_cache),
+) -> Union[ImageDataFrameResponse, JSONResponse]:
+    """
+    This endpoint stores an image uploaded as columns. With job=true it answers 202 right away and
+    the image is stored by a background ingest job, followed at /ingest-jobs/{job_id}.
+    """
+    if job:
+        if not request.data.get("image_name"):
+            raise ImageProcessingError("The image_name column is required.")
+        return queue_ingest_job(
+            ingest_jobs,
+            str(request.data["image_name"][0]),
+            database_service,
+            response_cache,
+            ImageProcessingService.columns_to_arrays,
+            request.data,
+        )
+    try:
+        image_name = await executor.run(store_uploaded_image, database_service, request.data)
+        response_cache.invalidate(image_name)
 
         return ImageDataFrameResponse(
             message="Data uploaded and stored successfully.", success=True
         )
+    except ServiceBusyError:
+        raise
     except Exception as e:
         logger.error(f"Error occurred while uploading dataframe data: {e}")
         return ImageDataFrameResponse(message=f"Error occurred: {e}", success=False)
 
 
+UPLOAD_FORMATS = {
+    "application/octet-stream": "raw",
+    "application/x-npy": "npy",
+    "image/png": "png",
+    "image/webp": "webp",
+}
+
+
+@app.post("/upload-image-binary", response_model=ImageDataFrameResponse)
+async def upload_image_binary(
+    request: Request,
+    image_name: str = Query(...),
+    image_format: Optional[str] = Query(default=None, alias="format", pattern="^(raw|npy|png|webp)$"),
+    width: Optional[int] = Query(default=None, gt=0),
+    channels: int = Query(default=1, gt=0),
+    depth_count: Optional[int] = Query(default=None, ge=0),
+    depth_start: Optional[float] = None,
+    depth_step: Optional[float] = Query(default=None, gt=0),
+    job: bool = Query(default=False),
+    database_service: ImageStore = Depends(get_database_service),
+    executor: BlockingExecutor = Depends(get_executor),
+    ingest_jobs: IngestJobManager = Depends(get_ingest_jobs),
+    response_cache: LRUCache = Depends(get_response_cache),
+) -> Union[ImageDataFrameResponse, JSONResponse]:
+    """
+    This endpoint stores an image uploaded as a binary body, decoded without per-pixel validation.
+
+    The body is a raw uint8 buffer, a uint8 .npy array or a PNG/WebP image, as given by the format
+    query parameter or else the Content-Type header, optionally preceded by its depth vector.
+    With job=true it answers 202 once the body is received, and a background ingest job stores it.
+    """
+    if image_format is None:
+        content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+        image_format = UPLOAD_FORMATS.get(content_type)
+        if image_format is None:
+            raise ImageProcessingError(f"Unsupported content type: {content_type or 'none'}.")
+
+    body = await read_body(request, UPLOAD_MAX_BYTES)
+    if job:
+        return queue_ingest_job(
+            ingest_jobs,
+            image_name,
+            database_service,
+            response_cache,
+            decode_binary_image,
+            body,
+            image_format,
+            width,
+            channels,
+            depth_count,
+            depth_start,
+            depth_step,
+        )
+    rows = await executor.run(
+        store_binary_image,
+        database_service,
+        body,
+        image_name,
+        image_format,
+        width,
+        channels,
+        depth_count,
+        depth_start,
+        depth_step,
+    )
+    response_cache.invalidate(image_name)
+
+    return ImageDataFrameResponse(message=f"Stored {rows} pixel rows of {image_name}.")
+
+
+@app.get("/ingest-jobs", response_class=JSONResponse)
+async def list_ingest_jobs(ingest_jobs: IngestJobManager = Depends(get_ingest_jobs)) -> JSONResponse:
+    """
+    This endpoint lists the running, queued and recently finished ingest jobs of the worker, newest first.
+    """
+    return JSONResponse(status_code=200, content={"jobs": ingest_jobs.list()})
+
+
+@app.get("/ingest-jobs/{job_id}", response_class=JSONResponse)
+async def get_ingest_job(
+    job_id: str, ingest_jobs: IngestJobManager = Depends(get_ingest_jobs)
+) -> JSONResponse:
+    """
+    This endpoint reports the status, stage, rows written, progress and write throughput of an ingest job.
+    """
+    job = ingest_jobs.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"message": f"Ingest job {job_id} not found."})
+    return JSONResponse(status_code=200, content=job.snapshot())
+
+
 @app.get("/", response_class=JSONResponse)
 async def root() -> JSONResponse:
     """
@@ -122,11 +1058,127 @@ async def root() -> JSONResponse:
 
 
 @app.get("/health", response_class=JSONResponse)
-async def health_check() -> JSONResponse:
+async def health_check(request: Request) -> JSONResponse:
     """
     This endpoint checks the health status of the application.
+
+    It answers 503 until the image store is seeded, so that traffic is only routed to ready workers when
+    seeding in the background.
+    """
+    seed_status = getattr(request.app.state, "seed_status", "ready")
+    if seed_status == "ready":
+        return JSONResponse(status_code=200, content={"status": "OK", "seed": seed_status})
+    content = {"status": "UNAVAILABLE", "seed": seed_status}
+    if seed_status == "failed":
+        content["error"] = request.app.state.seed_error
+    return JSONResponse(status_code=503, content=content)
+
+
+@app.get("/db-pool-stats", response_class=JSONResponse)
+async def db_pool_stats(
+    database_service: ImageStore = Depends(get_database_service),
+) -> JSONResponse:
+    """
+    This endpoint returns connection pool checkout and wait metrics of the worker.
+    """
+    pool_metrics = getattr(database_service, "pool_metrics", None)
+    if pool_metrics is None:
+        return JSONResponse(
+            status_code=404,
+            content={"message": f"The {IMAGE_STORE_BACKEND} image store has no connection pool."},
+        )
+    return JSONResponse(status_code=200, content=pool_metrics.snapshot())
+
+
+@app.get("/metrics")
+async def metrics() -> Response:
+    """
+    This endpoint returns the pipeline stage and HTTP request metrics of the worker, in the Prometheus
+    text format.
+    """
+    return Response(
+        content=get_metrics_registry().render(),
+        media_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+
+def profiles_forbidden(profile_token: Optional[str]) -> Optional[JSONResponse]:
+    """
+    Check the admin token of the profile endpoints. Profiles expose code paths and query text, so they
+    are not served at all unless PROFILE_TOKEN is set.
+
+    Args:
+        profile_token (str, optional): The X-Profile-Token header of the request.
+
+    Returns:
+        JSONResponse, optional: The 403 response when no token is configured or the token does not
+        match, None otherwise.
+    """
+    if not PROFILE_TOKEN:
+        return JSONResponse(status_code=403, content={"message": "Profiles are only served when PROFILE_TOKEN is set."})
+    if profile_token is None or not hmac.compare_digest(profile_token, PROFILE_TOKEN):
+        return JSONResponse(status_code=403, content={"message": "A valid X-Profile-Token header is required."})
+    return None
+
+
+@app.get("/profiles", response_class=JSONResponse)
+async def list_profiles(profile_token: Optional[str] = Header(default=None, alias="X-Profile-Token")) -> JSONResponse:
+    """
+    This endpoint lists the saved request profiles of the host, newest first.
+    """
+    forbidden = profiles_forbidden(profile_token)
+    if forbidden is not None:
+        return forbidden
+    return JSONResponse(status_code=200, content={"profiles": profile_store.list()})
+
+
+@app.get("/profiles/{profile_id}")
+async def get_profile(
+    profile_id: str,
+    format: str = Query(default="prof", pattern="^(prof|text)$"),
+    sort: str = Query(default="cumulative", pattern="^(cumulative|tottime|calls|ncalls)$"),
+    limit: int = Query(default=50, ge=1, le=1000),
+    profile_token: Optional[str] = Header(default=None, alias="X-Profile-Token"),
+) -> Response:
     """
-    return JSONResponse(status_code=200, content={"status": "OK"})
+    This endpoint downloads a saved request profile: the cProfile dump, loadable with pstats or
+    snakeviz, or with format=text the pstats report of its slowest functions.
+    """
+    forbidden = profiles_forbidden(profile_token)
+    if forbidden is not None:
+        return forbidden
+    path = profile_store.path(profile_id)
+    if path is None:
+        return JSONResponse(status_code=404, content={"message": f"Profile {profile_id} not found."})
+    if format == "text":
+        return PlainTextResponse(profile_store.report(profile_id, sort=sort, limit=limit) or "")
+    return FileResponse(path, media_type="application/octet-stream", filename=f"{profile_id}.prof")
+
+
+@app.get("/colormaps", response_class=JSONResponse)
+async def list_colormaps(colormaps: ColormapRegistry = Depends(get_colormaps)) -> JSONResponse:
+    """
+    This endpoint lists the colormaps accepted by /image-depth-range.
+    """
+    return JSONResponse(status_code=200, content={"colormaps": colormaps.names()})
+
+
+@app.get("/cache-stats", response_class=JSONResponse)
+async def cache_stats(
+    request: Request, response_cache: LRUCache = Depends(get_response_cache)
+) -> JSONResponse:
+    """
+    This endpoint returns the hit, miss and eviction counters of the rendered depth range cache
+    and of the depth tile cache.
+    """
+    tile_cache = request.app.state.tile_cache
+    return JSONResponse(
+        status_code=200,
+        content={
+            "responses": response_cache.stats(),
+            "tiles": tile_cache.tiles.stats() if tile_cache is not None else None,
+        },
+    )
 
 
 @app.exception_handler(DatabaseConnectionError)
@@ -207,3 +1259,43 @@ async def database_creation_error_handler(
         status_code=400,
         content={"message": f"Invalid colormap. {exc}."},
     )
+
+
+@app.exception_handler(ImageProcessingError)
+async def image_processing_error_handler(
+    request: Request, exc: ImageProcessingError
+) -> JSONResponse:
+    """
+    This function handles ImageProcessingError exceptions.
+    """
+    return JSONResponse(
+        status_code=400,
+        content={"message": f"Invalid image. {exc}"},
+    )
+
+
+@app.exception_handler(UploadTooLargeError)
+async def upload_too_large_error_handler(
+    request: Request, exc: UploadTooLargeError
+) -> JSONResponse:
+    """
+    This function handles UploadTooLargeError exceptions.
+    """
+    return JSONResponse(
+        status_code=413,
+        content={"message": f"Upload too large. {exc}"},
+    )
+
+
+@app.exception_handler(ServiceBusyError)
+async def service_busy_error_handler(
+    request: Request, exc: ServiceBusyError
+) -> JSONResponse:
+    """
+    This function handles ServiceBusyError exceptions.
+    """
+    return JSONResponse(
+        status_code=503,
+        content={"message": f"Service is busy, retry later. {exc}"},
+        headers={"Retry-After": "1"},
+    )
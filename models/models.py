@@ -1,6 +1,8 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+
+from services.config import BATCH_MAX_WINDOWS
 
 
 class ImageDataRow(BaseModel):
@@ -13,10 +15,17 @@ class ImageDepthRangeRequest(BaseModel):
     depth_max: float
     colormap: str = "COLORMAP_JET"
     image_name: str = "test_image"
+    target_height: Optional[int] = Field(default=None, gt=0)
+    target_width: Optional[int] = Field(default=None, gt=0)
+
+
+class ImageDepthRangeBatchRequest(BaseModel):
+    windows: List[ImageDepthRangeRequest] = Field(min_length=1, max_length=BATCH_MAX_WINDOWS)
 
 
 class ImageDepthRangeResponse(BaseModel):
     image: str
+    shape: Optional[List[int]] = None
 
 
 class DataFrameRequest(BaseModel):
@@ -25,3 +34,9 @@ class DataFrameRequest(BaseModel):
 
 class ImageDataFrameResponse(BaseModel):
     message: str
+
+
+class IngestJobResponse(BaseModel):
+    message: str
+    job_id: str
+    status_url: str
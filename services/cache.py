@@ -0,0 +1,190 @@
+"""Cache related module."""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Set
+
+
+class _Entry:
+    __slots__ = ("value", "size", "tag", "expires_at")
+
+    def __init__(self, value: Any, size: int, tag: Optional[Hashable], expires_at: Optional[float]):
+        self.value = value
+        self.size = size
+        self.tag = tag
+        self.expires_at = expires_at
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache bounded by the total size of its values, with an optional TTL.
+
+    Entries can carry a tag (e.g. an image name) so that every entry derived from the same
+    source can be invalidated at once. Each tag has a generation that invalidation bumps:
+    a value computed before an invalidation is refused by ``put`` when it is given the
+    generation read before the computation started.
+    """
+
+    def __init__(
+            self,
+            max_bytes: int,
+            ttl: Optional[float] = None,
+            clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Initialize a new instance of the LRUCache class.
+
+        Args:
+            max_bytes (int): The maximum total size of the cached values, in bytes.
+            ttl (float, optional): The seconds an entry stays valid. Entries never expire when omitted or 0.
+            clock (Callable[[], float]): The time source, in seconds.
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl if ttl else None
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._tags: Dict[Hashable, Set[Hashable]] = {}
+        self._generations: Dict[Hashable, int] = {}
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Get a cached value and mark it as most recently used.
+
+        Args:
+            key (Hashable): The cache key.
+
+        Returns:
+            The cached value, or None on a miss.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at is not None and entry.expires_at <= self._clock():
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.value
+
+    def put(
+            self,
+            key: Hashable,
+            value: Any,
+            size: int,
+            tag: Optional[Hashable] = None,
+            generation: Optional[int] = None,
+    ) -> bool:
+        """
+        Cache a value, evicting the least recently used entries to stay within max_bytes.
+
+        Args:
+            key (Hashable): The cache key.
+            value (Any): The value.
+            size (int): The size of the value, in bytes.
+            tag (Hashable, optional): The tag used for invalidation.
+            generation (int, optional): The tag generation the value was computed at.
+
+        Returns:
+            bool: Whether the value was cached. Values larger than max_bytes, and values
+            computed before their tag was invalidated, are not cached.
+        """
+        with self._lock:
+            if size > self.max_bytes:
+                return False
+            if generation is not None and generation != self._generations.get(tag, 0):
+                return False
+            if key in self._entries:
+                self._remove(key)
+            expires_at = self._clock() + self.ttl if self.ttl else None
+            self._entries[key] = _Entry(value, size, tag, expires_at)
+            self.current_bytes += size
+            if tag is not None:
+                self._tags.setdefault(tag, set()).add(key)
+            while self.current_bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+            return True
+
+    def generation(self, tag: Hashable) -> int:
+        """
+        Get the current generation of a tag.
+
+        Args:
+            tag (Hashable): The tag.
+
+        Returns:
+            int: The number of times the tag has been invalidated.
+        """
+        with self._lock:
+            return self._generations.get(tag, 0)
+
+    def invalidate(self, tag: Hashable) -> int:
+        """
+        Drop every entry carrying a tag.
+
+        Args:
+            tag (Hashable): The tag.
+
+        Returns:
+            int: The number of entries dropped.
+        """
+        with self._lock:
+            self._generations[tag] = self._generations.get(tag, 0) + 1
+            keys = self._tags.pop(tag, set())
+            for key in keys:
+                self._remove(key)
+            self.invalidations += len(keys)
+            return len(keys)
+
+    def clear(self) -> None:
+        """
+        Drop every entry.
+        """
+        with self._lock:
+            for tag in self._tags:
+                self._generations[tag] = self._generations.get(tag, 0) + 1
+            self._entries.clear()
+            self._tags.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Return the cache counters.
+
+        Returns:
+            Dict[str, float]: The cache statistics.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "current_bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+    def _remove(self, key: Hashable) -> None:
+        entry = self._entries.pop(key)
+        self.current_bytes -= entry.size
+        if entry.tag is not None:
+            keys = self._tags.get(entry.tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[entry.tag]
@@ -0,0 +1,230 @@
+"""Colormap registry module."""
+import json
+import threading
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+
+from exceptions.exceptions import ColorMapError
+from services.metrics import timed
+from services.parallel import map_strips
+
+# Colormaps returning the stored values instead of colorizing them
+GRAYSCALE = "GRAYSCALE"
+RAW = "RAW"
+PASSTHROUGH = (GRAYSCALE, RAW)
+
+_PREFIX = "COLORMAP_"
+
+
+class ColormapRegistry:
+    """
+    Registry of 256x3 colormap lookup tables, indexed by name.
+
+    It holds every OpenCV colormap plus user-defined ones, so colorizing is a single NumPy ``take``
+    of the pixel values into a table, and unknown names are rejected before any work is done.
+    Tables are in BGR order, like the output of ``cv2.applyColorMap``. The GRAYSCALE and RAW
+    colormaps skip colorizing: GRAYSCALE returns single-channel intensities and RAW the stored values.
+    """
+
+    def __init__(self):
+        """
+        Initialize a new instance of the ColormapRegistry class with the OpenCV colormaps.
+        """
+        self._lock = threading.Lock()
+        self._luts: Dict[str, np.ndarray] = {}
+        ramp = np.arange(256, dtype=np.uint8).reshape(256, 1)
+        for name in dir(cv2):
+            if name.startswith(_PREFIX) and isinstance(getattr(cv2, name), int):
+                lut = cv2.applyColorMap(ramp, getattr(cv2, name)).reshape(256, 3)
+                self._luts[name] = _read_only(lut)
+
+    def names(self) -> List[str]:
+        """
+        List the supported colormaps.
+
+        Returns:
+            List[str]: The colormap names, the passthrough ones first.
+        """
+        with self._lock:
+            return list(PASSTHROUGH) + sorted(self._luts)
+
+    def resolve(self, name: str) -> str:
+        """
+        Get the canonical name of a colormap, case-insensitive and with an optional COLORMAP_ prefix.
+
+        Args:
+            name (str): The colormap name, e.g. "COLORMAP_JET", "jet" or "grayscale".
+
+        Returns:
+            str: The canonical name.
+
+        Raises:
+            ColorMapError: If the colormap is not registered.
+        """
+        upper = name.strip().upper()
+        if upper in PASSTHROUGH:
+            return upper
+        with self._lock:
+            for candidate in (upper, _PREFIX + upper):
+                if candidate in self._luts:
+                    return candidate
+        raise ColorMapError(
+            "Unknown colormap {}, supported colormaps are listed at /colormaps.".format(name)
+        )
+
+    def lut(self, name: str) -> np.ndarray:
+        """
+        Get the lookup table of a colormap.
+
+        Args:
+            name (str): The colormap name.
+
+        Returns:
+            np.ndarray: The read-only 256x3 uint8 BGR table.
+
+        Raises:
+            ColorMapError: If the colormap is not registered or is a passthrough colormap.
+        """
+        name = self.resolve(name)
+        if name in PASSTHROUGH:
+            raise ColorMapError("The {} colormap has no lookup table.".format(name))
+        with self._lock:
+            return self._luts[name]
+
+    def register(self, name: str, colors: np.ndarray, rgb: bool = True) -> str:
+        """
+        Register a user-defined colormap.
+
+        Args:
+            name (str): The colormap name. The COLORMAP_ prefix is added when missing.
+            colors (np.ndarray): An Nx3 array of uint8 colors, N >= 2, from the lowest to the highest
+                value. Tables of other sizes than 256 are linearly interpolated to 256 entries.
+            rgb (bool): Whether the colors are in RGB order rather than BGR.
+
+        Returns:
+            str: The canonical name of the colormap.
+
+        Raises:
+            ColorMapError: If the name or the colors are invalid.
+        """
+        upper = name.strip().upper()
+        if not upper or upper in PASSTHROUGH:
+            raise ColorMapError("Invalid colormap name: {}.".format(name))
+        canonical = upper if upper.startswith(_PREFIX) else _PREFIX + upper
+
+        colors = np.asarray(colors)
+        if colors.ndim != 2 or colors.shape[1] != 3 or colors.shape[0] < 2:
+            raise ColorMapError("A colormap needs an Nx3 array of colors, got shape {}.".format(colors.shape))
+        if not np.isfinite(colors).all() or colors.min() < 0 or colors.max() > 255:
+            raise ColorMapError("Colormap colors must lie within 0..255.")
+        if colors.shape[0] != 256:
+            stops = np.linspace(0, 255, colors.shape[0])
+            colors = np.stack(
+                [np.interp(np.arange(256), stops, colors[:, channel]) for channel in range(3)], axis=1
+            )
+        lut = np.rint(colors).astype(np.uint8)
+        if rgb:
+            lut = lut[:, ::-1]
+
+        with self._lock:
+            self._luts[canonical] = _read_only(lut)
+        return canonical
+
+    def load_file(self, path: str) -> List[str]:
+        """
+        Register the user-defined colormaps of a JSON file mapping names to lists of RGB colors.
+
+        Args:
+            path (str): The path of the JSON file.
+
+        Returns:
+            List[str]: The canonical names of the registered colormaps.
+
+        Raises:
+            ColorMapError: If the file cannot be read or holds an invalid colormap.
+        """
+        try:
+            with open(path, encoding="utf-8") as file:
+                colormaps = json.load(file)
+        except (OSError, ValueError) as exc:
+            raise ColorMapError("Failed to read colormaps from {}: {}".format(path, exc)) from exc
+        if not isinstance(colormaps, dict):
+            raise ColorMapError("{} must map colormap names to lists of RGB colors.".format(path))
+        return [self.register(name, np.asarray(colors, dtype=np.float64)) for name, colors in colormaps.items()]
+
+    @timed("colorize")
+    def apply(self, pixels: np.ndarray, name: str, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Colorize uint8 pixel rows with a colormap.
+
+        Color pixel rows are RGB(A) ordered, as stored, and are converted to intensities first, as
+        ``cv2.applyColorMap`` does for BGR images. Large
+        images are colorized in row strips on several threads, with the same output.
+
+        Args:
+            pixels (np.ndarray): The (height, width) or (height, width, channels) uint8 pixel rows.
+            name (str): The colormap name.
+            out (np.ndarray, optional): A preallocated (height, width, 3) uint8 buffer to write
+                the colorized image into.
+
+        Returns:
+            np.ndarray: The colorized (height, width, 3) BGR image, the intensities for GRAYSCALE,
+            or the pixel rows themselves for RAW.
+
+        Raises:
+            ColorMapError: If the colormap is not registered or the output buffer does not fit.
+        """
+        name = self.resolve(name)
+        if name == RAW or (name == GRAYSCALE and pixels.ndim == 2):
+            return pixels
+        if name == GRAYSCALE:
+            result = np.empty(pixels.shape[:2], dtype=np.uint8)
+        else:
+            shape = pixels.shape[:2] + (3,)
+            if out is not None and (out.shape != shape or out.dtype != np.uint8):
+                raise ColorMapError(
+                    "The output buffer must be a {} uint8 array, got {} {}.".format(shape, out.shape, out.dtype)
+                )
+            result = out if out is not None else np.empty(shape, dtype=np.uint8)
+
+        lut = self.lut(name) if name != GRAYSCALE else None
+
+        def colorize_strip(start: int, stop: int) -> None:
+            strip = pixels[start:stop]
+            if strip.ndim == 3:
+                code = cv2.COLOR_RGBA2GRAY if strip.shape[2] == 4 else cv2.COLOR_RGB2GRAY
+                strip = strip[:, :, 0] if strip.shape[2] == 1 else cv2.cvtColor(strip, code)
+            if lut is None:
+                result[start:stop] = strip
+            else:
+                # uint8 values always index the 256-entry table, mode="clip" only avoids buffering the output
+                np.take(lut, strip, axis=0, out=result[start:stop], mode="clip")
+
+        map_strips(colorize_strip, pixels.shape[0])
+        return result
+
+
+def _read_only(lut: np.ndarray) -> np.ndarray:
+    lut = np.ascontiguousarray(lut, dtype=np.uint8)
+    lut.setflags(write=False)
+    return lut
+
+
+_registry: Optional[ColormapRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_colormap_registry() -> ColormapRegistry:
+    """
+    Get the process-wide colormap registry, building it on first use.
+
+    Returns:
+        ColormapRegistry: The colormap registry.
+    """
+    global _registry  # pylint: disable=global-statement
+    with _registry_lock:
+        if _registry is None:
+            _registry = ColormapRegistry()
+        return _registry
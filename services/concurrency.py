@@ -0,0 +1,290 @@
+"""Concurrency related module."""
+import asyncio
+import contextvars
+import functools
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Iterator, TypeVar
+
+import anyio
+
+from exceptions.exceptions import ServiceBusyError
+from services.profiling import profiled_call
+
+logger = logging.getLogger()
+
+T = TypeVar("T")
+
+
+class BlockingExecutor:
+    """
+    Run blocking calls (database queries, pandas, OpenCV) on a bounded thread pool, off the event loop.
+
+    At most ``max_workers`` calls run at once and at most ``max_pending`` more wait for a thread.
+    Further callers wait up to ``queue_timeout`` seconds for a slot before being rejected with
+    ServiceBusyError, so a burst of slow requests cannot queue unbounded work.
+    """
+
+    def __init__(self, max_workers: int, max_pending: int, queue_timeout: float):
+        """
+        Initialize a new instance of the BlockingExecutor class.
+
+        Args:
+            max_workers (int): The number of worker threads.
+            max_pending (int): The number of calls allowed to wait for a worker thread.
+            queue_timeout (float): The seconds a caller waits for a slot before being rejected.
+        """
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.queue_timeout = queue_timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="blocking")
+        self._slots = asyncio.Semaphore(max_workers + max_pending)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+
+    async def run(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """
+        Run a blocking callable on the thread pool and await its result.
+
+        The callable runs in a copy of the caller's context, so context variables set by the
+        request are visible to it, and under the request's profiler when the request is profiled.
+        The slot of the call is released when the call ends, not when the caller stops awaiting it,
+        so cancelled requests still count against the limits while their call runs.
+
+        Args:
+            func (Callable): The blocking callable.
+            *args: Positional arguments of the callable.
+            **kwargs: Keyword arguments of the callable.
+
+        Returns:
+            The result of the callable.
+
+        Raises:
+            ServiceBusyError: If no slot frees up within the queue timeout.
+        """
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError as exc:
+            with self._lock:
+                self.rejected += 1
+            raise ServiceBusyError(
+                "All {} workers are busy and {} requests are already queued.".format(
+                    self.max_workers, self.max_pending
+                )
+            ) from exc
+
+        loop = asyncio.get_running_loop()
+
+        def release(_: Any = None) -> None:
+            with self._lock:
+                self._in_flight -= 1
+                self.completed += 1
+            try:
+                loop.call_soon_threadsafe(self._slots.release)
+            except RuntimeError:
+                # The loop is closed, nobody waits for the slot anymore
+                pass
+
+        with self._lock:
+            self._in_flight += 1
+        context = contextvars.copy_context()
+        call = functools.partial(context.run, profiled_call, func, *args, **kwargs)
+        try:
+            future = self._executor.submit(call)
+        except BaseException:
+            release()
+            raise
+        # The slot is held until the call itself ends: a cancelled caller leaves its call running
+        future.add_done_callback(release)
+        return await asyncio.wrap_future(future)
+
+    async def iterate(self, iterator: Iterator[T], depth: int = 2) -> AsyncIterator[T]:
+        """
+        Iterate over a blocking iterator on the thread pool, keeping at most ``depth`` items ahead.
+
+        The whole iteration, closing the iterator included, runs in a single call of the pool, which
+        holds its slot until the iterator is exhausted or closed. Items are handed to the event loop
+        through a bounded queue. When the consumer stops early, e.g. because the client went away,
+        the iterator is closed in its thread and the consumer waits for that, so resources held by the
+        iterator, such as a pooled connection, are released before this generator is closed.
+        Exceptions raised by the iterator are re-raised in the consumer.
+
+        Args:
+            iterator (Iterator): The blocking iterator, e.g. a generator of database pages.
+            depth (int): The maximum number of items produced ahead of the consumer.
+
+        Yields:
+            The items of the iterator, in order.
+
+        Raises:
+            ServiceBusyError: If no slot frees up within the queue timeout.
+        """
+        loop = asyncio.get_running_loop()
+        items: "asyncio.Queue[Any]" = asyncio.Queue()
+        space = threading.Semaphore(depth)
+        stop = threading.Event()
+
+        def offer(item: Any) -> bool:
+            while not space.acquire(timeout=0.1):
+                if stop.is_set():
+                    return False
+            loop.call_soon_threadsafe(items.put_nowait, item)
+            return True
+
+        def produce() -> None:
+            try:
+                for item in iterator:
+                    if stop.is_set() or not offer(item):
+                        return
+                loop.call_soon_threadsafe(items.put_nowait, _DONE)
+            except BaseException as exc:  # pylint: disable=broad-except
+                loop.call_soon_threadsafe(items.put_nowait, _Failure(exc))
+            finally:
+                close = getattr(iterator, "close", None)
+                if close is not None:
+                    close()
+
+        def report_rejection(task: "asyncio.Future[None]") -> None:
+            # The producer never ran when no slot freed up, nothing else ends the queue then
+            if not task.cancelled() and task.exception() is not None:
+                items.put_nowait(_Failure(task.exception()))
+
+        producer = asyncio.ensure_future(self.run(produce))
+        producer.add_done_callback(report_rejection)
+        try:
+            while True:
+                item = await items.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, _Failure):
+                    raise item.exception
+                space.release()
+                yield item
+        finally:
+            stop.set()
+            # A disconnected client cancels every await of the response, the wait for the iterator
+            # to be closed is shielded from that
+            with anyio.CancelScope(shield=True):
+                try:
+                    await producer
+                except Exception:  # pylint: disable=broad-except
+                    # Already raised to the consumer, or irrelevant once it stopped
+                    pass
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Return the executor's load counters.
+
+        Returns:
+            Dict[str, int]: The executor statistics.
+        """
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_pending": self.max_pending,
+                "in_flight": self._in_flight,
+                "completed": self.completed,
+                "rejected": self.rejected,
+            }
+
+    def shutdown(self) -> None:
+        """
+        Wait for the running calls to finish and stop the worker threads.
+        """
+        self._executor.shutdown(wait=True)
+
+
+_DONE = object()
+
+
+class _Failure:
+    __slots__ = ("exception",)
+
+    def __init__(self, exception: BaseException):
+        self.exception = exception
+
+
+def prefetch(iterable: Iterable[T], depth: int = 2) -> Iterator[T]:
+    """
+    Iterate over an iterable in a background thread, keeping at most ``depth`` items ahead.
+
+    Producing the next items (e.g. parsing a CSV chunk) then overlaps with consuming the current
+    one (e.g. writing it to the database), while memory stays bounded by ``depth`` items.
+    Exceptions raised by the iterable are re-raised in the consumer.
+
+    Args:
+        iterable (Iterable): The items to produce.
+        depth (int): The maximum number of items produced ahead of the consumer.
+
+    Yields:
+        The items of the iterable, in order.
+    """
+    items: "queue.Queue[Any]" = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def offer(item: Any) -> bool:
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce() -> None:
+        try:
+            for item in iterable:
+                if not offer(item):
+                    return
+            offer(_DONE)
+        except BaseException as exc:  # pylint: disable=broad-except
+            offer(_Failure(exc))
+
+    producer = threading.Thread(target=produce, name="prefetch", daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = items.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Failure):
+                raise item.exception
+            yield item
+    finally:
+        stop.set()
+        producer.join()
+
+
+@contextmanager
+def heartbeat(beat: Callable[[], Any], interval: float) -> Iterator[None]:
+    """
+    Call a function every ``interval`` seconds in a background thread while the block runs.
+
+    It keeps a lease alive, e.g. a seed claim, during blocking work that cannot report progress
+    itself. A failing beat is logged and the next one still runs.
+
+    Args:
+        beat (Callable[[], Any]): The function renewing the lease.
+        interval (float): The seconds between two calls.
+    """
+    stop = threading.Event()
+
+    def run() -> None:
+        while not stop.wait(interval):
+            try:
+                beat()
+            except Exception as exc:  # pylint: disable=broad-except
+                logger.warning(f"Heartbeat failed: {exc}")
+
+    thread = threading.Thread(target=run, name="heartbeat", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
@@ -0,0 +1,103 @@
+"""Service configuration module."""
+import os
+
+
+def _env_bool(name: str, default: str) -> bool:
+    return os.getenv(name, default).strip().lower() in ("1", "true", "yes", "on")
+
+
+# Database connection pool
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = _env_bool("DB_POOL_PRE_PING", "true")
+DB_ALLOW_LOCAL_INFILE = _env_bool("DB_ALLOW_LOCAL_INFILE", "false")
+
+# Bulk inserts: "executemany", "multi" (multi-row VALUES) or "load_data" (MySQL LOAD DATA LOCAL INFILE)
+BULK_INSERT_METHOD = os.getenv("BULK_INSERT_METHOD", "executemany")
+BULK_INSERT_CHUNK_SIZE = int(os.getenv("BULK_INSERT_CHUNK_SIZE", "1000"))
+
+# Image storage: "packed" keeps one uint8 BLOB per depth row, "wide" one column per pixel
+IMAGE_STORAGE_MODE = os.getenv("IMAGE_STORAGE_MODE", "packed")
+
+# Image store: "database" keeps images in the SQL database, "memmap" as memory-mapped files under MEMMAP_STORE_PATH
+IMAGE_STORE_BACKEND = os.getenv("IMAGE_STORE_BACKEND", "database")
+MEMMAP_STORE_PATH = os.getenv("MEMMAP_STORE_PATH", "data/images")
+
+# Thread pool running blocking database and image work off the event loop
+BLOCKING_WORKERS = int(os.getenv("BLOCKING_WORKERS", str(DB_POOL_SIZE)))
+BLOCKING_QUEUE_SIZE = int(os.getenv("BLOCKING_QUEUE_SIZE", "32"))
+BLOCKING_QUEUE_TIMEOUT = float(os.getenv("BLOCKING_QUEUE_TIMEOUT", "5"))
+
+# In-process cache of rendered /image-depth-range responses. Uploads only invalidate the caches of the
+# worker receiving them, so entries expire after the TTL in seconds on the others; 0 disables expiry.
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "60"))
+
+# Cache of decoded pixel rows in fixed depth buckets; TILE_CACHE_MAX_BYTES=0 disables it.
+# Tiles expire after TILE_CACHE_TTL seconds, like responses; 0 disables expiry.
+TILE_DEPTH = float(os.getenv("TILE_DEPTH", "100"))
+TILE_CACHE_MAX_BYTES = int(os.getenv("TILE_CACHE_MAX_BYTES", str(128 * 1024 * 1024)))
+TILE_CACHE_TTL = float(os.getenv("TILE_CACHE_TTL", "60"))
+
+# Width images are resized to before being stored
+IMAGE_WIDTH = int(os.getenv("IMAGE_WIDTH", "150"))
+
+# Resolution pyramid built at upload time: full resolution, 1/2, 1/4, ...
+PYRAMID_LEVELS = int(os.getenv("PYRAMID_LEVELS", "5"))
+PYRAMID_MIN_WIDTH = int(os.getenv("PYRAMID_MIN_WIDTH", "8"))
+
+# Rows parsed per chunk when seeding from CSV; 0 parses the whole file at once
+INGEST_CHUNK_ROWS = int(os.getenv("INGEST_CHUNK_ROWS", "0"))
+
+# Largest body accepted by the binary upload endpoint
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# Binary /image-depth-range encodings: zlib level of PNG (0-9) and WebP quality (1-100, above 100 is lossless)
+PNG_COMPRESSION = int(os.getenv("PNG_COMPRESSION", "1"))
+WEBP_QUALITY = int(os.getenv("WEBP_QUALITY", "90"))
+
+# Optional JSON file of user-defined colormaps: {"name": [[r, g, b], ...]}, interpolated to 256 colors
+COLORMAPS_FILE = os.getenv("COLORMAPS_FILE", "")
+
+# Resampling of stored images: filter ("area", "bilinear" or "lanczos") and, when positive, the regular
+# depth step rows are resampled onto; 0 keeps the depth of every row
+RESAMPLING_FILTER = os.getenv("RESAMPLING_FILTER", "area")
+DEPTH_STEP = float(os.getenv("DEPTH_STEP", "0"))
+
+# Largest number of windows accepted by one /image-depth-range/batch call
+BATCH_MAX_WINDOWS = int(os.getenv("BATCH_MAX_WINDOWS", "200"))
+
+# Rows fetched, colorized and sent per strip by /image-depth-range/stream
+STREAM_STRIP_ROWS = int(os.getenv("STREAM_STRIP_ROWS", "1024"))
+
+# Startup seed: the CSV seeded, whether the app serves while seeding (readiness is reported by /health), the
+# seconds after which an unfinished seed of another worker is taken over, and how often it is checked on
+SEED_FILE = os.getenv("SEED_FILE", "image/img.csv")
+SEED_IN_BACKGROUND = _env_bool("SEED_IN_BACKGROUND", "false")
+SEED_CLAIM_TIMEOUT = float(os.getenv("SEED_CLAIM_TIMEOUT", "600"))
+SEED_POLL_INTERVAL = float(os.getenv("SEED_POLL_INTERVAL", "2"))
+
+# Per-stage latency, row and byte histograms of the read and upload pipelines, served on /metrics
+METRICS_ENABLED = _env_bool("METRICS_ENABLED", "true")
+
+# Per-request profiling: requests sending the X-Profile header with PROFILE_TOKEN are profiled (no token disables
+# the header), as well as a PROFILE_SAMPLE_RATE fraction of all requests; the last PROFILE_MAX_FILES profiles are
+# kept in PROFILE_DIR
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "100"))
+
+# Background ingest jobs of uploads sent with ?job=true: jobs run at once, jobs queued beyond them, finished jobs
+# kept for status queries, and full-resolution rows written per transaction
+INGEST_JOB_WORKERS = int(os.getenv("INGEST_JOB_WORKERS", "2"))
+INGEST_JOB_QUEUE_SIZE = int(os.getenv("INGEST_JOB_QUEUE_SIZE", "8"))
+INGEST_JOBS_KEPT = int(os.getenv("INGEST_JOBS_KEPT", "100"))
+INGEST_JOB_CHUNK_ROWS = int(os.getenv("INGEST_JOB_CHUNK_ROWS", "4096"))
+
+# Threads splitting large images into row strips (resampling, pyramids, colormaps); 1 processes every image in a
+# single call. Images under PARALLEL_MIN_ROWS rows are never split
+IMAGE_PARALLELISM = int(os.getenv("IMAGE_PARALLELISM", str(min(os.cpu_count() or 1, 8))))
+PARALLEL_MIN_ROWS = int(os.getenv("PARALLEL_MIN_ROWS", "16384"))
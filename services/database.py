@@ -1,57 +1,761 @@
 """Database related module."""
+import io
+import logging
 import os
+import tempfile
+import threading
+import time
+import uuid
+import weakref
+from contextlib import contextmanager
+from itertools import chain, islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
 
-import cv2
 import numpy as np
 import pandas as pd
 from mysql.connector import Error as MySQLError
 from sqlalchemy import PrimaryKeyConstraint
-from sqlalchemy import create_engine, Table, MetaData, Column
-from sqlalchemy import inspect
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy import create_engine, Table, MetaData, Column, select
+from sqlalchemy import event, inspect
+from sqlalchemy.engine import Connection, Engine, make_url
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.types import Integer, Float, String
+from sqlalchemy.sql import Select
+from sqlalchemy.types import Double, Integer, Float, LargeBinary, String
 from sqlalchemy_utils import database_exists, create_database
 
 from exceptions.exceptions import (
     DatabaseConnectionError,
     DatabaseServiceError,
     DatabaseQueryError,
-    ColorMapError,
 )
+from services.config import (
+    BULK_INSERT_CHUNK_SIZE,
+    BULK_INSERT_METHOD,
+    DB_ALLOW_LOCAL_INFILE,
+    DB_MAX_OVERFLOW,
+    DB_POOL_PRE_PING,
+    DB_POOL_RECYCLE,
+    DB_POOL_SIZE,
+    DB_POOL_TIMEOUT,
+    IMAGE_STORAGE_MODE,
+)
+from services.colormaps import ColormapRegistry, get_colormap_registry
+from services.metrics import observe_stage, stage_timer, timed
+from services.tiles import DepthTileCache
+
+logger = logging.getLogger(__name__)
+
+STORAGE_MODES = ("packed", "wide")
+
+# MEDIUMBLOB on MySQL, so that a packed row can hold up to 16 MiB of pixels.
+PACKED_ROW_LENGTH = 2**24 - 1
+
+
+class PoolMetrics:
+    """Counters describing how an engine's connection pool is used."""
+
+    def __init__(self, engine: Engine):
+        """
+        Initialize a new instance of the PoolMetrics class and hook it into the engine's pool events.
+
+        Args:
+            engine (Engine): The engine whose pool is observed.
+        """
+        self._engine = engine
+        self._lock = threading.Lock()
+        self.connections_created = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidations = 0
+        self.wait_count = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+        event.listen(engine, "connect", self._on_connect)
+        event.listen(engine, "checkout", self._on_checkout)
+        event.listen(engine, "checkin", self._on_checkin)
+        event.listen(engine, "invalidate", self._on_invalidate)
+
+    def _on_connect(self, *_) -> None:
+        with self._lock:
+            self.connections_created += 1
+
+    def _on_checkout(self, *_) -> None:
+        with self._lock:
+            self.checkouts += 1
+
+    def _on_checkin(self, *_) -> None:
+        with self._lock:
+            self.checkins += 1
+
+    def _on_invalidate(self, *_) -> None:
+        with self._lock:
+            self.invalidations += 1
+
+    def record_wait(self, seconds: float) -> None:
+        """
+        Record the time spent waiting for a connection to be checked out.
+
+        Args:
+            seconds (float): The checkout wait time in seconds.
+        """
+        with self._lock:
+            self.wait_count += 1
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+
+    def snapshot(self) -> Dict[str, float]:
+        """
+        Return the current counters together with the live pool status.
+
+        Returns:
+            Dict[str, float]: The pool metrics.
+        """
+        pool = self._engine.pool
+        with self._lock:
+            stats: Dict[str, float] = {
+                "connections_created": self.connections_created,
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "invalidations": self.invalidations,
+                "wait_count": self.wait_count,
+                "wait_seconds_total": self.wait_seconds_total,
+                "wait_seconds_max": self.wait_seconds_max,
+                "wait_seconds_avg": (
+                    self.wait_seconds_total / self.wait_count if self.wait_count else 0.0
+                ),
+            }
+        for name in ("size", "checkedin", "checkedout", "overflow"):
+            status = getattr(pool, name, None)
+            if callable(status):
+                stats[f"pool_{name}"] = status()
+        return stats
+
+
+class TableCache:
+    """Cache of reflected tables, keyed by table name."""
+
+    def __init__(self, engine: Engine):
+        """
+        Initialize a new instance of the TableCache class.
+
+        Args:
+            engine (Engine): The engine used to reflect tables.
+        """
+        self._engine = engine
+        self._lock = threading.Lock()
+        self._tables: Dict[str, Table] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, table_name: str) -> Table:
+        """
+        Get a table, reflecting it from the database only if it is not cached yet.
+
+        Args:
+            table_name (str): The name of the table.
+
+        Returns:
+            Table: The reflected table.
+        """
+        with self._lock:
+            table = self._tables.get(table_name)
+            if table is not None:
+                self.hits += 1
+                return table
+            self.misses += 1
+
+        with stage_timer("reflect"):
+            table = Table(table_name, MetaData(), autoload_with=self._engine)
+        with self._lock:
+            return self._tables.setdefault(table_name, table)
+
+    def invalidate(self, table_name: Optional[str] = None) -> None:
+        """
+        Drop a cached table so that it is reflected again on next use.
+
+        Args:
+            table_name (str, optional): The name of the table. Drops every table when omitted.
+        """
+        with self._lock:
+            if table_name is None:
+                self._tables.clear()
+            else:
+                self._tables.pop(table_name, None)
+
+
+_ENGINE_STATE: "weakref.WeakKeyDictionary[Engine, Dict[type, object]]" = weakref.WeakKeyDictionary()
+_ENGINE_STATE_LOCK = threading.Lock()
+
+
+def _engine_state(engine: Engine, factory: type):
+    with _ENGINE_STATE_LOCK:
+        state = _ENGINE_STATE.setdefault(engine, {})
+        if factory not in state:
+            state[factory] = factory(engine)
+        return state[factory]
+
+
+def get_pool_metrics(engine: Engine) -> PoolMetrics:
+    """
+    Get the pool metrics attached to an engine, attaching them on first use.
+
+    Args:
+        engine (Engine): The engine whose pool is observed.
+
+    Returns:
+        PoolMetrics: The pool metrics of the engine.
+    """
+    return _engine_state(engine, PoolMetrics)
+
+
+def get_table_cache(engine: Engine) -> TableCache:
+    """
+    Get the reflected table cache shared by every DatabaseService using the engine.
+
+    Args:
+        engine (Engine): The engine used to reflect tables.
+
+    Returns:
+        TableCache: The table cache of the engine.
+    """
+    return _engine_state(engine, TableCache)
+
+
+def build_database_url() -> str:
+    """
+    Build the database URL from the environment.
+
+    ``DB_URL`` takes precedence; otherwise the MySQL URL is assembled from
+    ``DB_HOST``, ``DB_PORT``, ``DB_USER``, ``DB_PASS`` and ``DB_NAME``.
+
+    Returns:
+        str: The database URL.
+
+    Raises:
+        DatabaseServiceError: If an environment variable is missing.
+    """
+    db_url = os.getenv("DB_URL")
+    if db_url:
+        return db_url
+
+    names = ("DB_HOST", "DB_PORT", "DB_USER", "DB_PASS", "DB_NAME")
+    missing = [name for name in names if not os.getenv(name)]
+    if missing:
+        raise DatabaseServiceError(
+            "Missing environment variable(s) for database connection: {}".format(
+                ", ".join(missing)
+            )
+        )
+    db_host, db_port, db_user, db_pass, db_name = (os.getenv(name) for name in names)
+    return f"mysql+mysqlconnector://{db_user}:{db_pass}@{db_host}:{db_port}/{db_name}"
+
+
+@timed("engine", size=None)
+def create_db_engine(db_url: Optional[str] = None) -> Engine:
+    """
+    Create a pooled engine. One engine is meant to be shared by every request of a worker.
+
+    Args:
+        db_url (str, optional): The database URL. Defaults to the URL built from the environment.
+
+    Returns:
+        Engine: The engine.
+
+    Raises:
+        DatabaseServiceError: If the engine cannot be created.
+    """
+    try:
+        url = make_url(db_url or build_database_url())
+        options: Dict[str, object] = {"pool_pre_ping": DB_POOL_PRE_PING}
+        if url.get_backend_name() != "sqlite":
+            options.update(
+                pool_size=DB_POOL_SIZE,
+                max_overflow=DB_MAX_OVERFLOW,
+                pool_timeout=DB_POOL_TIMEOUT,
+                pool_recycle=DB_POOL_RECYCLE,
+            )
+        if url.get_backend_name() == "mysql" and DB_ALLOW_LOCAL_INFILE:
+            options["connect_args"] = {"allow_local_infile": True}
+        engine = create_engine(url, **options)
+    except DatabaseServiceError:
+        raise
+    except Exception as exc:
+        raise DatabaseServiceError("Failed to create database engine: {}".format(exc)) from exc
+
+    get_pool_metrics(engine)
+    return engine
+
+
+_PACKED_METADATA = MetaData()
+_PACKED_TABLES: Dict[str, Tuple[Table, Table]] = {}
+_PACKED_TABLES_LOCK = threading.Lock()
+
+
+def packed_tables(table_name: str = "images") -> Tuple[Table, Table]:
+    """
+    Get the tables of the packed storage mode.
+
+    Each depth row of a pyramid level of an image is stored as a single uint8 BLOB in
+    ``<table_name>_packed``, while the shape and depth extent of every level are kept in
+    ``<table_name>_meta``. The metadata table is written in both storage modes.
+
+    Args:
+        table_name (str): The name of the image table.
+
+    Returns:
+        Tuple[Table, Table]: The row table and the metadata table.
+    """
+    with _PACKED_TABLES_LOCK:
+        tables = _PACKED_TABLES.get(table_name)
+        if tables is None:
+            rows_table = Table(
+                f"{table_name}_packed",
+                _PACKED_METADATA,
+                Column("image_name", String(255), primary_key=True),
+                Column("level", Integer(), primary_key=True, autoincrement=False),
+                Column("depth", Double(), primary_key=True),
+                Column("pixels", LargeBinary(PACKED_ROW_LENGTH), nullable=False),
+            )
+            meta_table = Table(
+                f"{table_name}_meta",
+                _PACKED_METADATA,
+                Column("image_name", String(255), primary_key=True),
+                Column("level", Integer(), primary_key=True, autoincrement=False),
+                Column("height", Integer(), nullable=False),
+                Column("width", Integer(), nullable=False),
+                Column("channels", Integer(), nullable=False),
+                Column("depth_min", Double()),
+                Column("depth_max", Double()),
+            )
+            tables = _PACKED_TABLES[table_name] = (rows_table, meta_table)
+        return tables
+
+
+# Seeds of the deployment: the fingerprint and state of the last seed of every seeded image
+SEEDS_TABLE = Table(
+    "image_seeds",
+    _PACKED_METADATA,
+    Column("seed_name", String(255), primary_key=True),
+    Column("fingerprint", String(64), nullable=False),
+    Column("status", String(16), nullable=False),
+    Column("updated_at", Double(), nullable=False),
+)
+
+# Outcomes of claim_seed
+SEED_READY = "ready"
+SEED_CLAIMED = "claimed"
+SEED_BUSY = "busy"
+
+
+def seed_claim(row: Optional[Dict[str, Any]], fingerprint: str, stale_after: float, now: float) -> str:
+    """
+    Decide whether a worker may seed an image, given the stored state of its last seed.
+
+    Args:
+        row (Dict[str, Any], optional): The stored fingerprint, status and updated_at, None if never seeded.
+        fingerprint (str): The fingerprint of the data the worker would seed.
+        stale_after (float): The seconds after which a running seed is deemed abandoned.
+        now (float): The current time, in seconds since the epoch.
+
+    Returns:
+        str: SEED_READY if that data is already seeded, SEED_BUSY if another worker is seeding,
+        else SEED_CLAIMED.
+    """
+    if row is None:
+        return SEED_CLAIMED
+    if row["status"] == "ready" and row["fingerprint"] == fingerprint:
+        return SEED_READY
+    if row["status"] == "seeding" and now - row["updated_at"] < stale_after:
+        return SEED_BUSY
+    return SEED_CLAIMED
+
+
+def level_table_name(table_name: str, level: int) -> str:
+    """
+    Get the name of the wide table holding a pyramid level. Level 0 lives in the table itself.
+
+    Args:
+        table_name (str): The name of the image table.
+        level (int): The pyramid level.
+
+    Returns:
+        str: The name of the level's table.
+    """
+    return table_name if level == 0 else f"{table_name}_level{level}"
+
+
+def _validate_image(depths: np.ndarray, pixels: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    pixels = np.ascontiguousarray(pixels, dtype=np.uint8)
+    depths = np.asarray(depths, dtype=np.float64)
+    if pixels.ndim not in (2, 3):
+        raise DatabaseServiceError(
+            "Failed to store image: expected a 2D or 3D pixel array, got {}D.".format(pixels.ndim)
+        )
+    if depths.shape != (pixels.shape[0],):
+        raise DatabaseServiceError(
+            "Failed to store image: expected one depth per pixel row, got {} depths for {} rows.".format(
+                depths.size, pixels.shape[0]
+            )
+        )
+    return depths, pixels
+
+
+def _meta_row(image_name: str, level: int, depths: np.ndarray, pixels: np.ndarray) -> Dict[str, Any]:
+    return {
+        "image_name": image_name,
+        "level": level,
+        "height": pixels.shape[0],
+        "width": pixels.shape[1],
+        "channels": pixels.shape[2] if pixels.ndim == 3 else 1,
+        "depth_min": float(depths.min()) if depths.size else None,
+        "depth_max": float(depths.max()) if depths.size else None,
+    }
+
+
+def _merge_meta_row(meta_rows: Dict[int, Dict[str, Any]], row: Dict[str, Any]) -> None:
+    """Extend the metadata of a level with the metadata of its next chunk of rows."""
+    merged = meta_rows.get(row["level"])
+    if merged is None:
+        meta_rows[row["level"]] = row
+        return
+    merged["height"] += row["height"]
+    if row["depth_min"] is None:
+        return
+    if merged["depth_min"] is None:
+        merged["depth_min"], merged["depth_max"] = row["depth_min"], row["depth_max"]
+    else:
+        merged["depth_min"] = min(merged["depth_min"], row["depth_min"])
+        merged["depth_max"] = max(merged["depth_max"], row["depth_max"])
+
+
+def _estimate_rows(level: Dict[str, Any], depth_min: float, depth_max: float) -> float:
+    """Estimate the rows of a pyramid level within a depth range, assuming evenly spaced depths."""
+    if level["depth_min"] is None:
+        return 0.0
+    span = level["depth_max"] - level["depth_min"]
+    overlap = min(depth_max, level["depth_max"]) - max(depth_min, level["depth_min"])
+    if overlap < 0:
+        return 0.0
+    if span <= 0:
+        return float(level["height"])
+    return level["height"] * overlap / span
+
+
+def pick_level(
+        levels: List[Dict[str, Any]],
+        depth_min: float,
+        depth_max: float,
+        target_height: Optional[int] = None,
+        target_width: Optional[int] = None,
+) -> int:
+    """
+    Pick the coarsest of the given pyramid levels that still renders a depth range at the target size.
+
+    Args:
+        levels (List[Dict[str, Any]]): The levels, as returned by image_levels, finest first.
+        depth_min (float): The minimum depth.
+        depth_max (float): The maximum depth.
+        target_height (int, optional): The minimum number of rows wanted.
+        target_width (int, optional): The minimum number of columns wanted.
+
+    Returns:
+        int: The selected level, 0 when no target is given or no coarser level is large enough.
+    """
+    if target_height is None and target_width is None:
+        return 0
+    for level in reversed(levels):
+        if target_width is not None and level["width"] < target_width:
+            continue
+        if target_height is not None and _estimate_rows(level, depth_min, depth_max) < target_height:
+            continue
+        return level["level"]
+    return 0
+
+
+def merge_depth_windows(windows: Sequence[Tuple[float, float]]) -> List[Tuple[float, float, List[int]]]:
+    """
+    Merge overlapping depth windows, so that a single range query serves all the windows it covers.
+
+    Args:
+        windows (Sequence[Tuple[float, float]]): The (depth_min, depth_max) of every window.
+
+    Returns:
+        List[Tuple[float, float, List[int]]]: The merged ranges by increasing depth, each with the
+        indices of the windows it covers.
+    """
+    merged: List[List[Any]] = []
+    for index in sorted(range(len(windows)), key=lambda position: windows[position]):
+        depth_min, depth_max = windows[index]
+        if merged and depth_min <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], depth_max)
+            merged[-1][2].append(index)
+        else:
+            merged.append([depth_min, depth_max, [index]])
+    return [(depth_min, depth_max, indices) for depth_min, depth_max, indices in merged]
+
+
+class BulkLoadStats:
+    """Outcome of a bulk load."""
+
+    def __init__(self, rows: int, chunks: int, seconds: float):
+        """
+        Initialize a new instance of the BulkLoadStats class.
+
+        Args:
+            rows (int): The number of rows written.
+            chunks (int): The number of chunks the rows were sent in.
+            seconds (float): The time spent writing.
+        """
+        self.rows = rows
+        self.chunks = chunks
+        self.seconds = seconds
+
+    @property
+    def rows_per_second(self) -> float:
+        """The write throughput."""
+        return self.rows / self.seconds if self.seconds > 0 else 0.0
+
+    @classmethod
+    def combine(cls, stats: Iterable["BulkLoadStats"]) -> "BulkLoadStats":
+        """
+        Add up the outcome of several bulk loads.
+
+        Args:
+            stats (Iterable[BulkLoadStats]): The outcomes to add up.
+
+        Returns:
+            BulkLoadStats: The total rows, chunks and time.
+        """
+        stats = list(stats)
+        return cls(
+            rows=sum(stat.rows for stat in stats),
+            chunks=sum(stat.chunks for stat in stats),
+            seconds=sum(stat.seconds for stat in stats),
+        )
+
+    def __repr__(self) -> str:
+        return "BulkLoadStats(rows={}, chunks={}, seconds={:.3f}, rows_per_second={:.0f})".format(
+            self.rows, self.chunks, self.seconds, self.rows_per_second
+        )
+
+
+class BulkLoader:
+    """
+    Stream rows into a table in fixed-size chunks.
+
+    Supported methods:
+        - "executemany": one DBAPI executemany per chunk.
+        - "multi": one multi-row INSERT ... VALUES statement per chunk.
+        - "load_data": MySQL only. Each chunk is serialized to an in-memory tab-separated buffer
+          and sent with LOAD DATA LOCAL INFILE. mysql-connector only reads local files, so the
+          buffer is spooled through a temporary file. Requires DB_ALLOW_LOCAL_INFILE and
+          local_infile enabled on the server.
+    """
+
+    METHODS = ("executemany", "multi", "load_data")
+
+    def __init__(
+            self,
+            table: Table,
+            columns: Sequence[str],
+            chunk_size: Optional[int] = None,
+            method: Optional[str] = None,
+    ):
+        """
+        Initialize a new instance of the BulkLoader class.
+
+        Args:
+            table (Table): The table to load.
+            columns (Sequence[str]): The names of the columns, in the order of the row values.
+            chunk_size (int, optional): The number of rows per chunk. Defaults to BULK_INSERT_CHUNK_SIZE.
+            method (str, optional): The load method. Defaults to BULK_INSERT_METHOD.
+
+        Raises:
+            DatabaseServiceError: If the method or the chunk size is invalid.
+        """
+        self.table = table
+        self.columns = list(columns)
+        self.chunk_size = chunk_size or BULK_INSERT_CHUNK_SIZE
+        self.method = method or BULK_INSERT_METHOD
+        if self.method not in self.METHODS:
+            raise DatabaseServiceError(
+                "Unknown bulk insert method {!r}, expected one of {}.".format(
+                    self.method, ", ".join(self.METHODS)
+                )
+            )
+        if self.chunk_size < 1:
+            raise DatabaseServiceError("Bulk insert chunk size must be positive.")
+
+    def load(self, connection: Connection, rows: Iterable[Sequence[Any]]) -> BulkLoadStats:
+        """
+        Write rows through a connection. The caller owns the transaction.
+
+        Args:
+            connection (Connection): The connection to write through.
+            rows (Iterable[Sequence[Any]]): The row values, in the order of the columns.
+
+        Returns:
+            BulkLoadStats: The number of rows and chunks written and the time it took.
+        """
+        if self.method == "load_data" and connection.dialect.name != "mysql":
+            raise DatabaseServiceError("LOAD DATA LOCAL INFILE is only supported on MySQL.")
+
+        started = time.perf_counter()
+        row_count = chunk_count = 0
+        iterator = iter(rows)
+        while True:
+            chunk = list(islice(iterator, self.chunk_size))
+            if not chunk:
+                break
+            if self.method == "load_data":
+                self._load_data(connection, chunk)
+            else:
+                parameters = [dict(zip(self.columns, row)) for row in chunk]
+                if self.method == "multi":
+                    connection.execute(self.table.insert().values(parameters))
+                else:
+                    connection.execute(self.table.insert(), parameters)
+            row_count += len(chunk)
+            chunk_count += 1
+
+        stats = BulkLoadStats(row_count, chunk_count, time.perf_counter() - started)
+        logger.info("Bulk loaded %s into %s via %s.", stats, self.table.name, self.method)
+        return stats
+
+    def _load_data(self, connection: Connection, chunk: List[Sequence[Any]]) -> None:
+        binary = {
+            name for name in self.columns if isinstance(self.table.c[name].type, LargeBinary)
+        }
+        buffer = io.StringIO()
+        for row in chunk:
+            buffer.write("\t".join(_tsv_value(value) for value in row))
+            buffer.write("\n")
+
+        targets = ", ".join(f"@{name}" if name in binary else f"`{name}`" for name in self.columns)
+        assignments = ", ".join(f"`{name}` = UNHEX(@{name})" for name in self.columns if name in binary)
+        with tempfile.NamedTemporaryFile("w", suffix=".tsv", encoding="utf-8") as infile:
+            infile.write(buffer.getvalue())
+            infile.flush()
+            statement = (
+                f"LOAD DATA LOCAL INFILE '{infile.name}' INTO TABLE `{self.table.name}` "
+                "CHARACTER SET utf8mb4 FIELDS TERMINATED BY '\\t' LINES TERMINATED BY '\\n' "
+                f"({targets})"
+            )
+            if assignments:
+                statement += f" SET {assignments}"
+            connection.exec_driver_sql(statement)
+
+
+def _packed_rows_to_arrays(rows: Sequence[Sequence[Any]], width: int, channels: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Turn (depth, pixels BLOB) rows into depths and pixel rows of the given shape."""
+    row_shape = (width, channels) if channels > 1 else (width,)
+    depths = np.fromiter((row[0] for row in rows), dtype=np.float64, count=len(rows))
+    image = np.frombuffer(b"".join(row[1] for row in rows), dtype=np.uint8)
+    return depths, image.reshape((len(rows),) + row_shape)
+
+
+def _wide_rows_to_arrays(rows: Sequence[Sequence[Any]]) -> Tuple[np.ndarray, np.ndarray]:
+    """Turn (depth, pixel values...) rows into depths and pixel rows."""
+    if not rows:
+        return np.empty(0, dtype=np.float64), np.empty((0, 0), dtype=np.uint8)
+
+    # Fill the arrays straight from the driver's rows
+    width = len(rows[0]) - 1
+    depths = np.fromiter((row[0] for row in rows), dtype=np.float64, count=len(rows))
+    pixels = np.fromiter(
+        chain.from_iterable(islice(row, 1, None) for row in rows),
+        dtype=np.uint8,
+        count=len(rows) * width,
+    )
+    return depths, pixels.reshape(len(rows), width)
+
+
+def _tsv_value(value: Any) -> str:
+    if value is None:
+        return "\\N"
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex()
+    if isinstance(value, float):
+        return repr(value)
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n")
 
 
 class DatabaseService:
     """Calss to perform database tasks."""
 
-    def __init__(self):
+    def __init__(
+            self,
+            engine: Optional[Engine] = None,
+            storage_mode: Optional[str] = None,
+            tile_cache: Optional[DepthTileCache] = None,
+            colormaps: Optional[ColormapRegistry] = None,
+    ):
         """
         Initialize a new instance of the DatabaseService class.
+
+        Args:
+            engine (Engine, optional): A shared engine. A private engine is created when omitted.
+            storage_mode (str, optional): "packed" or "wide". Defaults to IMAGE_STORAGE_MODE.
+            tile_cache (DepthTileCache, optional): A shared cache of depth tiles that reads go through.
+            colormaps (ColormapRegistry, optional): The colormaps images are colorized with.
+                Defaults to the process-wide registry.
         """
+        self.storage_mode = storage_mode or IMAGE_STORAGE_MODE
+        self.tile_cache = tile_cache
+        self.colormaps = colormaps if colormaps is not None else get_colormap_registry()
+        if self.storage_mode not in STORAGE_MODES:
+            raise DatabaseServiceError(
+                "Unknown storage mode {!r}, expected one of {}.".format(
+                    self.storage_mode, ", ".join(STORAGE_MODES)
+                )
+            )
         try:
-            self._init_db()
+            self._init_db(engine)
         except MySQLError as exc:
             raise DatabaseConnectionError(
                 "Failed to initialize database connection: {}".format(exc)
             ) from exc
 
-    def _init_db(self):
+    def _init_db(self, engine: Optional[Engine] = None):
         """
         Initialize the database connection.
+
+        Args:
+            engine (Engine, optional): A shared engine. A private engine is created when omitted.
         """
-        try:
-            db_host = os.getenv("DB_HOST")
-            db_port = os.getenv("DB_PORT")
-            db_user = os.getenv("DB_USER")
-            db_pass = os.getenv("DB_PASS")
-            db_name = os.getenv("DB_NAME")
-            db_url = f"mysql+mysqlconnector://{db_user}:{db_pass}@{db_host}:{db_port}/{db_name}"
-            self.engine = create_engine(db_url)
-            self.sql_session = sessionmaker(bind=self.engine)
-        except Exception as exc:
-            raise DatabaseServiceError(
-                "Missing environment variable(s) for database connection: {}".format(exc)
-            ) from exc
+        self.engine = engine if engine is not None else create_db_engine()
+        self.pool_metrics = get_pool_metrics(self.engine)
+        self.table_cache = get_table_cache(self.engine)
+        self.sql_session = sessionmaker(bind=self.engine)
+
+    @contextmanager
+    def connection(self) -> Iterator[Connection]:
+        """
+        Check a connection out of the pool, recording how long the checkout waited.
+
+        Yields:
+            Connection: The pooled connection.
+        """
+        started = time.perf_counter()
+        with self.engine.connect() as connection:
+            waited = time.perf_counter() - started
+            self.pool_metrics.record_wait(waited)
+            observe_stage("pool_checkout", waited)
+            yield connection
+
+    @contextmanager
+    def transaction(self) -> Iterator[Connection]:
+        """
+        Check a connection out of the pool and run a transaction on it.
+        The transaction is committed on success and rolled back on error.
+
+        Yields:
+            Connection: The pooled connection.
+        """
+        with self.connection() as connection, connection.begin():
+            yield connection
 
     def create_table(self, table_name: str, dataframe: pd.DataFrame) -> None:
         """
@@ -61,6 +765,36 @@ class DatabaseService:
             table_name (str): The name of the table.
             dataframe (pd.DataFrame): The DataFrame based on which the table is to be created.
         """
+        columns = []
+        for column_name, dtype in dataframe.dtypes.items():
+            if column_name == "depth":
+                # Part of the primary key, so it must compare exactly with the bounds of range queries.
+                columns.append(Column(column_name, Double()))  # type: ignore
+            elif pd.api.types.is_integer_dtype(dtype):
+                columns.append(Column(column_name, Integer()))
+            elif pd.api.types.is_float_dtype(dtype):
+                columns.append(Column(column_name, Float()))  # type: ignore
+            elif pd.api.types.is_string_dtype(dtype):
+                columns.append(Column(column_name, String(255)))  # type: ignore
+        self._create_table(table_name, columns)
+
+    def create_wide_table(self, table_name: str, pixel_count: int) -> Table:
+        """
+        Create a wide image table, with one integer column per pixel value, unless it already exists.
+
+        Args:
+            table_name (str): The name of the table.
+            pixel_count (int): The number of pixel values per row.
+
+        Returns:
+            Table: The table.
+        """
+        columns = [Column(f"pixel_{index}", Integer()) for index in range(pixel_count)]
+        columns += [Column("depth", Double()), Column("image_name", String(255))]  # type: ignore
+        self._create_table(table_name, columns)
+        return self.table_cache.get(table_name)
+
+    def _create_table(self, table_name: str, columns: List[Column]) -> None:
         try:
             inspector = inspect(self.engine)
             if not inspector.has_table(table_name):
@@ -68,37 +802,72 @@ class DatabaseService:
                     create_database(self.engine.url)
 
                 metadata = MetaData()
-
-                columns = []
-                for column_name, dtype in dataframe.dtypes.items():
-                    if "int64" in str(dtype):
-                        columns.append(Column(column_name, Integer()))
-                    elif "float64" in str(dtype):
-                        columns.append(Column(column_name, Float()))  # type: ignore
-                    elif "object" in str(dtype):
-                        columns.append(Column(column_name, String(255)))  # type: ignore
-
+                # Rows are clustered on (image_name, depth): a depth window of one image is a
+                # primary key range scan, and the per-image delete of insert_data an index lookup.
                 table = Table(  # pylint: disable=unused-variable
-                    table_name, metadata, *columns, PrimaryKeyConstraint("image_name")
+                    table_name, metadata, *columns, PrimaryKeyConstraint("image_name", "depth")
                 )
                 metadata.create_all(self.engine)
+                self.table_cache.invalidate(table_name)
         except SQLAlchemyError as exc:
             raise DatabaseServiceError("Failed to create table: {}".format(exc)) from exc
 
-    def insert_data(self, table_name: str, dataframe: pd.DataFrame):
+    def insert_data(
+            self,
+            table_name: str,
+            dataframe: pd.DataFrame,
+            replace_image: bool = True,
+            chunk_size: Optional[int] = None,
+            method: Optional[str] = None,
+    ) -> BulkLoadStats:
         """
         Insert data into a table in the database.
 
+        The rows of every image present in the DataFrame replace the rows previously stored for
+        that image in a single transaction, so readers never see a half-written image and rows
+        of other images are left untouched.
+
         Args:
             table_name (str): The name of the table.
             dataframe (pd.DataFrame): The DataFrame to be inserted into the table.
+            replace_image (bool): Delete the stored rows of the uploaded images before inserting.
+                When False the rows are appended.
+            chunk_size (int, optional): The number of rows per insert chunk. Defaults to BULK_INSERT_CHUNK_SIZE.
+            method (str, optional): The BulkLoader method. Defaults to BULK_INSERT_METHOD.
+
+        Returns:
+            BulkLoadStats: The number of rows written and the write throughput.
         """
         try:
             dataframe.reset_index(drop=True, inplace=True)
             self.create_table(table_name, dataframe)
-            dataframe.to_sql(table_name, self.engine, if_exists="replace", index=False)
+            table = self.table_cache.get(table_name)
+            unknown_columns = set(dataframe.columns) - set(table.columns.keys())
+            if unknown_columns:
+                raise DatabaseServiceError(
+                    "Failed to insert data: table {} has no column(s) {}.".format(
+                        table_name, ", ".join(sorted(map(str, unknown_columns)))
+                    )
+                )
+
+            image_names = dataframe["image_name"].unique().tolist()
+            with self.transaction() as connection:
+                if replace_image:
+                    connection.execute(table.delete().where(table.c.image_name.in_(image_names)))
+                columns = [str(column) for column in dataframe.columns]
+                loader = BulkLoader(table, columns, chunk_size=chunk_size, method=method)
+                # tolist() hands the driver native Python values instead of NumPy scalars.
+                return loader.load(connection, zip(*(dataframe[column].tolist() for column in dataframe.columns)))
         except SQLAlchemyError as exc:
             raise DatabaseServiceError("Failed to insert data: {}".format(exc)) from exc
+        finally:
+            if "image_name" in dataframe.columns:
+                self._invalidate_tiles(table_name, dataframe["image_name"].unique().tolist())
+
+    def _invalidate_tiles(self, table_name: str, image_names: List[str]) -> None:
+        if self.tile_cache is not None:
+            for image_name in image_names:
+                self.tile_cache.invalidate(table_name, image_name)
 
     def get_image_data(
             self,
@@ -107,6 +876,7 @@ class DatabaseService:
             colormap: str,
             image_name: str,
             table_name: str = "images",
+            level: int = 0,
     ) -> np.ndarray:
         """
         Get image data from the database based on a depth range and apply a colormap.
@@ -117,41 +887,664 @@ class DatabaseService:
             depth_max (int): The maximum depth.
             colormap (str): The colormap to be applied.
             image_name (str): The name of the image.
+            level (int): The pyramid level, 0 being the full resolution.
 
         Returns:
             np.ndarray: The image data.
 
         Raises:
             DatabaseServiceError: If an error occurs while getting the image data.
-            ColorMapError: If an error occurs while applying the colormap.
+            ColorMapError: If the colormap is not registered.
 
         """
+        # Fail fast on unknown colormaps, before querying the database
+        colormap = self.colormaps.resolve(colormap)
         try:
-            metadata = MetaData()
-            table = Table(table_name, metadata, autoload_with=self.engine)
-            with self.sql_session() as session:
-                result = (
-                    session.query(table)
-                    .filter(
-                        table.columns.depth.between(depth_min, depth_max),
-                        table.columns.image_name == image_name,
-                    )
-                    .all()
-                )
-            dataframe = pd.DataFrame(result)
+            _, image = self.load_image(
+                image_name=image_name,
+                depth_min=depth_min,
+                depth_max=depth_max,
+                table_name=table_name,
+                level=level,
+            )
 
-            if dataframe.empty:
+            if image.shape[0] == 0:
                 raise DatabaseQueryError(
                     "Failed to get image data: No data found for the provided depth range."
                 )
 
-            dataframe = dataframe.drop(columns=["depth", "image_name"])
-            image = np.array(dataframe.values, dtype=np.uint8)
-            image = cv2.applyColorMap(image, getattr(cv2, colormap.upper()))
-            return image
+            return self.colormaps.apply(image, colormap)
         except SQLAlchemyError as exc:
             raise DatabaseServiceError("Failed to get image data: {}".format(exc)) from exc
-        except AttributeError as exc:
-            raise ColorMapError(
-                "Failed to apply custom color mapping to the image: {}".format(exc)
-            ) from exc
+
+    def store_image(
+            self,
+            image_name: str,
+            depths: np.ndarray,
+            pixels: np.ndarray,
+            table_name: str = "images",
+            level: int = 0,
+    ) -> BulkLoadStats:
+        """
+        Store one pyramid level of an image, one row per depth, using the configured storage mode.
+
+        Args:
+            image_name (str): The name of the image.
+            depths (np.ndarray): The depth of every pixel row.
+            pixels (np.ndarray): The uint8 pixel rows, shaped (height, width) or (height, width, channels).
+            table_name (str): The name of the table.
+            level (int): The pyramid level, 0 being the full resolution.
+
+        Returns:
+            BulkLoadStats: The number of rows written and the write throughput.
+
+        Raises:
+            DatabaseServiceError: If an error occurs while storing the image.
+        """
+        return self.store_pyramid(image_name, [(depths, pixels)], table_name, first_level=level)
+
+    @timed("store", size=lambda stats: (stats.rows, None))
+    def store_pyramid(
+            self,
+            image_name: str,
+            levels: Sequence[Tuple[np.ndarray, np.ndarray]],
+            table_name: str = "images",
+            first_level: int = 0,
+    ) -> BulkLoadStats:
+        """
+        Store the pyramid levels of an image, replacing the stored ones.
+
+        All levels and their meta rows are written in a single transaction, so readers see either the
+        previous pyramid or the new one, and a failed store leaves the previous one in place. When the
+        pyramid starts at level 0, levels of a previous upload that the new pyramid does not have are removed.
+
+        Args:
+            image_name (str): The name of the image.
+            levels (Sequence[Tuple[np.ndarray, np.ndarray]]): The (depths, pixels) of each level.
+            table_name (str): The name of the table.
+            first_level (int): The level number of the first entry of levels.
+
+        Returns:
+            BulkLoadStats: The number of rows written and the write throughput, over all levels.
+
+        Raises:
+            DatabaseServiceError: If an error occurs while storing the image.
+        """
+        levels = [_validate_image(depths, pixels) for depths, pixels in levels]
+        level_numbers = list(range(first_level, first_level + len(levels)))
+        rows_table, meta_table = packed_tables(table_name)
+        stats: List[BulkLoadStats] = []
+        try:
+            self.create_packed_tables(table_name)
+            if self.storage_mode == "wide":
+                # Tables are created up front, DDL cannot run inside the transaction on every backend
+                tables = [
+                    self._wide_level_table(table_name, level, pixels)
+                    for level, (_, pixels) in zip(level_numbers, levels)
+                ]
+                with self.transaction() as connection:
+                    self._delete_levels(connection, meta_table, image_name, level_numbers, first_level == 0)
+                    for level, table, (depths, pixels) in zip(level_numbers, tables, levels):
+                        connection.execute(meta_table.insert(), _meta_row(image_name, level, depths, pixels))
+                        stats.append(self._insert_wide_level(connection, table, image_name, depths, pixels))
+            else:
+                with self.transaction() as connection:
+                    for table in (rows_table, meta_table):
+                        self._delete_levels(connection, table, image_name, level_numbers, first_level == 0)
+                    for level, (depths, pixels) in zip(level_numbers, levels):
+                        connection.execute(meta_table.insert(), _meta_row(image_name, level, depths, pixels))
+                        stats.append(
+                            self._insert_packed_level(connection, rows_table, image_name, level, depths, pixels)
+                        )
+        except SQLAlchemyError as exc:
+            raise DatabaseServiceError("Failed to store image: {}".format(exc)) from exc
+        finally:
+            self._invalidate_tiles(table_name, [image_name])
+
+        return BulkLoadStats.combine(stats)
+
+    @timed("store", size=lambda stats: (stats.rows, None))
+    def store_pyramid_chunks(
+            self,
+            image_name: str,
+            chunks: Iterable[Sequence[Tuple[np.ndarray, np.ndarray]]],
+            table_name: str = "images",
+    ) -> BulkLoadStats:
+        """
+        Stream the pyramid of an image into the database chunk by chunk, replacing the stored one.
+
+        Every chunk holds the next rows of each level, starting at level 0, and is written in its own
+        transaction under a temporary staging name, so memory is bounded by the chunk size. Once all
+        chunks are written, a single transaction swaps the staged rows in place of the stored image,
+        so readers never see a partially ingested image. Staged rows are removed if ingest fails.
+
+        Args:
+            image_name (str): The name of the image.
+            chunks (Iterable[Sequence[Tuple[np.ndarray, np.ndarray]]]): The (depths, pixels) of each
+                level, for every chunk.
+            table_name (str): The name of the table.
+
+        Returns:
+            BulkLoadStats: The number of rows written and the write throughput, over all levels.
+
+        Raises:
+            DatabaseServiceError: If an error occurs while storing the image.
+        """
+        staging_name = f"__staging__{uuid.uuid4().hex}"
+        rows_table, meta_table = packed_tables(table_name)
+        meta_rows: Dict[int, Dict[str, Any]] = {}
+        stats: List[BulkLoadStats] = []
+        staged_levels = 0
+        try:
+            self.create_packed_tables(table_name)
+            for chunk in chunks:
+                chunk = [_validate_image(depths, pixels) for depths, pixels in chunk]
+                staged_levels = max(staged_levels, len(chunk))
+                if self.storage_mode == "wide":
+                    tables = [
+                        self._wide_level_table(table_name, level, pixels)
+                        for level, (_, pixels) in enumerate(chunk)
+                    ]
+                    with self.transaction() as connection:
+                        for table, (depths, pixels) in zip(tables, chunk):
+                            stats.append(
+                                self._insert_wide_level(
+                                    connection, table, staging_name, depths, pixels, replace_image=False
+                                )
+                            )
+                else:
+                    with self.transaction() as connection:
+                        for level, (depths, pixels) in enumerate(chunk):
+                            stats.append(
+                                self._insert_packed_level(
+                                    connection, rows_table, staging_name, level, depths, pixels
+                                )
+                            )
+                for level, (depths, pixels) in enumerate(chunk):
+                    _merge_meta_row(meta_rows, _meta_row(image_name, level, depths, pixels))
+
+            if self.storage_mode == "wide":
+                row_tables = [self.table_cache.get(level_table_name(table_name, level)) for level in meta_rows]
+            else:
+                row_tables = [rows_table]
+            with self.transaction() as connection:
+                for table in row_tables:
+                    connection.execute(table.delete().where(table.c.image_name == image_name))
+                    connection.execute(
+                        table.update()
+                        .where(table.c.image_name == staging_name)
+                        .values(image_name=image_name)
+                    )
+                connection.execute(meta_table.delete().where(meta_table.c.image_name == image_name))
+                if meta_rows:
+                    connection.execute(meta_table.insert(), list(meta_rows.values()))
+        except Exception as exc:
+            self._discard_staged_rows(staging_name, table_name, staged_levels)
+            if isinstance(exc, SQLAlchemyError):
+                raise DatabaseServiceError("Failed to store image: {}".format(exc)) from exc
+            raise
+        finally:
+            self._invalidate_tiles(table_name, [image_name])
+
+        return BulkLoadStats.combine(stats)
+
+    def _discard_staged_rows(self, staging_name: str, table_name: str, level_count: int) -> None:
+        try:
+            if self.storage_mode == "wide":
+                tables = [
+                    self.table_cache.get(level_table_name(table_name, level)) for level in range(level_count)
+                ]
+            else:
+                tables = [packed_tables(table_name)[0]]
+            with self.transaction() as connection:
+                for table in tables:
+                    connection.execute(table.delete().where(table.c.image_name == staging_name))
+        except SQLAlchemyError as exc:
+            logger.warning("Failed to discard staged rows of %s: %s", staging_name, exc)
+
+    @staticmethod
+    def _insert_packed_level(
+            connection: Connection,
+            rows_table: Table,
+            image_name: str,
+            level: int,
+            depths: np.ndarray,
+            pixels: np.ndarray,
+    ) -> BulkLoadStats:
+        loader = BulkLoader(rows_table, ("image_name", "level", "depth", "pixels"))
+        return loader.load(
+            connection,
+            ((image_name, level, depth, row.tobytes()) for depth, row in zip(depths.tolist(), pixels)),
+        )
+
+    @staticmethod
+    def _delete_levels(
+            connection: Connection,
+            table: Table,
+            image_name: str,
+            levels: List[int],
+            all_levels: bool,
+    ) -> None:
+        condition = table.c.image_name == image_name
+        if not all_levels:
+            condition = condition & table.c.level.in_(levels)
+        connection.execute(table.delete().where(condition))
+
+    def _wide_level_table(self, table_name: str, level: int, pixels: np.ndarray) -> Table:
+        level_table = level_table_name(table_name, level)
+        pixel_count = int(np.prod(pixels.shape[1:]))
+        try:
+            table = self.create_wide_table(level_table, pixel_count)
+        except SQLAlchemyError as exc:
+            raise DatabaseServiceError("Failed to insert data: {}".format(exc)) from exc
+        unknown_columns = {f"pixel_{index}" for index in range(pixel_count)} - set(table.columns.keys())
+        if unknown_columns:
+            raise DatabaseServiceError(
+                "Failed to insert data: table {} has {} pixel columns, the image has {}.".format(
+                    level_table, len(table.columns) - 2, pixel_count
+                )
+            )
+        return table
+
+    @staticmethod
+    def _insert_wide_level(
+            connection: Connection,
+            table: Table,
+            image_name: str,
+            depths: np.ndarray,
+            pixels: np.ndarray,
+            replace_image: bool = True,
+    ) -> BulkLoadStats:
+        flattened = pixels.reshape(pixels.shape[0], -1)
+        columns = [f"pixel_{index}" for index in range(flattened.shape[1])]
+        if replace_image:
+            connection.execute(table.delete().where(table.c.image_name == image_name))
+        loader = BulkLoader(table, ["image_name", "depth"] + columns)
+        # tolist() hands the driver native Python values instead of NumPy scalars.
+        return loader.load(
+            connection,
+            ((image_name, depth, *row) for depth, row in zip(depths.tolist(), flattened.tolist())),
+        )
+
+    @timed("levels", size=None)
+    def image_levels(self, image_name: str, table_name: str = "images") -> List[Dict[str, Any]]:
+        """
+        Get the stored pyramid levels of an image.
+
+        Args:
+            image_name (str): The name of the image.
+            table_name (str): The name of the table.
+
+        Returns:
+            List[Dict[str, Any]]: The level, height, width, channels and depth extent of every level,
+            finest level first.
+        """
+        _, meta_table = packed_tables(table_name)
+        try:
+            with self.connection() as connection:
+                result = connection.execute(
+                    select(meta_table)
+                    .where(meta_table.c.image_name == image_name)
+                    .order_by(meta_table.c.level)
+                )
+                return [dict(row._mapping) for row in result]
+        except SQLAlchemyError as exc:
+            raise DatabaseServiceError("Failed to get image levels: {}".format(exc)) from exc
+
+    def select_level(
+            self,
+            image_name: str,
+            depth_min: float,
+            depth_max: float,
+            target_height: Optional[int] = None,
+            target_width: Optional[int] = None,
+            table_name: str = "images",
+    ) -> int:
+        """
+        Pick the coarsest pyramid level that still renders a depth range at the target size.
+
+        The number of rows of a level within the range is estimated from the level's height and depth extent.
+
+        Args:
+            image_name (str): The name of the image.
+            depth_min (float): The minimum depth.
+            depth_max (float): The maximum depth.
+            target_height (int, optional): The minimum number of rows wanted.
+            target_width (int, optional): The minimum number of columns wanted.
+            table_name (str): The name of the table.
+
+        Returns:
+            int: The selected level, 0 when no target is given or no coarser level is large enough.
+        """
+        if target_height is None and target_width is None:
+            return 0
+        return pick_level(self.image_levels(image_name, table_name), depth_min, depth_max, target_height, target_width)
+
+    def load_image(
+            self,
+            image_name: str,
+            depth_min: float,
+            depth_max: float,
+            table_name: str = "images",
+            level: int = 0,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Load the pixel rows of an image within a depth range, using the configured storage mode.
+
+        Args:
+            image_name (str): The name of the image.
+            depth_min (float): The minimum depth.
+            depth_max (float): The maximum depth.
+            table_name (str): The name of the table.
+            level (int): The pyramid level, 0 being the full resolution.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The depths and the uint8 pixel rows. Packed images keep
+            their channel axis when they have more than one channel.
+
+        Raises:
+            SQLAlchemyError: If an error occurs while querying the database.
+        """
+        if self.tile_cache is not None:
+            return self.tile_cache.load(
+                table_name,
+                image_name,
+                depth_min,
+                depth_max,
+                lambda name, low, high: self._query_image(name, low, high, table_name, level),
+                level=level,
+            )
+        return self._query_image(image_name, depth_min, depth_max, table_name, level)
+
+    @timed("query")
+    def _query_image(
+            self,
+            image_name: str,
+            depth_min: float,
+            depth_max: float,
+            table_name: str,
+            level: int,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        if self.storage_mode == "wide":
+            return self._load_wide_image(image_name, depth_min, depth_max, table_name, level)
+
+        rows_table, meta_table = packed_tables(table_name)
+        with self.connection() as connection:
+            shape = connection.execute(
+                select(meta_table.c.width, meta_table.c.channels).where(
+                    meta_table.c.image_name == image_name,
+                    meta_table.c.level == level,
+                )
+            ).first()
+            if shape is None:
+                return np.empty(0, dtype=np.float64), np.empty((0, 0), dtype=np.uint8)
+            result = connection.execute(
+                self._range_query(image_name, depth_min, depth_max, table_name, level)
+            ).all()
+        return _packed_rows_to_arrays(result, *shape)
+
+    def _load_wide_image(
+            self,
+            image_name: str,
+            depth_min: float,
+            depth_max: float,
+            table_name: str,
+            level: int,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        with self.connection() as connection:
+            result = connection.execute(
+                self._range_query(image_name, depth_min, depth_max, table_name, level)
+            ).all()
+        return _wide_rows_to_arrays(result)
+
+    def iter_image(
+            self,
+            image_name: str,
+            depth_min: float,
+            depth_max: float,
+            table_name: str = "images",
+            level: int = 0,
+            strip_rows: int = 1024,
+    ) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Stream the pixel rows of an image within a depth range, in strips of at most strip_rows rows.
+
+        Every strip is its own query of at most strip_rows rows, resuming after the last depth read
+        (keyset paging on the primary key), so memory stays bounded by the strip size whatever the
+        depth range, without relying on server-side cursors, which mysql-connector does not support.
+        The tile cache is bypassed, as a deep range would only evict hot tiles. A pooled connection
+        is held until the iterator is exhausted or closed.
+
+        Args:
+            image_name (str): The name of the image.
+            depth_min (float): The minimum depth.
+            depth_max (float): The maximum depth.
+            table_name (str): The name of the table.
+            level (int): The pyramid level, 0 being the full resolution.
+            strip_rows (int): The largest number of rows per strip.
+
+        Yields:
+            Tuple[np.ndarray, np.ndarray]: The depths and the uint8 pixel rows of every strip, by
+            increasing depth.
+
+        Raises:
+            DatabaseServiceError: If an error occurs while querying the database.
+        """
+        try:
+            with self.connection() as connection:
+                shape = None
+                if self.storage_mode != "wide":
+                    _, meta_table = packed_tables(table_name)
+                    shape = connection.execute(
+                        select(meta_table.c.width, meta_table.c.channels).where(
+                            meta_table.c.image_name == image_name,
+                            meta_table.c.level == level,
+                        )
+                    ).first()
+                    if shape is None:
+                        return
+                query = self._range_query(image_name, depth_min, depth_max, table_name, level)
+                depth = query.selected_columns.depth
+                last_depth = None
+                while True:
+                    page = query if last_depth is None else query.where(depth > last_depth)
+                    rows = connection.execute(page.limit(strip_rows)).all()
+                    if not rows:
+                        return
+                    yield _wide_rows_to_arrays(rows) if shape is None else _packed_rows_to_arrays(rows, *shape)
+                    if len(rows) < strip_rows:
+                        return
+                    last_depth = rows[-1].depth
+        except SQLAlchemyError as exc:
+            raise DatabaseServiceError("Failed to stream image data: {}".format(exc)) from exc
+
+    def _range_query(
+            self,
+            image_name: str,
+            depth_min: float,
+            depth_max: float,
+            table_name: str,
+            level: int = 0,
+    ) -> Select:
+        """
+        Build the depth range query of an image. Both storage modes key their rows on
+        (image_name, [level,] depth), so the query is a range scan of the primary key.
+        """
+        if self.storage_mode == "wide":
+            table = self.table_cache.get(level_table_name(table_name, level))
+            pixel_columns = [column for column in table.columns if column.name not in ("depth", "image_name")]
+            query = select(table.c.depth, *pixel_columns).where(table.c.image_name == image_name)
+        else:
+            table, _ = packed_tables(table_name)
+            query = select(table.c.depth, table.c.pixels).where(
+                table.c.image_name == image_name,
+                table.c.level == level,
+            )
+        return query.where(table.c.depth.between(depth_min, depth_max)).order_by(table.c.depth)
+
+    def explain_range_query(
+            self,
+            image_name: str,
+            depth_min: float,
+            depth_max: float,
+            table_name: str = "images",
+            level: int = 0,
+    ) -> List[Dict[str, Any]]:
+        """
+        Get the database's query plan of the depth range query used by load_image.
+
+        Args:
+            image_name (str): The name of the image.
+            depth_min (float): The minimum depth.
+            depth_max (float): The maximum depth.
+            table_name (str): The name of the table.
+            level (int): The pyramid level.
+
+        Returns:
+            List[Dict[str, Any]]: The rows returned by EXPLAIN (EXPLAIN QUERY PLAN on SQLite).
+        """
+        query = self._range_query(image_name, depth_min, depth_max, table_name, level)
+        statement = str(query.compile(self.engine, compile_kwargs={"literal_binds": True}))
+        prefix = "EXPLAIN QUERY PLAN" if self.engine.dialect.name == "sqlite" else "EXPLAIN"
+        with self.connection() as connection:
+            result = connection.exec_driver_sql(f"{prefix} {statement}")
+            return [dict(row._mapping) for row in result]
+
+    def claim_seed(self, seed_name: str, fingerprint: str, stale_after: float) -> str:
+        """
+        Claim the seeding of an image for this worker, unless its data is already seeded or being seeded.
+
+        The workers of a deployment share the seeds table: the first one to claim an image seeds it, the
+        others find it busy, then ready. Claims are a compare-and-set on the image's row, so they hold
+        across processes and hosts. A claim older than stale_after seconds is taken over, as its worker
+        is assumed dead.
+
+        Args:
+            seed_name (str): The name of the seeded image.
+            fingerprint (str): The fingerprint of the data to seed, e.g. a hash of the source file.
+            stale_after (float): The seconds after which a running seed is deemed abandoned.
+
+        Returns:
+            str: SEED_READY if the data is already seeded, SEED_CLAIMED if this worker must seed it and
+            then call finish_seed, SEED_BUSY if another worker is seeding it.
+
+        Raises:
+            DatabaseServiceError: If an error occurs while claiming the seed.
+        """
+        try:
+            self.create_seeds_table()
+            with self.transaction() as connection:
+                row = connection.execute(
+                    select(SEEDS_TABLE).where(SEEDS_TABLE.c.seed_name == seed_name)
+                ).first()
+                now = time.time()
+                row = dict(row._mapping) if row is not None else None
+                claim = seed_claim(row, fingerprint, stale_after, now)
+                if claim != SEED_CLAIMED:
+                    return claim
+                values = {"fingerprint": fingerprint, "status": "seeding", "updated_at": now}
+                if row is None:
+                    connection.execute(SEEDS_TABLE.insert().values(seed_name=seed_name, **values))
+                    return SEED_CLAIMED
+                claimed = connection.execute(
+                    SEEDS_TABLE.update()
+                    .where(
+                        SEEDS_TABLE.c.seed_name == seed_name,
+                        SEEDS_TABLE.c.status == row["status"],
+                        SEEDS_TABLE.c.updated_at == row["updated_at"],
+                    )
+                    .values(**values)
+                )
+                return SEED_CLAIMED if claimed.rowcount == 1 else SEED_BUSY
+        except IntegrityError:
+            # Another worker inserted its claim first
+            return SEED_BUSY
+        except SQLAlchemyError as exc:
+            raise DatabaseServiceError("Failed to claim seed: {}".format(exc)) from exc
+
+    def finish_seed(self, seed_name: str, fingerprint: str, success: bool) -> None:
+        """
+        Record the end of a seed claimed with claim_seed.
+
+        Args:
+            seed_name (str): The name of the seeded image.
+            fingerprint (str): The fingerprint the seed was claimed with.
+            success (bool): Whether the data was stored. A failed seed can be claimed again right away.
+
+        Raises:
+            DatabaseServiceError: If an error occurs while recording the seed.
+        """
+        try:
+            with self.transaction() as connection:
+                connection.execute(
+                    SEEDS_TABLE.update()
+                    .where(
+                        SEEDS_TABLE.c.seed_name == seed_name,
+                        SEEDS_TABLE.c.fingerprint == fingerprint,
+                        SEEDS_TABLE.c.status == "seeding",
+                    )
+                    .values(status="ready" if success else "failed", updated_at=time.time())
+                )
+        except SQLAlchemyError as exc:
+            raise DatabaseServiceError("Failed to record seed: {}".format(exc)) from exc
+
+    def refresh_seed(self, seed_name: str, fingerprint: str) -> None:
+        """
+        Record that a seed claimed with claim_seed is still running, so that other workers do not take
+        it over as abandoned while it takes longer than their stale_after.
+
+        Args:
+            seed_name (str): The name of the seeded image.
+            fingerprint (str): The fingerprint the seed was claimed with.
+
+        Raises:
+            DatabaseServiceError: If an error occurs while recording the seed.
+        """
+        try:
+            with self.transaction() as connection:
+                connection.execute(
+                    SEEDS_TABLE.update()
+                    .where(
+                        SEEDS_TABLE.c.seed_name == seed_name,
+                        SEEDS_TABLE.c.fingerprint == fingerprint,
+                        SEEDS_TABLE.c.status == "seeding",
+                    )
+                    .values(updated_at=time.time())
+                )
+        except SQLAlchemyError as exc:
+            raise DatabaseServiceError("Failed to record seed: {}".format(exc)) from exc
+
+    def create_seeds_table(self) -> None:
+        """
+        Create the seeds table if it does not exist.
+        """
+        try:
+            if inspect(self.engine).has_table(SEEDS_TABLE.name):
+                return
+            if not database_exists(self.engine.url):
+                create_database(self.engine.url)
+            SEEDS_TABLE.create(self.engine, checkfirst=True)
+        except SQLAlchemyError as exc:
+            # Workers starting together race to create the table, losing the race is fine
+            if inspect(self.engine).has_table(SEEDS_TABLE.name):
+                return
+            raise DatabaseServiceError("Failed to create table: {}".format(exc)) from exc
+
+    def create_packed_tables(self, table_name: str = "images") -> None:
+        """
+        Create the packed row and metadata tables if they do not exist.
+
+        Args:
+            table_name (str): The name of the image table the packed tables belong to.
+        """
+        try:
+            rows_table, meta_table = packed_tables(table_name)
+            inspector = inspect(self.engine)
+            if inspector.has_table(rows_table.name) and inspector.has_table(meta_table.name):
+                return
+            if not database_exists(self.engine.url):
+                create_database(self.engine.url)
+            rows_table.create(self.engine, checkfirst=True)
+            meta_table.create(self.engine, checkfirst=True)
+        except SQLAlchemyError as exc:
+            raise DatabaseServiceError("Failed to create table: {}".format(exc)) from exc
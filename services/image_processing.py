@@ -1,9 +1,44 @@
 """Image related module."""
+import io
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import cv2
 import numpy as np
 import pandas as pd
 from PIL import Image
 
-from exceptions.exceptions import DataCleanerError
+from exceptions.exceptions import DataCleanerError, ImageProcessingError
+from services.metrics import timed
+from services.parallel import map_strips
+
+BufferLike = Union[bytes, bytearray, memoryview]
+
+# Upper bound of a .npy header: magic, version, 4-byte length and a 65535-byte dict (format 2.0 allows
+# more, which no 2D or 3D uint8 array needs)
+_NPY_MAX_HEADER_BYTES = 65536 + 12
+
+
+RESAMPLING_FILTERS = {
+    "area": cv2.INTER_AREA,
+    "bilinear": cv2.INTER_LINEAR,
+    "lanczos": cv2.INTER_LANCZOS4,
+}
+
+
+def _lanczos(x: np.ndarray, lobes: int = 3) -> np.ndarray:
+    """Lanczos kernel with the given number of lobes."""
+    return np.where(np.abs(x) < lobes, np.sinc(x) * np.sinc(x / lobes), 0.0)
+
+
+def _to_uint8(values: np.ndarray) -> np.ndarray:
+    """Convert pixel values to uint8, rejecting values that do not fit instead of wrapping them."""
+    if values.dtype == np.uint8:
+        return values
+    if values.dtype.kind not in "iuf":
+        raise ValueError("pixel values must be numbers within 0..255.")
+    if values.size and (not np.isfinite(values.min()) or values.min() < 0 or values.max() > 255):
+        raise ValueError("pixel values must be numbers within 0..255.")
+    return values.astype(np.uint8)
 
 
 class ImageProcessingService:
@@ -17,6 +52,7 @@ class ImageProcessingService:
         """
         self.file_path = file_path
 
+    @timed("csv_parse", size=lambda data: (len(data), None))
     def clean_data(self) -> pd.DataFrame:
         """
         Read data from a CSV file, drop rows with missing data, and return the cleaned DataFrame.
@@ -46,6 +82,147 @@ class ImageProcessingService:
 
         return image_data
 
+    def iter_clean_data(
+            self,
+            chunk_rows: int,
+            depth_dtype: type = np.float64,
+    ) -> Iterator[pd.DataFrame]:
+        """
+        Read the CSV file in chunks with compact dtypes, and yield each chunk once its rows with
+        missing data are dropped.
+
+        Pixel columns are parsed as nullable int16 (two bytes per value instead of the eight bytes
+        of float64; pandas would silently wrap out-of-range values parsed as uint8), range checked,
+        and converted to plain uint8 once the missing rows are gone.
+
+        Args:
+            chunk_rows (int): The number of CSV rows parsed per chunk.
+            depth_dtype (type): The dtype of the depth column.
+
+        Yields:
+            pd.DataFrame: The cleaned chunks.
+
+        Raises:
+            DataCleanerError: If an error occurs while reading the file, parsing the CSV, or cleaning the data.
+        """
+        try:
+            columns = pd.read_csv(self.file_path, nrows=0).columns
+            dtypes = {column: ("Int16" if column != "depth" else depth_dtype) for column in columns}
+            reader = pd.read_csv(self.file_path, dtype=dtypes, chunksize=chunk_rows)
+            for chunk in reader:
+                chunk = chunk.dropna()
+                pixel_columns = [column for column in chunk.columns if column != "depth"]
+                pixels = chunk[pixel_columns].to_numpy(dtype=np.int16)
+                if pixels.size and (pixels.min() < 0 or pixels.max() > 255):
+                    raise ValueError("pixel values must lie within 0..255.")
+                yield chunk.astype({column: np.uint8 for column in pixel_columns})
+        except FileNotFoundError as exc:
+            raise DataCleanerError(
+                "The file specified in file_path does not exist."
+            ) from exc
+        except (pd.errors.ParserError, ValueError, TypeError) as exc:
+            raise DataCleanerError(
+                f"Invalid pixel value encountered while parsing the CSV file. {exc}"
+            ) from exc
+
+    def iter_image_chunks(
+            self,
+            chunk_rows: int,
+            block_rows: int = 1,
+    ) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Stream the cleaned CSV file as (depths, uint8 pixel rows) chunks.
+
+        Rows dropped while cleaning are made up for from the next chunk, so that every chunk but
+        the last holds a multiple of block_rows rows. Chunks can then be halved block_rows times
+        independently of each other, e.g. to build the pyramid of each chunk.
+
+        Args:
+            chunk_rows (int): The number of CSV rows parsed per chunk.
+            block_rows (int): Every chunk but the last holds a multiple of this many rows.
+
+        Yields:
+            Tuple[np.ndarray, np.ndarray]: The depths and pixel rows of each chunk.
+
+        Raises:
+            DataCleanerError: If an error occurs while reading, parsing or cleaning the data.
+        """
+        chunk_rows = max(chunk_rows, block_rows)
+        pending_depths: List[np.ndarray] = []
+        pending_pixels: List[np.ndarray] = []
+        pending_rows = 0
+        for chunk in self.iter_clean_data(chunk_rows):
+            depths, pixels = self.frame_to_arrays(chunk)
+            pending_depths.append(depths)
+            pending_pixels.append(pixels)
+            pending_rows += len(chunk)
+            if pending_rows < chunk_rows:
+                continue
+            ready_rows = pending_rows - pending_rows % block_rows
+            depths, pixels = np.concatenate(pending_depths), np.concatenate(pending_pixels)
+            yield depths[:ready_rows], pixels[:ready_rows]
+            pending_depths, pending_pixels = [depths[ready_rows:]], [pixels[ready_rows:]]
+            pending_rows -= ready_rows
+        if pending_rows:
+            yield np.concatenate(pending_depths), np.concatenate(pending_pixels)
+
+    @staticmethod
+    @timed("to_arrays")
+    def frame_to_arrays(data: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Split a cleaned DataFrame into its depths and uint8 pixel rows, the CSV boundary of the
+        ndarray pipeline.
+
+        Args:
+            data (pd.DataFrame): The cleaned data, with a depth column and one column per pixel value.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The float64 depths and the uint8 pixel rows.
+
+        Raises:
+            DataCleanerError: If a pixel value is not a uint8 value.
+        """
+        pixel_columns = [column for column in data.columns if column not in ("depth", "image_name")]
+        try:
+            return (
+                data["depth"].to_numpy(dtype=np.float64),
+                _to_uint8(data[pixel_columns].to_numpy()),
+            )
+        except (KeyError, TypeError, ValueError) as exc:
+            raise DataCleanerError(f"Invalid image data. {exc}") from exc
+
+    @staticmethod
+    @timed("to_arrays")
+    def columns_to_arrays(data: Dict[str, List[Any]]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Build the depths and uint8 pixel rows of an image from a mapping of column names to values,
+        without going through a DataFrame.
+
+        Each pixel column is written straight into one preallocated uint8 array.
+
+        Args:
+            data (Dict[str, List[Any]]): The depth column and one column per pixel value. An
+                image_name column is ignored.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The float64 depths and the uint8 pixel rows.
+
+        Raises:
+            DataCleanerError: If the columns differ in length, or a pixel value is not a uint8 value.
+        """
+        pixel_columns = [column for column in data if column not in ("depth", "image_name")]
+        try:
+            depths = np.asarray(data["depth"], dtype=np.float64)
+            pixels = np.empty((len(depths), len(pixel_columns)), dtype=np.uint8)
+            for index, column in enumerate(pixel_columns):
+                values = np.asarray(data[column])
+                if values.shape != depths.shape:
+                    raise ValueError(f"column {column} holds {len(values)} values for {len(depths)} depths.")
+                pixels[:, index] = _to_uint8(values)
+        except (KeyError, TypeError, ValueError) as exc:
+            raise DataCleanerError(f"Invalid image data. {exc}") from exc
+        return depths, pixels
+
     @staticmethod
     def dataframe_to_image(data: pd.DataFrame) -> Image.Image:
         """
@@ -61,9 +238,8 @@ class ImageProcessingService:
             DataCleanerError: If an error occurs while converting the DataFrame to an image.
         """
         try:
-            # Defensive programming: Drop the depth column if it exists
-            if "depth" in data.columns:
-                data = data.drop(columns=["depth", "image_name"], axis=1)
+            # Defensive programming: Drop the depth and image name columns if they exist
+            data = data.drop(columns=["depth", "image_name"], errors="ignore")
 
             # Convert the DataFrame values directly into an image
             image = Image.fromarray(np.uint8(data.values))
@@ -134,3 +310,408 @@ class ImageProcessingService:
             ) from exc
 
         return data
+
+    @staticmethod
+    @timed("pyramid", size=None)
+    def build_pyramid(
+            pixels: np.ndarray,
+            depths: np.ndarray,
+            levels: int,
+            min_width: int = 1,
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Build a multi-resolution pyramid of an image: the image itself, then halves in both axes.
+
+        Each coarser row is the area average of two consecutive rows, and its depth the mean of
+        their depths, so the rows and the depth axis stay aligned at every level. An odd last row
+        is dropped before halving.
+
+        Large images are split into strips of a multiple of 2 ** (levels - 1) rows, which halve
+        independently into the same rows, and the pyramids of the strips are built on several threads.
+
+        Args:
+            pixels (np.ndarray): The uint8 pixel rows of the full-resolution level.
+            depths (np.ndarray): The depth of every pixel row.
+            levels (int): The maximum number of levels, including the full resolution.
+            min_width (int): Levels narrower than this are not built.
+
+        Returns:
+            List[Tuple[np.ndarray, np.ndarray]]: The (depths, pixels) of every level, finest first.
+
+        Raises:
+            DataCleanerError: If an error occurs while resampling the image.
+        """
+        pixels = np.ascontiguousarray(pixels, dtype=np.uint8)
+        depths = np.asarray(depths, dtype=np.float64)
+        strips = map_strips(
+            lambda start, stop: ImageProcessingService._build_strip_pyramid(
+                pixels[start:stop], depths[start:stop], levels, min_width
+            ),
+            pixels.shape[0],
+            align=2 ** max(levels - 1, 0),
+        )
+        if len(strips) == 1:
+            return strips[0]
+        # The first strip is at least 2 ** (levels - 1) rows high, so it has all the levels of the image;
+        # the last one may lack the coarsest levels, for which its rows are dropped before halving
+        return [(depths, pixels)] + [
+            (
+                np.concatenate([strip[level][0] for strip in strips if len(strip) > level]),
+                np.concatenate([strip[level][1] for strip in strips if len(strip) > level]),
+            )
+            for level in range(1, len(strips[0]))
+        ]
+
+    @staticmethod
+    def _build_strip_pyramid(
+            pixels: np.ndarray,
+            depths: np.ndarray,
+            levels: int,
+            min_width: int,
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Build the pyramid of contiguous pixel rows, see build_pyramid."""
+        try:
+            pyramid = [(depths, pixels)]
+            while len(pyramid) < levels:
+                height, width = pixels.shape[:2]
+                if height < 2 or width // 2 < max(min_width, 1):
+                    break
+                even_height = height - height % 2
+                pixels = cv2.resize(
+                    pixels[:even_height], (width // 2, even_height // 2), interpolation=cv2.INTER_AREA
+                )
+                depths = depths[:even_height].reshape(-1, 2).mean(axis=1)
+                pyramid.append((depths, pixels))
+        except cv2.error as exc:
+            raise DataCleanerError(f"An error occurred while building the image pyramid. {exc}") from exc
+
+        return pyramid
+
+    @staticmethod
+    def split_pyramid(
+            pyramid: Sequence[Tuple[np.ndarray, np.ndarray]],
+            chunk_rows: int,
+    ) -> Iterator[List[Tuple[np.ndarray, np.ndarray]]]:
+        """
+        Split a pyramid into chunks holding the next rows of each level, as store_pyramid_chunks expects.
+
+        Every chunk covers chunk_rows rows of the full resolution, rounded up to a multiple of
+        2 ** (levels - 1) so that it covers exactly half as many rows at every next level. The chunks
+        are views, the rows are not copied.
+
+        Args:
+            pyramid (Sequence[Tuple[np.ndarray, np.ndarray]]): The (depths, pixels) of every level, finest first.
+            chunk_rows (int): The number of full-resolution rows per chunk.
+
+        Yields:
+            List[Tuple[np.ndarray, np.ndarray]]: The (depths, pixels) of each level, for every chunk. Levels
+            left without rows in the last chunk are omitted.
+        """
+        block_rows = 2 ** (len(pyramid) - 1)
+        chunk_rows = -(-max(chunk_rows, 1) // block_rows) * block_rows
+        total_rows = len(pyramid[0][0])
+        for start in range(0, total_rows, chunk_rows):
+            last = start + chunk_rows >= total_rows
+            chunk = []
+            for level, (depths, pixels) in enumerate(pyramid):
+                level_start = start >> level
+                level_stop = len(depths) if last else (start + chunk_rows) >> level
+                if level_stop <= level_start:
+                    break
+                chunk.append((depths[level_start:level_stop], pixels[level_start:level_stop]))
+            yield chunk
+
+    @staticmethod
+    @timed("resample")
+    def resample(
+            pixels: np.ndarray,
+            depths: np.ndarray,
+            width: Optional[int] = None,
+            height: Optional[int] = None,
+            depth_step: Optional[float] = None,
+            method: str = "area",
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Resample pixel rows and their depth axis together.
+
+        The output rows are sampled at the same positions as OpenCV samples them, and each output
+        depth is the depth at that position, so rows and depths stay aligned whatever the scale.
+        With a depth step, rows are resampled onto the regular depth grid of the multiples of the
+        step within the depth range of the image, interpolating between irregularly spaced rows.
+
+        Args:
+            pixels (np.ndarray): The (height, width) or (height, width, channels) uint8 pixel rows.
+            depths (np.ndarray): The depth of every pixel row.
+            width (int, optional): The output width. The width is kept when omitted.
+            height (int, optional): The output number of rows. Ignored when depth_step is given.
+            depth_step (float, optional): The depth between consecutive output rows.
+            method (str): The resampling filter: "area", "bilinear" or "lanczos".
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The resampled depths and uint8 pixel rows.
+
+        Raises:
+            DataCleanerError: If the arguments are invalid or an error occurs while resampling.
+        """
+        if method not in RESAMPLING_FILTERS:
+            raise DataCleanerError(
+                f"Unknown resampling filter {method}, expected one of {', '.join(RESAMPLING_FILTERS)}."
+            )
+        pixels = np.ascontiguousarray(pixels, dtype=np.uint8)
+        depths = np.asarray(depths, dtype=np.float64)
+        if depths.shape != pixels.shape[:1]:
+            raise DataCleanerError(f"Got {len(depths)} depths for {pixels.shape[0]} pixel rows.")
+        if (width is not None and width <= 0) or (height is not None and height <= 0):
+            raise DataCleanerError("The output width and height must be positive.")
+        if depth_step is not None and not depth_step > 0:
+            raise DataCleanerError("The depth step must be positive.")
+        if pixels.shape[0] == 0:
+            return depths, pixels
+
+        if depths.size > 1 and (np.diff(depths) < 0).any():
+            order = np.argsort(depths, kind="stable")
+            depths, pixels = depths[order], pixels[order]
+
+        interpolation = RESAMPLING_FILTERS[method]
+        try:
+            source_height, source_width = pixels.shape[:2]
+            if width is not None and width != source_width:
+                pixels = ImageProcessingService._resize_width(pixels, width, interpolation)
+
+            if depth_step is not None:
+                first = np.ceil(depths[0] / depth_step)
+                last = np.floor(depths[-1] / depth_step)
+                grid = np.arange(first, last + 1) * depth_step
+                rows = np.interp(grid, depths, np.arange(source_height, dtype=np.float64))
+                return grid, ImageProcessingService._resample_rows(pixels, rows, method)
+
+            if height is not None and height != source_height:
+                pixels = cv2.resize(pixels, (pixels.shape[1], height), interpolation=interpolation)
+                # Output row i is centered on input row (i + 0.5) * scale - 0.5, as in cv2.resize
+                rows = (np.arange(height) + 0.5) * (source_height / height) - 0.5
+                depths = np.interp(rows, np.arange(source_height, dtype=np.float64), depths)
+        except cv2.error as exc:
+            raise DataCleanerError(f"An error occurred while resampling the image. {exc}") from exc
+
+        return depths, pixels
+
+    @staticmethod
+    def _resize_width(pixels: np.ndarray, width: int, interpolation: int) -> np.ndarray:
+        """
+        Resize pixel rows to a new width, keeping the number of rows.
+
+        Without vertical scaling OpenCV computes every output row from its input row only, so row
+        strips are resized independently into the output.
+        """
+        resized = np.empty((pixels.shape[0], width) + pixels.shape[2:], dtype=np.uint8)
+
+        def resize_strip(start: int, stop: int) -> None:
+            cv2.resize(pixels[start:stop], (width, stop - start), dst=resized[start:stop], interpolation=interpolation)
+
+        map_strips(resize_strip, pixels.shape[0])
+        return resized
+
+    @staticmethod
+    def _resample_rows(pixels: np.ndarray, rows: np.ndarray, method: str) -> np.ndarray:
+        """
+        Sample pixel rows at fractional, increasing row positions with a resampling filter.
+
+        Every output row is computed from the input rows under its filter footprint only, so strips of
+        output rows are sampled independently, each reading the input rows around it.
+        """
+        height = pixels.shape[0]
+        if rows.size == 0:
+            return pixels[:0]
+        # Rows between two output rows, the scale of the filter footprint
+        spacing = np.maximum(np.gradient(rows) if rows.size > 1 else np.ones(1), 1.0)
+        source = pixels.astype(np.float32)
+        trailing = (slice(None),) + (None,) * (pixels.ndim - 1)
+        resampled = np.empty((rows.size,) + pixels.shape[1:], dtype=np.uint8)
+
+        if method == "area":
+            # Average of the rows under a box of the output spacing, from the running sum of the rows:
+            # input row k covers [k, k + 1)
+            running = np.zeros((height + 1,) + pixels.shape[1:], dtype=np.float64)
+            np.cumsum(source, axis=0, out=running[1:])
+        elif method == "lanczos":
+            # Lanczos-3, stretched by the spacing when downsampling to avoid aliasing
+            taps = int(np.ceil(2 * (3 * spacing).max()))
+
+        def resample_strip(first_row: int, last_row: int) -> None:
+            strip_rows, strip_spacing = rows[first_row:last_row], spacing[first_row:last_row]
+            if method == "bilinear":
+                lower = np.clip(np.floor(strip_rows).astype(np.int64), 0, height - 1)
+                upper = np.minimum(lower + 1, height - 1)
+                weight = (strip_rows - lower).astype(np.float32)[trailing]
+                values = source[lower] * (1 - weight) + source[upper] * weight
+            elif method == "area":
+                start = np.clip(strip_rows + 0.5 - strip_spacing / 2, 0, height)
+                stop = np.clip(strip_rows + 0.5 + strip_spacing / 2, 0, height)
+
+                def integral(position: np.ndarray) -> np.ndarray:
+                    row = np.minimum(np.floor(position).astype(np.int64), height - 1)
+                    return running[row] + (position - row)[trailing] * source[row]
+
+                values = (integral(stop) - integral(start)) / (stop - start)[trailing]
+            else:
+                first = np.floor(strip_rows - 3 * strip_spacing).astype(np.int64) + 1
+                values = np.zeros((strip_rows.size,) + pixels.shape[1:], dtype=np.float32)
+                total = np.zeros(strip_rows.size, dtype=np.float64)
+                for tap in range(taps):
+                    row = first + tap
+                    weight = _lanczos((row - strip_rows) / strip_spacing)
+                    values += source[np.clip(row, 0, height - 1)] * weight.astype(np.float32)[trailing]
+                    total += weight
+                values /= total.astype(np.float32)[trailing]
+            resampled[first_row:last_row] = np.clip(np.rint(values), 0, 255)
+
+        map_strips(resample_strip, rows.size)
+        return resampled
+
+    @staticmethod
+    def split_depths(buffer: BufferLike, depth_count: int) -> Tuple[np.ndarray, memoryview]:
+        """
+        Split a binary upload into its leading depth vector and the encoded image that follows it.
+
+        The depths are read in place as little-endian float64 values, without copying the buffer.
+
+        Args:
+            buffer (BufferLike): The upload body.
+            depth_count (int): The number of depths at the start of the body.
+
+        Returns:
+            Tuple[np.ndarray, memoryview]: The depths and a view of the rest of the body.
+
+        Raises:
+            ImageProcessingError: If the body is shorter than the depth vector.
+        """
+        view = memoryview(buffer).cast("B")
+        depth_bytes = depth_count * 8
+        if depth_count < 0 or depth_bytes > len(view):
+            raise ImageProcessingError(
+                f"The body holds {len(view)} bytes, too few for {depth_count} float64 depths."
+            )
+        depths = np.frombuffer(view, dtype="<f8", count=depth_count)
+        return depths, view[depth_bytes:]
+
+    @staticmethod
+    @timed("decode")
+    def decode_image(
+            buffer: BufferLike,
+            image_format: str,
+            width: Optional[int] = None,
+            channels: int = 1,
+    ) -> np.ndarray:
+        """
+        Decode a binary image into uint8 pixel rows.
+
+        Raw and .npy bodies are decoded in place with np.frombuffer: the pixel rows are a view of
+        the buffer, not a copy. PNG and WebP bodies are decompressed with OpenCV.
+
+        Args:
+            buffer (BufferLike): The encoded image.
+            image_format (str): "raw" (row-major uint8 pixels), "npy" (a uint8 NumPy array), "png"
+                or "webp".
+            width (int, optional): The width of a raw image, in pixels. Required for raw images.
+            channels (int): The number of channels of a raw image.
+
+        Returns:
+            np.ndarray: The (height, width) or (height, width, channels) uint8 pixel rows.
+
+        Raises:
+            ImageProcessingError: If the body cannot be decoded into a uint8 image.
+        """
+        view = memoryview(buffer).cast("B")
+        if image_format == "raw":
+            if not width or width <= 0 or channels <= 0:
+                raise ImageProcessingError("A raw image requires a positive width and channel count.")
+            row_bytes = width * channels
+            if len(view) % row_bytes:
+                raise ImageProcessingError(
+                    f"The body holds {len(view)} bytes, not a whole number of {row_bytes}-byte rows."
+                )
+            pixels = np.frombuffer(view, dtype=np.uint8)
+            shape = (-1, width, channels) if channels > 1 else (-1, width)
+            return pixels.reshape(shape)
+        if image_format == "npy":
+            return ImageProcessingService._decode_npy(view)
+        if image_format in ("png", "webp"):
+            pixels = cv2.imdecode(np.frombuffer(view, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+            if pixels is None:
+                raise ImageProcessingError(f"The body is not a valid {image_format.upper()} image.")
+            if pixels.dtype != np.uint8:
+                raise ImageProcessingError(f"Only 8-bit images are supported, got {pixels.dtype}.")
+            if pixels.ndim == 3:
+                # OpenCV decodes to BGR(A), the rest of the service works on RGB(A) rows
+                code = cv2.COLOR_BGR2RGB if pixels.shape[2] == 3 else cv2.COLOR_BGRA2RGBA
+                pixels = cv2.cvtColor(pixels, code)
+            return pixels
+        raise ImageProcessingError(f"Unsupported image format: {image_format}.")
+
+    @staticmethod
+    def _decode_npy(view: memoryview) -> np.ndarray:
+        # Only the header is parsed from a copy, the array itself is a view of the buffer
+        header = io.BytesIO(view[:_NPY_MAX_HEADER_BYTES].tobytes())
+        try:
+            version = np.lib.format.read_magic(header)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(header)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(header)
+        except ValueError as exc:
+            raise ImageProcessingError(f"The body is not a valid .npy array. {exc}") from exc
+        if dtype != np.uint8:
+            raise ImageProcessingError(f"Only uint8 arrays are supported, got {dtype}.")
+        if len(shape) not in (2, 3):
+            raise ImageProcessingError(f"Expected a 2D or 3D array, got shape {shape}.")
+        count = int(np.prod(shape))
+        offset = header.tell()
+        if len(view) - offset < count:
+            raise ImageProcessingError("The .npy array is truncated.")
+        pixels = np.frombuffer(view, dtype=np.uint8, count=count, offset=offset)
+        return pixels.reshape(shape, order="F" if fortran_order else "C")
+
+    @staticmethod
+    @timed("encode")
+    def encode_image(
+            pixels: np.ndarray,
+            image_format: str,
+            png_compression: int = 1,
+            webp_quality: int = 90,
+            rgb: bool = False,
+    ) -> bytes:
+        """
+        Encode uint8 pixel rows for a binary response.
+
+        Args:
+            pixels (np.ndarray): The (height, width) or (height, width, channels) uint8 pixel rows.
+            image_format (str): "raw" (the row-major bytes), "png" or "webp".
+            png_compression (int): The zlib level of PNG images, from 0 (fastest) to 9 (smallest).
+            webp_quality (int): The quality of WebP images, from 1 to 100; above 100 is lossless.
+            rgb (bool): Whether color pixels are in RGB(A) order rather than the BGR(A) order OpenCV
+                encodes. Raw bytes are returned in the given order.
+
+        Returns:
+            bytes: The encoded image.
+
+        Raises:
+            ImageProcessingError: If the format is unsupported or the image cannot be encoded.
+        """
+        if image_format == "raw":
+            return np.ascontiguousarray(pixels).tobytes()
+        if image_format == "png":
+            params = [cv2.IMWRITE_PNG_COMPRESSION, png_compression]
+        elif image_format == "webp":
+            params = [cv2.IMWRITE_WEBP_QUALITY, webp_quality]
+        else:
+            raise ImageProcessingError(f"Unsupported image format: {image_format}.")
+        try:
+            if rgb and pixels.ndim == 3 and pixels.shape[2] in (3, 4):
+                code = cv2.COLOR_RGBA2BGRA if pixels.shape[2] == 4 else cv2.COLOR_RGB2BGR
+                pixels = cv2.cvtColor(pixels, code)
+            encoded, buffer = cv2.imencode(f".{image_format}", pixels, params)
+        except cv2.error as exc:
+            raise ImageProcessingError(f"An error occurred while encoding the image. {exc}") from exc
+        if not encoded:
+            raise ImageProcessingError(f"The image could not be encoded as {image_format}.")
+        return buffer.tobytes()
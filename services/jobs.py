@@ -0,0 +1,245 @@
+"""Background ingest jobs module."""
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from exceptions.exceptions import ServiceBusyError
+
+logger = logging.getLogger()
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class IngestJob:
+    """
+    Progress of an image upload processed in the background.
+
+    The job function reports its stage and the rows it has written; the throughput is measured
+    over the time spent writing.
+    """
+
+    def __init__(self, image_name: str):
+        """
+        Initialize a new instance of the IngestJob class.
+
+        Args:
+            image_name (str): The name of the uploaded image.
+        """
+        self.job_id = uuid.uuid4().hex
+        self.image_name = image_name
+        self.status = QUEUED
+        self.stage: Optional[str] = None
+        self.error: Optional[str] = None
+        self.rows_total = 0
+        self.rows_written = 0
+        self.created = time.time()
+        self._lock = threading.Lock()
+        self._started: Optional[float] = None
+        self._finished: Optional[float] = None
+        self._writing: Optional[float] = None
+        self._write_seconds = 0.0
+
+    def start(self) -> None:
+        """
+        Mark the job as running.
+        """
+        with self._lock:
+            self.status = RUNNING
+            self._started = time.perf_counter()
+
+    def set_stage(self, stage: str) -> None:
+        """
+        Record the stage the job is in.
+
+        Args:
+            stage (str): The stage name, e.g. "decode", "resample" or "write".
+        """
+        with self._lock:
+            self.stage = stage
+
+    def start_writing(self, rows_total: int) -> None:
+        """
+        Record the start of the write stage.
+
+        Args:
+            rows_total (int): The number of rows to write, over all pyramid levels.
+        """
+        with self._lock:
+            self.stage = "write"
+            self.rows_total = rows_total
+            self._writing = time.perf_counter()
+
+    def add_rows(self, rows: int) -> None:
+        """
+        Record rows written.
+
+        Args:
+            rows (int): The number of rows just written.
+        """
+        with self._lock:
+            self.rows_written += rows
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        """
+        Mark the job as succeeded, or as failed with an error. A failed job keeps the stage it failed in.
+
+        Args:
+            error (BaseException, optional): The error the job failed with.
+        """
+        with self._lock:
+            now = time.perf_counter()
+            self._finished = now
+            if self._writing is not None:
+                self._write_seconds = now - self._writing
+                self._writing = None
+            self.status = FAILED if error is not None else SUCCEEDED
+            if error is None:
+                self.stage = None
+            self.error = str(error) if error is not None else None
+
+    @property
+    def done(self) -> bool:
+        """Whether the job has succeeded or failed."""
+        return self.status in (SUCCEEDED, FAILED)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Report the state of the job.
+
+        Returns:
+            Dict[str, Any]: The job id, image name, status, stage, error, rows written out of the total,
+            progress from 0 to 1, seconds spent and write throughput in rows per second.
+        """
+        with self._lock:
+            now = time.perf_counter()
+            write_seconds = now - self._writing if self._writing is not None else self._write_seconds
+            if self._started is None:
+                seconds = 0.0
+            else:
+                seconds = (self._finished if self._finished is not None else now) - self._started
+            if self.status == SUCCEEDED:
+                progress = 1.0
+            else:
+                progress = self.rows_written / self.rows_total if self.rows_total else 0.0
+            return {
+                "job_id": self.job_id,
+                "image_name": self.image_name,
+                "status": self.status,
+                "stage": self.stage,
+                "error": self.error,
+                "rows_total": self.rows_total,
+                "rows_written": self.rows_written,
+                "progress": round(progress, 4),
+                "seconds": round(seconds, 3),
+                "rows_per_second": round(self.rows_written / write_seconds, 1) if write_seconds > 0 else 0.0,
+                "created": self.created,
+            }
+
+
+class IngestJobManager:
+    """
+    Run image uploads on a bounded pool of background threads, off the HTTP request.
+
+    At most ``max_workers`` jobs run at once and at most ``max_pending`` more wait for a thread;
+    further submissions are rejected with ServiceBusyError. The ``max_finished`` most recent
+    finished jobs are kept for status queries. Jobs live in the worker process that accepted them.
+    """
+
+    def __init__(self, max_workers: int, max_pending: int, max_finished: int):
+        """
+        Initialize a new instance of the IngestJobManager class.
+
+        Args:
+            max_workers (int): The number of jobs run at once.
+            max_pending (int): The number of jobs allowed to wait for a thread.
+            max_finished (int): The number of finished jobs kept for status queries.
+        """
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.max_finished = max_finished
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+        self._lock = threading.Lock()
+        self._jobs: "OrderedDict[str, IngestJob]" = OrderedDict()
+
+    def submit(self, image_name: str, function: Callable[..., Any], *args: Any, **kwargs: Any) -> IngestJob:
+        """
+        Queue an ingest job.
+
+        Args:
+            image_name (str): The name of the uploaded image.
+            function (Callable): The ingest function, called with the job then the given arguments.
+            *args: Positional arguments of the function.
+            **kwargs: Keyword arguments of the function.
+
+        Returns:
+            IngestJob: The queued job.
+
+        Raises:
+            ServiceBusyError: If max_workers jobs are running and max_pending more are queued.
+        """
+        job = IngestJob(image_name)
+        with self._lock:
+            active = sum(1 for queued in self._jobs.values() if not queued.done)
+            if active >= self.max_workers + self.max_pending:
+                raise ServiceBusyError(
+                    "All {} ingest workers are busy and {} uploads are already queued.".format(
+                        self.max_workers, self.max_pending
+                    )
+                )
+            self._jobs[job.job_id] = job
+            self._prune()
+        self._executor.submit(self._run, job, function, args, kwargs)
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        """
+        Get a job.
+
+        Args:
+            job_id (str): The job id.
+
+        Returns:
+            IngestJob, optional: The job, None if it is unknown or was pruned.
+        """
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self) -> List[Dict[str, Any]]:
+        """
+        Report the state of every kept job.
+
+        Returns:
+            List[Dict[str, Any]]: The snapshot of every job, newest first.
+        """
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return [job.snapshot() for job in reversed(jobs)]
+
+    def shutdown(self) -> None:
+        """
+        Drop the queued jobs, wait for the running ones to finish and stop the threads.
+        """
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    @staticmethod
+    def _run(job: IngestJob, function: Callable[..., Any], args: Any, kwargs: Any) -> None:
+        job.start()
+        try:
+            function(job, *args, **kwargs)
+        except Exception as exc:  # pylint: disable=broad-except
+            logger.error(f"Ingest job {job.job_id} of {job.image_name} failed: {exc}")
+            job.finish(exc)
+            return
+        job.finish()
+
+    def _prune(self) -> None:
+        finished = [job_id for job_id, job in self._jobs.items() if job.done]
+        for job_id in finished[: max(len(finished) - self.max_finished, 0)]:
+            del self._jobs[job_id]
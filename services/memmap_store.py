@@ -0,0 +1,542 @@
+"""Memory-mapped local image store module."""
+import fcntl
+import json
+import os
+import shutil
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, TypeVar
+from urllib.parse import quote
+
+import numpy as np
+
+from exceptions.exceptions import DatabaseQueryError, DatabaseServiceError
+from services.colormaps import ColormapRegistry, get_colormap_registry
+from services.database import (
+    SEED_CLAIMED,
+    BulkLoadStats,
+    _merge_meta_row,
+    _meta_row,
+    _validate_image,
+    pick_level,
+    seed_claim,
+)
+from services.metrics import timed
+
+_CURRENT = "CURRENT"
+_META = "meta.json"
+_VERSION_PREFIX = "v-"
+_STAGING_PREFIX = ".staging-"
+_LOCK = ".lock"
+
+T = TypeVar("T")
+
+
+class MemmapImageStore:
+    """
+    Image store keeping every pyramid level of an image as contiguous files on local disk.
+
+    A level is a raw uint8 file of its pixel rows and a raw float64 file of their sorted depths,
+    both read with np.memmap. A depth range query binary-searches the depth file with
+    np.searchsorted and returns slices of the memory maps: no row is copied or decoded, and the
+    operating system page cache does the caching.
+
+    Each upload is written to a new version directory, then published by atomically replacing the
+    image's CURRENT file under an exclusive file lock, so readers see either the previous or the new
+    image, never a mix, and the workers sharing the store directory publish one at a time. The
+    previous version is kept until the next publish, and a read whose version was removed after it
+    was resolved is retried once on the current version. Memory maps of a removed version stay valid
+    until they are released.
+
+    It offers the image API of DatabaseService, so the endpoints run against either store.
+    """
+
+    def __init__(self, root: str, colormaps: Optional[ColormapRegistry] = None):
+        """
+        Initialize a new instance of the MemmapImageStore class.
+
+        Args:
+            root (str): The directory the images are stored in. It is created when missing.
+            colormaps (ColormapRegistry, optional): The colormaps images are colorized with.
+                Defaults to the process-wide registry.
+        """
+        self.root = root
+        self.colormaps = colormaps if colormaps is not None else get_colormap_registry()
+
+    def store_image(
+            self,
+            image_name: str,
+            depths: np.ndarray,
+            pixels: np.ndarray,
+            table_name: str = "images",
+            level: int = 0,
+    ) -> BulkLoadStats:
+        """
+        Store one pyramid level of an image, keeping its other stored levels.
+
+        Args:
+            image_name (str): The name of the image.
+            depths (np.ndarray): The depth of every pixel row.
+            pixels (np.ndarray): The uint8 pixel rows, shaped (height, width) or (height, width, channels).
+            table_name (str): The name of the table, a subdirectory of the store.
+            level (int): The pyramid level, 0 being the full resolution.
+
+        Returns:
+            BulkLoadStats: The number of rows written and the write throughput.
+
+        Raises:
+            DatabaseServiceError: If an error occurs while storing the image.
+        """
+        return self.store_pyramid(image_name, [(depths, pixels)], table_name, first_level=level)
+
+    def store_pyramid(
+            self,
+            image_name: str,
+            levels: Sequence[Tuple[np.ndarray, np.ndarray]],
+            table_name: str = "images",
+            first_level: int = 0,
+    ) -> BulkLoadStats:
+        """
+        Store the pyramid levels of an image, replacing the stored ones.
+
+        When the pyramid starts at level 0, levels of a previous upload that the new pyramid does
+        not have are removed; otherwise the stored levels below first_level are kept.
+
+        Args:
+            image_name (str): The name of the image.
+            levels (Sequence[Tuple[np.ndarray, np.ndarray]]): The (depths, pixels) of each level.
+            table_name (str): The name of the table, a subdirectory of the store.
+            first_level (int): The level number of the first entry of levels.
+
+        Returns:
+            BulkLoadStats: The number of rows written and the write throughput, over all levels.
+
+        Raises:
+            DatabaseServiceError: If an error occurs while storing the image.
+        """
+        levels = [_sort_rows(*_validate_image(depths, pixels)) for depths, pixels in levels]
+        return self.store_pyramid_chunks(image_name, [levels], table_name, first_level=first_level)
+
+    @timed("store", size=lambda stats: (stats.rows, None))
+    def store_pyramid_chunks(
+            self,
+            image_name: str,
+            chunks: Iterable[Sequence[Tuple[np.ndarray, np.ndarray]]],
+            table_name: str = "images",
+            first_level: int = 0,
+    ) -> BulkLoadStats:
+        """
+        Stream the pyramid of an image to disk chunk by chunk, replacing the stored one.
+
+        Every chunk holds the next rows of each level, starting at first_level, and is appended to
+        the level files of a new version, which is published once all chunks are written.
+
+        Args:
+            image_name (str): The name of the image.
+            chunks (Iterable[Sequence[Tuple[np.ndarray, np.ndarray]]]): The (depths, pixels) of each
+                level, for every chunk.
+            table_name (str): The name of the table, a subdirectory of the store.
+            first_level (int): The level number of the first entry of every chunk.
+
+        Returns:
+            BulkLoadStats: The number of rows written and the write throughput, over all levels.
+
+        Raises:
+            DatabaseServiceError: If an error occurs while storing the image.
+        """
+        image_dir = self._image_dir(table_name, image_name)
+        staging_dir = os.path.join(image_dir, _STAGING_PREFIX + uuid.uuid4().hex)
+        started = time.perf_counter()
+        meta_rows: Dict[int, Dict[str, Any]] = {}
+        last_depths: Dict[int, float] = {}
+        chunk_count = 0
+        try:
+            os.makedirs(staging_dir)
+            for chunk in chunks:
+                chunk_count += 1
+                for offset, (depths, pixels) in enumerate(chunk):
+                    depths, pixels = _validate_image(depths, pixels)
+                    level = first_level + offset
+                    if depths.size and ((np.diff(depths) < 0).any() or depths[0] < last_depths.get(level, -np.inf)):
+                        raise DatabaseServiceError(
+                            "Failed to store image: depths of level {} are not sorted.".format(level)
+                        )
+                    if depths.size:
+                        last_depths[level] = float(depths[-1])
+                    row = _meta_row(image_name, level, depths, pixels)
+                    if level in meta_rows and meta_rows[level]["width"] != row["width"]:
+                        raise DatabaseServiceError(
+                            "Failed to store image: chunks of level {} differ in width.".format(level)
+                        )
+                    _merge_meta_row(meta_rows, row)
+                    pixels_path, depths_path = _level_paths(staging_dir, level)
+                    with open(pixels_path, "ab") as file:
+                        file.write(pixels.data)
+                    with open(depths_path, "ab") as file:
+                        file.write(depths.data)
+
+            with _image_lock(image_dir):
+                if first_level > 0:
+                    self._link_levels(image_dir, staging_dir, range(first_level), meta_rows)
+                _write_json(
+                    os.path.join(staging_dir, _META), {"levels": [meta_rows[level] for level in sorted(meta_rows)]}
+                )
+                self._publish(image_dir, staging_dir)
+        except OSError as exc:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            raise DatabaseServiceError("Failed to store image: {}".format(exc)) from exc
+        except BaseException:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            raise
+
+        rows = sum(row["height"] for level, row in meta_rows.items() if level >= first_level)
+        return BulkLoadStats(rows=rows, chunks=chunk_count, seconds=time.perf_counter() - started)
+
+    @timed("levels", size=None)
+    def image_levels(self, image_name: str, table_name: str = "images") -> List[Dict[str, Any]]:
+        """
+        Get the stored pyramid levels of an image.
+
+        Args:
+            image_name (str): The name of the image.
+            table_name (str): The name of the table, a subdirectory of the store.
+
+        Returns:
+            List[Dict[str, Any]]: The level, height, width, channels and depth extent of every level,
+            finest level first.
+        """
+        def read_levels(version_dir: str) -> List[Dict[str, Any]]:
+            with open(os.path.join(version_dir, _META), encoding="utf-8") as file:
+                return json.load(file)["levels"]
+
+        try:
+            return self._read_current(table_name, image_name, read_levels, [])
+        except (OSError, ValueError, KeyError) as exc:
+            raise DatabaseServiceError("Failed to get image levels: {}".format(exc)) from exc
+
+    def select_level(
+            self,
+            image_name: str,
+            depth_min: float,
+            depth_max: float,
+            target_height: Optional[int] = None,
+            target_width: Optional[int] = None,
+            table_name: str = "images",
+    ) -> int:
+        """
+        Pick the coarsest pyramid level that still renders a depth range at the target size.
+
+        Args:
+            image_name (str): The name of the image.
+            depth_min (float): The minimum depth.
+            depth_max (float): The maximum depth.
+            target_height (int, optional): The minimum number of rows wanted.
+            target_width (int, optional): The minimum number of columns wanted.
+            table_name (str): The name of the table, a subdirectory of the store.
+
+        Returns:
+            int: The selected level, 0 when no target is given or no coarser level is large enough.
+        """
+        if target_height is None and target_width is None:
+            return 0
+        return pick_level(self.image_levels(image_name, table_name), depth_min, depth_max, target_height, target_width)
+
+    @timed("query")
+    def load_image(
+            self,
+            image_name: str,
+            depth_min: float,
+            depth_max: float,
+            table_name: str = "images",
+            level: int = 0,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Load the pixel rows of an image within a depth range, as read-only views of its memory maps.
+
+        Args:
+            image_name (str): The name of the image.
+            depth_min (float): The minimum depth.
+            depth_max (float): The maximum depth.
+            table_name (str): The name of the table, a subdirectory of the store.
+            level (int): The pyramid level, 0 being the full resolution.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The depths and the uint8 pixel rows.
+
+        Raises:
+            DatabaseServiceError: If the stored files cannot be read.
+        """
+        empty = np.empty(0, dtype=np.float64), np.empty((0, 0), dtype=np.uint8)
+
+        def map_level(version_dir: str) -> Tuple[np.ndarray, np.ndarray]:
+            with open(os.path.join(version_dir, _META), encoding="utf-8") as file:
+                levels = {row["level"]: row for row in json.load(file)["levels"]}
+            meta = levels.get(level)
+            if meta is None or meta["height"] == 0:
+                return empty
+            pixels_path, depths_path = _level_paths(version_dir, level)
+            row_shape = (meta["width"], meta["channels"]) if meta["channels"] > 1 else (meta["width"],)
+            depths = np.memmap(depths_path, dtype=np.float64, mode="r", shape=(meta["height"],))
+            pixels = np.memmap(pixels_path, dtype=np.uint8, mode="r", shape=(meta["height"],) + row_shape)
+            return depths, pixels
+
+        try:
+            depths, pixels = self._read_current(table_name, image_name, map_level, empty)
+        except (OSError, ValueError, KeyError) as exc:
+            raise DatabaseServiceError("Failed to load image: {}".format(exc)) from exc
+
+        start = np.searchsorted(depths, depth_min, side="left")
+        stop = np.searchsorted(depths, depth_max, side="right")
+        return depths[start:stop], pixels[start:stop]
+
+    def iter_image(
+            self,
+            image_name: str,
+            depth_min: float,
+            depth_max: float,
+            table_name: str = "images",
+            level: int = 0,
+            strip_rows: int = 1024,
+    ) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Stream the pixel rows of an image within a depth range, in strips of at most strip_rows rows.
+
+        Args:
+            image_name (str): The name of the image.
+            depth_min (float): The minimum depth.
+            depth_max (float): The maximum depth.
+            table_name (str): The name of the table, a subdirectory of the store.
+            level (int): The pyramid level, 0 being the full resolution.
+            strip_rows (int): The largest number of rows per strip.
+
+        Yields:
+            Tuple[np.ndarray, np.ndarray]: The depths and the uint8 pixel rows of every strip, as
+            views of the memory maps, by increasing depth.
+
+        Raises:
+            DatabaseServiceError: If the stored files cannot be read.
+        """
+        depths, pixels = self.load_image(image_name, depth_min, depth_max, table_name, level)
+        for start in range(0, depths.shape[0], strip_rows):
+            yield depths[start:start + strip_rows], pixels[start:start + strip_rows]
+
+    def get_image_data(
+            self,
+            depth_min: float,
+            depth_max: float,
+            colormap: str,
+            image_name: str,
+            table_name: str = "images",
+            level: int = 0,
+    ) -> np.ndarray:
+        """
+        Get the image of a depth range and apply a colormap.
+
+        Args:
+            depth_min (float): The minimum depth.
+            depth_max (float): The maximum depth.
+            colormap (str): The colormap to be applied.
+            image_name (str): The name of the image.
+            table_name (str): The name of the table, a subdirectory of the store.
+            level (int): The pyramid level, 0 being the full resolution.
+
+        Returns:
+            np.ndarray: The image data.
+
+        Raises:
+            DatabaseQueryError: If no row lies within the depth range.
+            ColorMapError: If the colormap is not registered.
+        """
+        colormap = self.colormaps.resolve(colormap)
+        _, image = self.load_image(image_name, depth_min, depth_max, table_name, level)
+        if image.shape[0] == 0:
+            raise DatabaseQueryError("Failed to get image data: No data found for the provided depth range.")
+        return self.colormaps.apply(image, colormap)
+
+    def claim_seed(self, seed_name: str, fingerprint: str, stale_after: float) -> str:
+        """
+        Claim the seeding of an image for this worker, unless its data is already seeded or being seeded.
+
+        Seeds are recorded in a JSON file per image, updated under an exclusive file lock, so the workers
+        sharing the store directory seed every image once. A claim older than stale_after seconds is
+        taken over, as its worker is assumed dead.
+
+        Args:
+            seed_name (str): The name of the seeded image.
+            fingerprint (str): The fingerprint of the data to seed, e.g. a hash of the source file.
+            stale_after (float): The seconds after which a running seed is deemed abandoned.
+
+        Returns:
+            str: SEED_READY if the data is already seeded, SEED_CLAIMED if this worker must seed it and
+            then call finish_seed, SEED_BUSY if another worker is seeding it.
+
+        Raises:
+            DatabaseServiceError: If the seed record cannot be read or written.
+        """
+        try:
+            with self._seed_record(seed_name) as (row, write):
+                now = time.time()
+                claim = seed_claim(row, fingerprint, stale_after, now)
+                if claim == SEED_CLAIMED:
+                    write({"fingerprint": fingerprint, "status": "seeding", "updated_at": now})
+                return claim
+        except (OSError, ValueError) as exc:
+            raise DatabaseServiceError("Failed to claim seed: {}".format(exc)) from exc
+
+    def finish_seed(self, seed_name: str, fingerprint: str, success: bool) -> None:
+        """
+        Record the end of a seed claimed with claim_seed.
+
+        Args:
+            seed_name (str): The name of the seeded image.
+            fingerprint (str): The fingerprint the seed was claimed with.
+            success (bool): Whether the data was stored. A failed seed can be claimed again right away.
+
+        Raises:
+            DatabaseServiceError: If the seed record cannot be read or written.
+        """
+        try:
+            with self._seed_record(seed_name) as (row, write):
+                if row is not None and row["fingerprint"] == fingerprint and row["status"] == "seeding":
+                    write({
+                        "fingerprint": fingerprint,
+                        "status": "ready" if success else "failed",
+                        "updated_at": time.time(),
+                    })
+        except (OSError, ValueError) as exc:
+            raise DatabaseServiceError("Failed to record seed: {}".format(exc)) from exc
+
+    def refresh_seed(self, seed_name: str, fingerprint: str) -> None:
+        """
+        Record that a seed claimed with claim_seed is still running, so that other workers do not take
+        it over as abandoned while it takes longer than their stale_after.
+
+        Args:
+            seed_name (str): The name of the seeded image.
+            fingerprint (str): The fingerprint the seed was claimed with.
+
+        Raises:
+            DatabaseServiceError: If the seed record cannot be read or written.
+        """
+        try:
+            with self._seed_record(seed_name) as (row, write):
+                if row is not None and row["fingerprint"] == fingerprint and row["status"] == "seeding":
+                    write(dict(row, updated_at=time.time()))
+        except (OSError, ValueError) as exc:
+            raise DatabaseServiceError("Failed to record seed: {}".format(exc)) from exc
+
+    @contextmanager
+    def _seed_record(self, seed_name: str) -> Iterator[Tuple[Optional[Dict[str, Any]], Any]]:
+        """Lock the seed record of an image, yielding its content and a function replacing it."""
+        seeds_dir = os.path.join(self.root, "seeds")
+        os.makedirs(seeds_dir, exist_ok=True)
+        path = os.path.join(seeds_dir, quote(seed_name, safe="") + ".json")
+        with open(path + ".lock", "a", encoding="utf-8") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(path, encoding="utf-8") as file:
+                    row = json.load(file)
+            except FileNotFoundError:
+                row = None
+
+            def write(content: Dict[str, Any]) -> None:
+                _write_json(path + ".tmp", content)
+                os.replace(path + ".tmp", path)
+
+            yield row, write
+
+    def _image_dir(self, table_name: str, image_name: str) -> str:
+        # Names are percent-encoded and prefixed, so no name can escape the store or clash with "." or ".."
+        return os.path.join(self.root, "t_" + quote(table_name, safe=""), "i_" + quote(image_name, safe=""))
+
+    def _current_version(self, table_name: str, image_name: str) -> Optional[str]:
+        return _current_version(self._image_dir(table_name, image_name))
+
+    def _read_current(self, table_name: str, image_name: str, read: Callable[[str], T], default: T) -> T:
+        """Read the current version of an image, or return default when the image is not stored."""
+        version_dir = self._current_version(table_name, image_name)
+        if version_dir is None:
+            return default
+        try:
+            return read(version_dir)
+        except FileNotFoundError:
+            # Two uploads were published since the version was resolved, removing it
+            version_dir = self._current_version(table_name, image_name)
+            if version_dir is None:
+                return default
+            return read(version_dir)
+
+    def _link_levels(
+            self, image_dir: str, staging_dir: str, levels: Iterable[int], meta_rows: Dict[int, Dict[str, Any]]
+    ) -> None:
+        """Carry stored levels over to a new version, as hard links where the file system allows."""
+        version_dir = _current_version(image_dir)
+        if version_dir is None:
+            return
+        with open(os.path.join(version_dir, _META), encoding="utf-8") as file:
+            stored = {row["level"]: row for row in json.load(file)["levels"]}
+        for level in levels:
+            if level not in stored or level in meta_rows:
+                continue
+            for source, target in zip(_level_paths(version_dir, level), _level_paths(staging_dir, level)):
+                try:
+                    os.link(source, target)
+                except OSError:
+                    shutil.copyfile(source, target)
+            meta_rows[level] = stored[level]
+
+    @staticmethod
+    def _publish(image_dir: str, staging_dir: str) -> None:
+        """
+        Make a staged version the current one and remove the versions older than the one it replaces.
+        The caller holds the image lock.
+        """
+        version = _VERSION_PREFIX + uuid.uuid4().hex
+        previous = _current_version(image_dir)
+        os.rename(staging_dir, os.path.join(image_dir, version))
+        pointer = os.path.join(image_dir, f".{_CURRENT}-{version}")
+        with open(pointer, "w", encoding="utf-8") as file:
+            file.write(version)
+        os.replace(pointer, os.path.join(image_dir, _CURRENT))
+        # The replaced version stays for the readers that resolved it just before the swap
+        kept = {version, os.path.basename(previous) if previous is not None else None}
+        for entry in os.listdir(image_dir):
+            if entry.startswith(_VERSION_PREFIX) and entry not in kept:
+                # Open memory maps of the removed version stay readable until released
+                shutil.rmtree(os.path.join(image_dir, entry), ignore_errors=True)
+
+
+@contextmanager
+def _image_lock(image_dir: str) -> Iterator[None]:
+    """Hold the exclusive lock of an image directory, shared by the threads and processes of the store."""
+    with open(os.path.join(image_dir, _LOCK), "a", encoding="utf-8") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def _current_version(image_dir: str) -> Optional[str]:
+    try:
+        with open(os.path.join(image_dir, _CURRENT), encoding="utf-8") as file:
+            return os.path.join(image_dir, file.read().strip())
+    except FileNotFoundError:
+        return None
+
+
+def _level_paths(version_dir: str, level: int) -> Tuple[str, str]:
+    return (
+        os.path.join(version_dir, f"level{level}.pixels.u8"),
+        os.path.join(version_dir, f"level{level}.depths.f8"),
+    )
+
+
+def _sort_rows(depths: np.ndarray, pixels: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    if depths.size and (np.diff(depths) < 0).any():
+        order = np.argsort(depths, kind="stable")
+        return depths[order], pixels[order]
+    return depths, pixels
+
+
+def _write_json(path: str, content: Any) -> None:
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(content, file)
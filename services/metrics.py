@@ -0,0 +1,366 @@
+"""Pipeline metrics module."""
+import functools
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, TypeVar
+
+import numpy as np
+
+from services.config import METRICS_ENABLED
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+SECONDS_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+ROWS_BUCKETS = tuple(float(4 ** power) for power in range(12))
+BYTES_BUCKETS = tuple(float(256 * 4 ** power) for power in range(12))
+
+
+class Histogram:
+    """
+    Prometheus histogram: the count of observations below each bucket bound, their sum and their count,
+    for every combination of label values.
+    """
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str], buckets: Sequence[float]):
+        """
+        Initialize a new instance of the Histogram class.
+
+        Args:
+            name (str): The metric name.
+            documentation (str): The HELP text of the metric.
+            labels (Sequence[str]): The label names.
+            buckets (Sequence[float]): The increasing upper bounds of the buckets, +Inf excluded.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple[str, ...], List[Any]] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        """
+        Record an observation.
+
+        Args:
+            value (float): The observed value.
+            *label_values (str): The label values, in the order of the label names.
+        """
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # Counts per bucket, the last one being +Inf, then the sum
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def samples(self) -> List[str]:
+        """
+        Render the histogram in the Prometheus text format.
+
+        Returns:
+            List[str]: The lines of the metric.
+        """
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labels: (list(counts), total) for labels, (counts, total) in self._series.items()}
+        for label_values, (counts, total) in sorted(series.items()):
+            labels = _format_labels(self.labels, label_values)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                bucket_labels = _format_labels(self.labels + ("le",), label_values + (_format_value(bound),))
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Counter:
+    """Prometheus counter, for every combination of label values."""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str]):
+        """
+        Initialize a new instance of the Counter class.
+
+        Args:
+            name (str): The metric name, ending with _total.
+            documentation (str): The HELP text of the metric.
+            labels (Sequence[str]): The label names.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1.0) -> None:
+        """
+        Increment the counter.
+
+        Args:
+            *label_values (str): The label values, in the order of the label names.
+            amount (float): The increment.
+        """
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def samples(self) -> List[str]:
+        """
+        Render the counter in the Prometheus text format.
+
+        Returns:
+            List[str]: The lines of the metric.
+        """
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        for label_values, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}")
+        return lines
+
+
+class MetricsRegistry:
+    """Registry of the metrics of a process, rendered together for the /metrics endpoint."""
+
+    def __init__(self):
+        """
+        Initialize a new instance of the MetricsRegistry class.
+        """
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, Any] = {}
+
+    def histogram(
+            self, name: str, documentation: str, labels: Sequence[str], buckets: Sequence[float]
+    ) -> Histogram:
+        """
+        Get a histogram, creating it on first use.
+
+        Args:
+            name (str): The metric name.
+            documentation (str): The HELP text of the metric.
+            labels (Sequence[str]): The label names.
+            buckets (Sequence[float]): The increasing upper bounds of the buckets, +Inf excluded.
+
+        Returns:
+            Histogram: The histogram.
+        """
+        with self._lock:
+            return self._metrics.setdefault(name, Histogram(name, documentation, labels, buckets))
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str]) -> Counter:
+        """
+        Get a counter, creating it on first use.
+
+        Args:
+            name (str): The metric name, ending with _total.
+            documentation (str): The HELP text of the metric.
+            labels (Sequence[str]): The label names.
+
+        Returns:
+            Counter: The counter.
+        """
+        with self._lock:
+            return self._metrics.setdefault(name, Counter(name, documentation, labels))
+
+    def render(self) -> str:
+        """
+        Render every metric in the Prometheus text exposition format.
+
+        Returns:
+            str: The exposition, one sample per line.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(line for metric in metrics for line in metric.samples()) + "\n"
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    escaped = (
+        str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for value in values
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+_registry = MetricsRegistry()
+
+
+def get_metrics_registry() -> MetricsRegistry:
+    """
+    Get the process-wide metrics registry.
+
+    Returns:
+        MetricsRegistry: The metrics registry.
+    """
+    return _registry
+
+
+STAGE_SECONDS = _registry.histogram(
+    "image_pipeline_stage_seconds", "Duration of the stages of the read and upload pipelines.", ["stage"],
+    SECONDS_BUCKETS,
+)
+STAGE_ROWS = _registry.histogram(
+    "image_pipeline_stage_rows", "Pixel rows handled by a pipeline stage.", ["stage"], ROWS_BUCKETS
+)
+STAGE_BYTES = _registry.histogram(
+    "image_pipeline_stage_bytes", "Bytes handled by a pipeline stage.", ["stage"], BYTES_BUCKETS
+)
+STAGE_ERRORS = _registry.counter(
+    "image_pipeline_stage_errors_total", "Pipeline stages that raised an error.", ["stage"]
+)
+HTTP_SECONDS = _registry.histogram(
+    "image_http_request_seconds", "Duration of HTTP requests, by route.", ["method", "route", "status"],
+    SECONDS_BUCKETS,
+)
+
+
+Size = Tuple[Optional[int], Optional[int]]
+
+
+def image_size(result: Any) -> Optional[Size]:
+    """
+    Size a stage result holding an image: an array, a (depths, pixels) pair or encoded bytes.
+
+    Args:
+        result (Any): The result of the stage.
+
+    Returns:
+        Tuple[Optional[int], Optional[int]], optional: The rows and bytes of the image, None for other results.
+    """
+    if isinstance(result, tuple) and len(result) == 2 and isinstance(result[1], np.ndarray):
+        result = result[1]
+    if isinstance(result, np.ndarray):
+        return (result.shape[0] if result.ndim else 1), result.nbytes
+    if isinstance(result, (bytes, bytearray, str)):
+        return None, len(result)
+    return None
+
+
+def observe_stage(stage: str, seconds: float, size: Optional[Size] = None) -> None:
+    """
+    Record the duration, and optionally the rows and bytes, of a pipeline stage.
+    Nothing is recorded when METRICS_ENABLED is off.
+
+    Args:
+        stage (str): The stage name.
+        seconds (float): The duration of the stage.
+        size (Tuple[Optional[int], Optional[int]], optional): The pixel rows and bytes the stage handled,
+            either one None when unknown.
+    """
+    if not METRICS_ENABLED:
+        return
+    STAGE_SECONDS.observe(seconds, stage)
+    if size is not None:
+        rows, nbytes = size
+        if rows is not None:
+            STAGE_ROWS.observe(rows, stage)
+        if nbytes is not None:
+            STAGE_BYTES.observe(nbytes, stage)
+
+
+def timed(stage: str, size: Optional[Callable[[Any], Optional[Size]]] = image_size) -> Callable[[F], F]:
+    """
+    Decorate a function so that every call records the duration of a pipeline stage, the rows and
+    bytes of its result, and its errors. Nothing is recorded when METRICS_ENABLED is off.
+
+    Args:
+        stage (str): The stage name.
+        size (Callable, optional): Sizes the result as (rows, bytes), None to record durations only.
+            Defaults to image_size.
+
+    Returns:
+        Callable: The decorator.
+    """
+
+    def decorate(function: F) -> F:
+        if not METRICS_ENABLED:
+            return function
+
+        @functools.wraps(function)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            started = time.perf_counter()
+            try:
+                result = function(*args, **kwargs)
+            except Exception:
+                STAGE_SECONDS.observe(time.perf_counter() - started, stage)
+                STAGE_ERRORS.inc(stage)
+                raise
+            observe_stage(stage, time.perf_counter() - started, size(result) if size is not None else None)
+            return result
+
+        return wrapper  # type: ignore[return-value]
+
+    return decorate
+
+
+@contextmanager
+def stage_timer(stage: str) -> Iterator[Dict[str, Any]]:
+    """
+    Time a block of code as a pipeline stage.
+
+    Yields:
+        Dict[str, Any]: A dict the block may set "size" in, to the (rows, bytes) it handled.
+    """
+    measure: Dict[str, Any] = {}
+    if not METRICS_ENABLED:
+        yield measure
+        return
+    started = time.perf_counter()
+    try:
+        yield measure
+    except Exception:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage)
+        STAGE_ERRORS.inc(stage)
+        raise
+    observe_stage(stage, time.perf_counter() - started, measure.get("size"))
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording the duration of every HTTP request, by method, route template and status.
+
+    The duration runs until the response is fully sent, streamed bodies included. Requests matching
+    no route are recorded under the "unmatched" route, so that paths cannot blow up the label values.
+    """
+
+    def __init__(self, app: Callable[..., Any]):
+        """
+        Initialize a new instance of the MetricsMiddleware class.
+
+        Args:
+            app (Callable): The ASGI application.
+        """
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable[..., Any], send: Callable[..., Any]) -> None:
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_with_status(message: Dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The router records the matched route in the scope
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_SECONDS.observe(time.perf_counter() - started, scope["method"], route, str(status["code"]))
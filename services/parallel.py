@@ -0,0 +1,95 @@
+"""Parallel strip processing module."""
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Callable, List, Optional, Tuple, TypeVar
+
+from services.config import IMAGE_PARALLELISM, PARALLEL_MIN_ROWS
+from services.profiling import profiled_call
+
+T = TypeVar("T")
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor  # pylint: disable=global-statement
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=IMAGE_PARALLELISM, thread_name_prefix="strips")
+        return _executor
+
+
+def strip_bounds(rows: int, strips: int, align: int = 1) -> List[Tuple[int, int]]:
+    """
+    Split rows into contiguous strips of about the same size.
+
+    Args:
+        rows (int): The number of rows.
+        strips (int): The maximum number of strips.
+        align (int): Every strip but the last starts and ends on a multiple of this many rows.
+
+    Returns:
+        List[Tuple[int, int]]: The (start, stop) of every strip, in order. A single strip when there are
+        too few rows to split.
+    """
+    blocks = -(-rows // align)
+    strips = max(min(strips, blocks), 1)
+    bounds = []
+    for index in range(strips):
+        start = min(index * blocks // strips * align, rows)
+        stop = min((index + 1) * blocks // strips * align, rows)
+        bounds.append((start, stop))
+    return bounds
+
+
+def map_strips(
+        function: Callable[[int, int], T],
+        rows: int,
+        align: int = 1,
+        min_rows: Optional[int] = None,
+        workers: Optional[int] = None,
+) -> List[T]:
+    """
+    Call a function on strips of rows, in parallel on the worker-wide strip thread pool.
+
+    The function receives the (start, stop) of its strip, and must only write to rows of that strip
+    so that strips can run at once; it may read any row, e.g. the rows a filter needs around the strip.
+    The function must not call map_strips itself, the strips would wait on each other for a thread.
+    Images smaller than min_rows, or a parallelism of 1, run as a single strip in the calling thread.
+    OpenCV and NumPy release the GIL, so strips of their calls run on several cores.
+
+    Args:
+        function (Callable[[int, int], T]): Processes the rows of a strip.
+        rows (int): The number of rows.
+        align (int): Every strip but the last starts and ends on a multiple of this many rows.
+        min_rows (int, optional): The number of rows from which strips run in parallel.
+            Defaults to PARALLEL_MIN_ROWS.
+        workers (int, optional): The number of strips. Defaults to IMAGE_PARALLELISM.
+
+    Returns:
+        List[T]: The result of every strip, in row order.
+    """
+    min_rows = PARALLEL_MIN_ROWS if min_rows is None else min_rows
+    workers = IMAGE_PARALLELISM if workers is None else workers
+    if workers <= 1 or rows < max(min_rows, 2 * align):
+        return [function(0, rows)]
+
+    bounds = strip_bounds(rows, workers, align)
+    if len(bounds) == 1:
+        return [function(0, rows)]
+    # Strips run in copies of the caller's context, so that they are profiled with its request
+    futures = [
+        _get_executor().submit(contextvars.copy_context().run, profiled_call, function, start, stop)
+        for start, stop in bounds[1:]
+    ]
+    try:
+        first = function(*bounds[0])
+    except BaseException:
+        # The other strips may still be writing to the caller's buffers
+        for future in futures:
+            future.cancel()
+        wait(futures)
+        raise
+    return [first] + [future.result() for future in futures]
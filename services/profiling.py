@@ -0,0 +1,328 @@
+"""Per-request profiling module."""
+import contextvars
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import re
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, TypeVar
+
+from starlette.concurrency import run_in_threadpool
+
+T = TypeVar("T")
+
+_PROFILE_ID = re.compile(r"^[0-9a-f]{32}$")
+
+# The profile of the request being handled, inherited by the blocking calls it makes
+_current_profile: contextvars.ContextVar[Optional["RequestProfile"]] = contextvars.ContextVar(
+    "current_profile", default=None
+)
+
+
+class RequestProfile:
+    """
+    cProfile profile of a single request.
+
+    cProfile only sees the thread it is enabled in, so every blocking call of the request is profiled
+    on its own, in the thread running it, and the profiles are merged when the request ends. The event
+    loop itself is not profiled, as it interleaves every request of the worker.
+    """
+
+    def __init__(self, method: str, path: str):
+        """
+        Initialize a new instance of the RequestProfile class.
+
+        Args:
+            method (str): The HTTP method of the request.
+            path (str): The path of the request.
+        """
+        self.profile_id = uuid.uuid4().hex
+        self.method = method
+        self.path = path
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._profiles: List[cProfile.Profile] = []
+
+    def run(self, function: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """
+        Run a callable under a profiler of its own, collected for this request.
+
+        Args:
+            function (Callable): The callable.
+            *args: Positional arguments of the callable.
+            **kwargs: Keyword arguments of the callable.
+
+        Returns:
+            The result of the callable.
+        """
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # From Python 3.12 only one profiler can be active at a time, the call then runs unprofiled
+            return function(*args, **kwargs)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            profiler.disable()
+            with self._lock:
+                self._profiles.append(profiler)
+
+    @property
+    def calls(self) -> int:
+        """The number of profiled calls collected so far."""
+        with self._lock:
+            return len(self._profiles)
+
+    def stats(self) -> Optional[pstats.Stats]:
+        """
+        Merge the profiles collected so far.
+
+        Returns:
+            pstats.Stats, optional: The merged statistics, None if no call was profiled.
+        """
+        with self._lock:
+            profiles = list(self._profiles)
+        if not profiles:
+            return None
+        stats = pstats.Stats(profiles[0], stream=io.StringIO())
+        for profiler in profiles[1:]:
+            stats.add(profiler)
+        return stats
+
+
+def current_profile() -> Optional[RequestProfile]:
+    """
+    Get the profile of the request being handled.
+
+    Returns:
+        RequestProfile, optional: The profile, None when the request is not profiled.
+    """
+    return _current_profile.get()
+
+
+def profiled_call(function: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Run a callable, under the profiler of the current request when it is profiled.
+
+    Args:
+        function (Callable): The callable.
+        *args: Positional arguments of the callable.
+        **kwargs: Keyword arguments of the callable.
+
+    Returns:
+        The result of the callable.
+    """
+    profile = _current_profile.get()
+    if profile is None:
+        return function(*args, **kwargs)
+    return profile.run(function, *args, **kwargs)
+
+
+class ProfileStore:
+    """
+    Directory of saved request profiles, keeping the most recent ones.
+
+    Every profile is saved as ``<id>.prof``, loadable with ``pstats`` or snakeviz, next to ``<id>.json``
+    describing its request. The directory can be shared by the workers of a host.
+    """
+
+    def __init__(self, directory: str, max_profiles: int):
+        """
+        Initialize a new instance of the ProfileStore class.
+
+        Args:
+            directory (str): The directory the profiles are saved in. It is created when missing.
+            max_profiles (int): The number of profiles kept, the oldest being deleted first.
+        """
+        self.directory = directory
+        self.max_profiles = max_profiles
+
+    def save(self, profile: RequestProfile, status: int, seconds: float) -> Optional[str]:
+        """
+        Save the profile of a request, replacing its previous save, and delete the oldest profiles over
+        the limit.
+
+        Args:
+            profile (RequestProfile): The profile.
+            status (int): The HTTP status of the response.
+            seconds (float): The duration of the request.
+
+        Returns:
+            str, optional: The profile id, None if no blocking call was profiled.
+        """
+        stats = profile.stats()
+        if stats is None:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        stats.dump_stats(os.path.join(self.directory, profile.profile_id + ".prof"))
+        summary = {
+            "id": profile.profile_id,
+            "method": profile.method,
+            "path": profile.path,
+            "started": profile.started,
+            "seconds": round(seconds, 6),
+            "status": status,
+        }
+        with open(os.path.join(self.directory, profile.profile_id + ".json"), "w", encoding="utf-8") as file:
+            json.dump(summary, file)
+        self._prune()
+        return profile.profile_id
+
+    def list(self) -> List[Dict[str, Any]]:
+        """
+        List the saved profiles.
+
+        Returns:
+            List[Dict[str, Any]]: The id, request, start time, duration and status of every profile, newest first.
+        """
+        summaries = []
+        for profile_id in self._ids():
+            try:
+                with open(os.path.join(self.directory, profile_id + ".json"), encoding="utf-8") as file:
+                    summaries.append(json.load(file))
+            except (OSError, ValueError):
+                continue
+        return sorted(summaries, key=lambda summary: summary["started"], reverse=True)
+
+    def path(self, profile_id: str) -> Optional[str]:
+        """
+        Get the path of a saved profile.
+
+        Args:
+            profile_id (str): The profile id.
+
+        Returns:
+            str, optional: The path of the .prof file, None if there is no such profile.
+        """
+        if not _PROFILE_ID.match(profile_id):
+            return None
+        path = os.path.join(self.directory, profile_id + ".prof")
+        return path if os.path.isfile(path) else None
+
+    def report(self, profile_id: str, sort: str = "cumulative", limit: int = 50) -> Optional[str]:
+        """
+        Render a saved profile as the text report of pstats.
+
+        Args:
+            profile_id (str): The profile id.
+            sort (str): The pstats sort key.
+            limit (int): The number of functions listed.
+
+        Returns:
+            str, optional: The report, None if there is no such profile.
+        """
+        path = self.path(profile_id)
+        if path is None:
+            return None
+        stream = io.StringIO()
+        pstats.Stats(path, stream=stream).sort_stats(sort).print_stats(limit)
+        return stream.getvalue()
+
+    def _ids(self) -> List[str]:
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return [name[:-5] for name in names if name.endswith(".prof") and _PROFILE_ID.match(name[:-5])]
+
+    def _prune(self) -> None:
+        paths = [os.path.join(self.directory, profile_id + ".prof") for profile_id in self._ids()]
+        if len(paths) <= self.max_profiles:
+            return
+        paths.sort(key=lambda path: os.stat(path).st_mtime)
+        for path in paths[: len(paths) - self.max_profiles]:
+            for stale in (path, path[:-5] + ".json"):
+                try:
+                    os.remove(stale)
+                except FileNotFoundError:
+                    pass
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware profiling the requests that carry the admin profiling header, and a random sample of
+    the others, then saving their profiles to a ProfileStore.
+
+    The profile is saved in a thread when the response starts, and its id is returned in the X-Profile-Id
+    response header, unless no blocking call was profiled by then. Calls profiled after the response
+    started, e.g. while streaming its body, are saved again under the same id when the request ends.
+    """
+
+    def __init__(
+            self,
+            app: Callable[..., Any],
+            store: ProfileStore,
+            token: str = "",
+            sample_rate: float = 0.0,
+            header: str = "x-profile",
+    ):
+        """
+        Initialize a new instance of the ProfilingMiddleware class.
+
+        Args:
+            app (Callable): The ASGI application.
+            store (ProfileStore): The store profiles are saved to.
+            token (str): The value of the profiling header that profiles a request. Empty disables the header.
+            sample_rate (float): The fraction of requests profiled without the header, 0 to 1.
+            header (str): The name of the profiling header, lowercase.
+        """
+        self.app = app
+        self.store = store
+        self.token = token
+        self.sample_rate = sample_rate
+        self.header = header.encode("latin-1")
+
+    def wants_profile(self, scope: Dict[str, Any]) -> bool:
+        """
+        Decide whether to profile a request.
+
+        Args:
+            scope (Dict[str, Any]): The ASGI scope of the request.
+
+        Returns:
+            bool: Whether the request is profiled.
+        """
+        if self.token:
+            for name, value in scope.get("headers", []):
+                if name == self.header:
+                    return value.decode("latin-1") == self.token
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable[..., Any], send: Callable[..., Any]) -> None:
+        if scope["type"] != "http" or not self.wants_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope["method"], scope["path"])
+        started = time.perf_counter()
+        status = {"code": 500}
+        saved = {"calls": 0}
+
+        async def save() -> Optional[str]:
+            saved["calls"] = profile.calls
+            return await run_in_threadpool(self.store.save, profile, status["code"], time.perf_counter() - started)
+
+        async def send_with_id(message: Dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                # The header only names a profile that is already written
+                if await save() is not None:
+                    message = dict(message)
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"x-profile-id", profile.profile_id.encode("latin-1"))
+                    ]
+            await send(message)
+
+        token = _current_profile.set(profile)
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            _current_profile.reset(token)
+            if profile.calls > saved["calls"]:
+                await save()
@@ -0,0 +1,155 @@
+"""Depth tile cache module."""
+import math
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from services.cache import LRUCache
+
+# (image_name, depth_min, depth_max) -> (depths, pixels)
+TileLoader = Callable[[str, float, float], Tuple[np.ndarray, np.ndarray]]
+
+
+class DepthTileCache:
+    """
+    Cache of decoded pixel rows, split into fixed-size depth buckets ("tiles").
+
+    Tile ``k`` of an image holds the rows whose depth lies in ``[k * tile_depth, (k + 1) * tile_depth)``.
+    A depth window is assembled by concatenating its cached tiles and slicing the result, so only the
+    missing tiles are fetched, one range query per run of consecutive missing tiles. Empty tiles are
+    cached too, so gaps in a log are not queried again. Windows spanning more than ``max_tiles``
+    tiles bypass the cache.
+    """
+
+    def __init__(
+            self,
+            tile_depth: float,
+            max_bytes: int,
+            max_tiles: int = 256,
+            ttl: Optional[float] = None,
+            clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Initialize a new instance of the DepthTileCache class.
+
+        Args:
+            tile_depth (float): The depth span of a tile.
+            max_bytes (int): The maximum total size of the cached tiles, in bytes.
+            max_tiles (int): The maximum number of tiles a window may span to go through the cache.
+            ttl (float, optional): The seconds a tile stays valid, bounding how long tiles of an image
+                rewritten by another worker are served. Tiles never expire when omitted or 0.
+            clock (Callable[[], float]): The time source, in seconds.
+        """
+        if tile_depth <= 0:
+            raise ValueError("tile_depth must be positive.")
+        self.tile_depth = tile_depth
+        self.max_tiles = max_tiles
+        self.tiles = LRUCache(max_bytes=max_bytes, ttl=ttl, clock=clock)
+
+    def load(
+            self,
+            table_name: str,
+            image_name: str,
+            depth_min: float,
+            depth_max: float,
+            loader: TileLoader,
+            level: int = 0,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Load the rows of an image within a depth range, fetching only the tiles that are not cached.
+
+        Args:
+            table_name (str): The name of the table, part of the tile key.
+            image_name (str): The name of the image.
+            depth_min (float): The minimum depth.
+            depth_max (float): The maximum depth.
+            loader (TileLoader): Fetches the rows of a depth range from the store.
+            level (int): The pyramid level, part of the tile key.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The depths and the uint8 pixel rows.
+        """
+        tag = (table_name, image_name)
+        if depth_min > depth_max:
+            return loader(image_name, depth_min, depth_max)
+
+        first, last = self._bucket(depth_min), self._bucket(depth_max)
+        if last - first + 1 > self.max_tiles:
+            return loader(image_name, depth_min, depth_max)
+
+        tiles: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+        missing: List[int] = []
+        for bucket in range(first, last + 1):
+            tile = self.tiles.get((tag, level, bucket))
+            if tile is None:
+                missing.append(bucket)
+            else:
+                tiles[bucket] = tile
+
+        if missing:
+            generation = self.tiles.generation(tag)
+            for run_first, run_last in _runs(missing):
+                fetched = self._fetch(image_name, run_first, run_last, loader)
+                for bucket, tile in fetched.items():
+                    tiles[bucket] = tile
+                    self.tiles.put(
+                        (tag, level, bucket),
+                        tile,
+                        size=tile[0].nbytes + tile[1].nbytes,
+                        tag=tag,
+                        generation=generation,
+                    )
+
+        non_empty = [tiles[bucket] for bucket in range(first, last + 1) if tiles[bucket][0].size]
+        if not non_empty:
+            return tiles[first]
+        depths = np.concatenate([tile[0] for tile in non_empty])
+        pixels = np.concatenate([tile[1] for tile in non_empty])
+        start = np.searchsorted(depths, depth_min, side="left")
+        stop = np.searchsorted(depths, depth_max, side="right")
+        return depths[start:stop], pixels[start:stop]
+
+    def invalidate(self, table_name: str, image_name: str) -> int:
+        """
+        Drop every cached tile of an image, at every pyramid level.
+
+        Args:
+            table_name (str): The name of the table.
+            image_name (str): The name of the image.
+
+        Returns:
+            int: The number of tiles dropped.
+        """
+        return self.tiles.invalidate((table_name, image_name))
+
+    def _bucket(self, depth: float) -> int:
+        return math.floor(depth / self.tile_depth)
+
+    def _fetch(
+            self,
+            image_name: str,
+            first: int,
+            last: int,
+            loader: TileLoader,
+    ) -> Dict[int, Tuple[np.ndarray, np.ndarray]]:
+        depths, pixels = loader(image_name, first * self.tile_depth, (last + 1) * self.tile_depth)
+        buckets = np.floor(depths / self.tile_depth).astype(np.int64)
+        fetched = {}
+        for bucket in range(first, last + 1):
+            start = np.searchsorted(buckets, bucket, side="left")
+            stop = np.searchsorted(buckets, bucket, side="right")
+            # Copies, so that a cached tile does not pin the buffer of the whole fetched run.
+            fetched[bucket] = (depths[start:stop].copy(), pixels[start:stop].copy())
+        return fetched
+
+
+def _runs(buckets: List[int]) -> List[Tuple[int, int]]:
+    """Group sorted bucket indices into (first, last) runs of consecutive buckets."""
+    runs: List[Tuple[int, int]] = []
+    for bucket in buckets:
+        if runs and runs[-1][1] == bucket - 1:
+            runs[-1] = (runs[-1][0], bucket)
+        else:
+            runs.append((bucket, bucket))
+    return runs
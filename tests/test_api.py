@@ -0,0 +1,370 @@
+import os
+import sys
+
+# Add the project root directory to the Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import asyncio
+import base64
+import io
+import json
+import threading
+import time
+
+import cv2
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from services.database import create_db_engine
+
+WIDTH = main.IMAGE_WIDTH
+ROWS = 64
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    # Every test runs the application lifespan against its own SQLite file, without the startup image
+    monkeypatch.setattr(main, "create_db_engine", lambda: create_db_engine(f"sqlite:///{tmp_path}/images.sqlite"))
+    monkeypatch.setattr(main, "seed_database", lambda database_service: False)
+    monkeypatch.setattr(main, "SEED_IN_BACKGROUND", False)
+    monkeypatch.setattr(main, "IMAGE_STORE_BACKEND", "database")
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+
+def columns(image_name, pixels, start=100.0):
+    data = {"image_name": [image_name] * pixels.shape[0], "depth": [start + row for row in range(pixels.shape[0])]}
+    for column in range(pixels.shape[1]):
+        data[str(column)] = pixels[:, column].tolist()
+    return {"data": data}
+
+
+def upload(client, image_name="well", value=None, width=WIDTH):
+    if value is None:
+        pixels = np.random.randint(0, 256, size=(ROWS, width), dtype=np.uint8)
+    else:
+        pixels = np.full((ROWS, width), value, dtype=np.uint8)
+    response = client.post("/upload-image", json=columns(image_name, pixels))
+    assert response.status_code == 200
+    return pixels
+
+
+def get_range(client, params=None, headers=None, **body):
+    body = {"depth_min": 100.0, "depth_max": 100.0 + ROWS, "image_name": "well", **body}
+    return client.request("GET", "/image-depth-range", params=params, headers=headers, json=body)
+
+
+# 1. Test Response Formats
+def test_range_defaults_to_json(client):
+    upload(client)
+    response = get_range(client)
+    assert response.status_code == 200
+    assert response.json()["shape"] == [ROWS, WIDTH, 3]
+
+
+@pytest.mark.parametrize("image_format, media_type", [("png", "image/png"), ("webp", "image/webp")])
+def test_range_format_query_returns_binary_image(client, image_format, media_type):
+    upload(client)
+    response = get_range(client, params={"format": image_format})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == media_type
+    assert response.headers["x-image-shape"] == f"{ROWS},{WIDTH},3"
+    assert cv2.imdecode(np.frombuffer(response.content, np.uint8), cv2.IMREAD_UNCHANGED).shape == (ROWS, WIDTH, 3)
+
+
+def test_range_raw_format_returns_the_stored_pixels(client):
+    pixels = upload(client)
+    response = get_range(client, params={"format": "raw"}, colormap="GRAYSCALE")
+    assert response.headers["x-image-channel-order"] == "GRAY"
+    assert np.array_equal(np.frombuffer(response.content, np.uint8).reshape(ROWS, WIDTH), pixels)
+
+
+def test_range_format_follows_accept_header(client):
+    upload(client)
+    response = get_range(client, headers={"Accept": "image/png;q=0.5, image/webp"})
+    assert response.headers["content-type"] == "image/webp"
+    assert response.headers["vary"] == "Accept"
+    # Unknown media types fall back to JSON
+    assert get_range(client, headers={"Accept": "text/html"}).json()["shape"] == [ROWS, WIDTH, 3]
+
+
+def test_range_rejects_unknown_format(client):
+    assert get_range(client, params={"format": "gif"}).status_code == 422
+
+
+def test_range_rejects_unknown_colormap(client):
+    upload(client)
+    response = get_range(client, colormap="nope")
+    assert response.status_code == 400
+
+
+def test_range_without_rows_is_a_bad_request(client):
+    upload(client)
+    response = get_range(client, depth_min=1000.0, depth_max=2000.0)
+    assert response.status_code == 400
+    assert "No data found" in response.json()["message"]
+
+
+# 2. Test Response Cache Invalidation
+def test_upload_invalidates_cached_ranges(client):
+    upload(client, value=10)
+    first = get_range(client, params={"format": "raw"}, colormap="GRAYSCALE")
+    assert set(first.content) == {10}
+
+    upload(client, value=20)
+    second = get_range(client, params={"format": "raw"}, colormap="GRAYSCALE")
+    assert set(second.content) == {20}
+
+
+# 3. Test Binary Uploads
+def binary_upload(client, body, params=None, headers=None):
+    params = {"image_name": "binary", "depth_start": 100.0, "depth_step": 1.0, **(params or {})}
+    return client.post("/upload-image-binary", params=params, headers=headers, content=body)
+
+
+def test_raw_upload_is_stored(client):
+    pixels = np.random.randint(0, 256, size=(ROWS, WIDTH), dtype=np.uint8)
+    response = binary_upload(client, pixels.tobytes(), params={"format": "raw", "width": WIDTH})
+    assert response.status_code == 200
+    stored = get_range(client, params={"format": "raw"}, image_name="binary", colormap="GRAYSCALE")
+    assert np.array_equal(np.frombuffer(stored.content, np.uint8).reshape(ROWS, WIDTH), pixels)
+
+
+def test_npy_upload_takes_its_format_from_the_content_type(client):
+    pixels = np.random.randint(0, 256, size=(ROWS, WIDTH), dtype=np.uint8)
+    buffer = io.BytesIO()
+    np.save(buffer, pixels)
+    response = binary_upload(client, buffer.getvalue(), headers={"Content-Type": "application/x-npy"})
+    assert response.status_code == 200
+    assert get_range(client, image_name="binary").json()["shape"] == [ROWS, WIDTH, 3]
+
+
+def test_upload_with_leading_depths(client):
+    pixels = np.random.randint(0, 256, size=(ROWS, WIDTH), dtype=np.uint8)
+    depths = 500.0 + np.arange(ROWS, dtype="<f8")
+    response = client.post(
+        "/upload-image-binary",
+        params={"image_name": "binary", "format": "raw", "width": WIDTH, "depth_count": ROWS},
+        content=depths.tobytes() + pixels.tobytes(),
+    )
+    assert response.status_code == 200
+    assert get_range(client, image_name="binary", depth_min=500.0, depth_max=600.0).json()["shape"][0] == ROWS
+
+
+def test_narrow_uploads_are_not_upscaled(client):
+    pixels = np.random.randint(0, 256, size=(ROWS, 10), dtype=np.uint8)
+    assert client.post("/upload-image", json=columns("narrow", pixels)).status_code == 200
+    buffer = io.BytesIO()
+    np.save(buffer, np.random.randint(0, 256, size=(ROWS, 12), dtype=np.uint8))
+    assert binary_upload(client, buffer.getvalue(), params={"format": "npy"}).status_code == 200
+
+    stored = get_range(client, params={"format": "raw"}, image_name="narrow", colormap="GRAYSCALE")
+    assert stored.headers["x-image-shape"] == f"{ROWS},10"
+    assert np.array_equal(np.frombuffer(stored.content, np.uint8).reshape(ROWS, 10), pixels)
+    assert get_range(client, image_name="binary").json()["shape"] == [ROWS, 12, 3]
+
+
+def test_wide_uploads_are_downsampled(client):
+    upload(client, width=WIDTH * 2)
+    assert get_range(client).json()["shape"] == [ROWS, WIDTH, 3]
+
+
+def test_upload_rejects_unsupported_content_type(client):
+    response = binary_upload(client, b"GIF89a", headers={"Content-Type": "image/gif"})
+    assert response.status_code == 400
+    assert "Unsupported content type" in response.json()["message"]
+
+
+def test_raw_upload_requires_a_width(client):
+    response = binary_upload(client, bytes(ROWS * WIDTH), params={"format": "raw"})
+    assert response.status_code == 400
+
+
+def test_upload_requires_depths(client):
+    response = client.post(
+        "/upload-image-binary", params={"image_name": "binary", "format": "raw", "width": WIDTH}, content=bytes(WIDTH)
+    )
+    assert response.status_code == 400
+
+
+def test_upload_rejects_bodies_over_the_limit(client, monkeypatch):
+    monkeypatch.setattr(main, "UPLOAD_MAX_BYTES", 16)
+    response = binary_upload(client, bytes(32), params={"format": "raw", "width": 4})
+    assert response.status_code == 413
+
+
+# 4. Test Batch Windows
+def test_batch_streams_one_line_per_window(client):
+    upload(client)
+    windows = [
+        {"image_name": "well", "depth_min": 100.0, "depth_max": 131.0},
+        {"image_name": "well", "depth_min": 1000.0, "depth_max": 2000.0},
+        {"image_name": "well", "depth_min": 100.0, "depth_max": 131.0, "colormap": "nope"},
+    ]
+    response = client.post("/image-depth-range/batch", json={"windows": windows})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = {line["index"]: line for line in map(json.loads, response.text.splitlines())}
+    assert lines[0]["shape"] == [32, WIDTH, 3]
+    assert lines[1]["status"] == 400
+    assert lines[2]["status"] == 400
+
+
+def test_batch_rejects_empty_requests(client):
+    assert client.post("/image-depth-range/batch", json={"windows": []}).status_code == 422
+
+
+# 5. Test Streamed Ranges
+def test_stream_returns_every_row(client, monkeypatch):
+    monkeypatch.setattr(main, "STREAM_STRIP_ROWS", 10)
+    pixels = upload(client)
+    body = {"depth_min": 100.0, "depth_max": 100.0 + ROWS, "image_name": "well", "colormap": "GRAYSCALE"}
+    response = client.request("GET", "/image-depth-range/stream", json=body)
+    assert response.status_code == 200
+    assert response.headers["x-image-shape"] == f"-1,{WIDTH}"
+    assert np.array_equal(np.frombuffer(response.content, np.uint8).reshape(ROWS, WIDTH), pixels)
+
+
+def test_stream_json_lines_cover_the_range(client, monkeypatch):
+    monkeypatch.setattr(main, "STREAM_STRIP_ROWS", 10)
+    upload(client)
+    body = {"depth_min": 100.0, "depth_max": 100.0 + ROWS, "image_name": "well"}
+    response = client.request("GET", "/image-depth-range/stream", params={"format": "json"}, json=body)
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert sum(line["shape"][0] for line in lines) == ROWS
+    assert len(base64.b64decode(lines[0]["image"])) == 10 * WIDTH * 3
+
+
+def test_abandoned_stream_releases_its_connection(client, monkeypatch):
+    monkeypatch.setattr(main, "STREAM_STRIP_ROWS", 4)
+    upload(client)
+    render_strips = main.render_strips
+
+    def slow_strips(*args):
+        # The client leaves while a strip is being read in the pool thread
+        for strip in render_strips(*args):
+            time.sleep(0.05)
+            yield strip
+
+    monkeypatch.setattr(main, "render_strips", slow_strips)
+    body = json.dumps({"depth_min": 100.0, "depth_max": 100.0 + ROWS, "image_name": "well"}).encode()
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/image-depth-range/stream",
+        "raw_path": b"/image-depth-range/stream",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        "client": ("testclient", 50000),
+        "server": ("testserver", 80),
+    }
+
+    async def abandon():
+        first_chunk = asyncio.Event()
+        chunks = []
+        requests = iter([{"type": "http.request", "body": body, "more_body": False}])
+
+        async def receive():
+            message = next(requests, None)
+            if message is not None:
+                return message
+            await first_chunk.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.body" and message.get("body"):
+                chunks.append(message["body"])
+                first_chunk.set()
+
+        await main.app(scope, receive, send)
+        return chunks
+
+    chunks = client.portal.call(abandon)
+    assert 0 < len(chunks) < ROWS // 4
+    stats = client.get("/db-pool-stats").json()
+    assert stats["pool_checkedout"] == 0
+    assert stats["checkouts"] == stats["checkins"]
+
+
+def test_stream_without_rows_is_a_bad_request(client):
+    upload(client)
+    body = {"depth_min": 1000.0, "depth_max": 2000.0, "image_name": "well"}
+    assert client.request("GET", "/image-depth-range/stream", json=body).status_code == 400
+
+
+# 6. Test Ingest Jobs
+def wait_for_job(client, status_url):
+    for _ in range(200):
+        job = client.get(status_url).json()
+        if job["status"] in ("succeeded", "failed"):
+            return job
+        time.sleep(0.02)
+    raise AssertionError("The ingest job did not finish.")
+
+
+def test_upload_job_reports_its_progress(client):
+    pixels = np.random.randint(0, 256, size=(ROWS, WIDTH), dtype=np.uint8)
+    response = client.post("/upload-image", params={"job": "true"}, json=columns("queued", pixels))
+    assert response.status_code == 202
+    job = wait_for_job(client, response.json()["status_url"])
+    assert job["status"] == "succeeded"
+    assert job["image_name"] == "queued"
+    assert [listed["job_id"] for listed in client.get("/ingest-jobs").json()["jobs"]] == [job["job_id"]]
+    assert get_range(client, image_name="queued").json()["shape"] == [ROWS, WIDTH, 3]
+
+
+def test_failed_upload_job_reports_its_error(client):
+    response = binary_upload(client, bytes(ROWS * WIDTH), params={"job": "true", "format": "raw", "width": 7})
+    assert response.status_code == 202
+    job = wait_for_job(client, response.json()["status_url"])
+    assert job["status"] == "failed"
+    assert "rows" in job["error"]
+
+
+def test_unknown_ingest_job_is_not_found(client):
+    assert client.get("/ingest-jobs/unknown").status_code == 404
+
+
+# 7. Test Health Before Seeding
+def test_health_is_unavailable_until_seeded(tmp_path, monkeypatch):
+    seeded = threading.Event()
+    monkeypatch.setattr(main, "create_db_engine", lambda: create_db_engine(f"sqlite:///{tmp_path}/images.sqlite"))
+    monkeypatch.setattr(main, "seed_database", lambda database_service: seeded.wait(5))
+    monkeypatch.setattr(main, "SEED_IN_BACKGROUND", True)
+    monkeypatch.setattr(main, "IMAGE_STORE_BACKEND", "database")
+    with TestClient(main.app) as test_client:
+        response = test_client.get("/health")
+        assert response.status_code == 503
+        assert response.json() == {"status": "UNAVAILABLE", "seed": "seeding"}
+
+        seeded.set()
+        for _ in range(100):
+            response = test_client.get("/health")
+            if response.status_code == 200:
+                break
+            time.sleep(0.02)
+        assert response.json() == {"status": "OK", "seed": "ready"}
+
+
+def test_health_reports_a_failed_seed(tmp_path, monkeypatch):
+    def fail(database_service):
+        raise main.DatabaseServiceError("seed file missing")
+
+    monkeypatch.setattr(main, "create_db_engine", lambda: create_db_engine(f"sqlite:///{tmp_path}/images.sqlite"))
+    monkeypatch.setattr(main, "seed_database", fail)
+    monkeypatch.setattr(main, "SEED_IN_BACKGROUND", True)
+    monkeypatch.setattr(main, "IMAGE_STORE_BACKEND", "database")
+    with TestClient(main.app) as test_client:
+        for _ in range(100):
+            response = test_client.get("/health")
+            if response.json()["seed"] == "failed":
+                break
+            time.sleep(0.02)
+        assert response.status_code == 503
+        assert response.json()["error"] == "seed file missing"
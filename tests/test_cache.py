@@ -0,0 +1,71 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from services.cache import LRUCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_hit_and_miss():
+    cache = LRUCache(max_bytes=100)
+    assert cache.get("a") is None
+    cache.put("a", "value", size=5)
+    assert cache.get("a") == "value"
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 1)
+
+
+def test_evicts_least_recently_used_by_size():
+    cache = LRUCache(max_bytes=10)
+    cache.put("a", "a", size=4)
+    cache.put("b", "b", size=4)
+    cache.get("a")
+    cache.put("c", "c", size=4)
+    assert cache.get("b") is None
+    assert cache.get("a") == "a"
+    assert cache.get("c") == "c"
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["current_bytes"] == 8
+
+
+def test_oversized_values_are_not_cached():
+    cache = LRUCache(max_bytes=10)
+    assert not cache.put("a", "a", size=11)
+    assert cache.stats()["entries"] == 0
+
+
+def test_entries_expire_after_ttl():
+    clock = FakeClock()
+    cache = LRUCache(max_bytes=10, ttl=5, clock=clock)
+    cache.put("a", "a", size=1)
+    clock.now = 4.9
+    assert cache.get("a") == "a"
+    clock.now = 5.0
+    assert cache.get("a") is None
+    assert cache.stats()["expirations"] == 1
+
+
+def test_invalidate_by_tag():
+    cache = LRUCache(max_bytes=100)
+    cache.put(("img1", 0), "x", size=1, tag="img1")
+    cache.put(("img1", 1), "y", size=1, tag="img1")
+    cache.put(("img2", 0), "z", size=1, tag="img2")
+    assert cache.invalidate("img1") == 2
+    assert cache.get(("img1", 0)) is None
+    assert cache.get(("img2", 0)) == "z"
+
+
+def test_stale_generation_is_refused():
+    cache = LRUCache(max_bytes=100)
+    generation = cache.generation("img1")
+    cache.invalidate("img1")
+    assert not cache.put("key", "stale", size=1, tag="img1", generation=generation)
+    assert cache.put("key", "fresh", size=1, tag="img1", generation=cache.generation("img1"))
@@ -0,0 +1,101 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import json
+
+import cv2
+import numpy as np
+import pytest
+
+from exceptions.exceptions import ColorMapError
+from services.colormaps import ColormapRegistry
+
+
+@pytest.fixture
+def registry():
+    return ColormapRegistry()
+
+
+def test_luts_match_opencv(registry):
+    pixels = np.random.randint(0, 256, size=(40, 30), dtype=np.uint8)
+    for name in registry.names()[2:]:
+        assert np.array_equal(registry.apply(pixels, name), cv2.applyColorMap(pixels, getattr(cv2, name)))
+
+
+def test_color_pixels_match_opencv(registry):
+    pixels = np.random.randint(0, 256, size=(40, 30, 3), dtype=np.uint8)
+    assert np.array_equal(
+        registry.apply(pixels, "COLORMAP_VIRIDIS"),
+        cv2.applyColorMap(cv2.cvtColor(pixels, cv2.COLOR_RGB2BGR), cv2.COLORMAP_VIRIDIS),
+    )
+
+
+def test_color_pixels_are_rgb_ordered(registry):
+    red = np.zeros((4, 4, 3), dtype=np.uint8)
+    red[:, :, 0] = 255
+    blue = red[:, :, ::-1].copy()
+    # Red weighs 0.299 in the luminance, blue 0.114
+    assert (registry.apply(red, "grayscale") == 76).all()
+    assert (registry.apply(blue, "grayscale") == 29).all()
+    assert (registry.apply(np.dstack([red, np.full((4, 4), 255, np.uint8)]), "grayscale") == 76).all()
+    assert np.array_equal(
+        registry.apply(red, "jet"), cv2.applyColorMap(np.full((4, 4), 76, np.uint8), cv2.COLORMAP_JET)
+    )
+
+
+def test_apply_writes_into_output_buffer(registry):
+    pixels = np.random.randint(0, 256, size=(40, 30), dtype=np.uint8)
+    out = np.empty((40, 30, 3), dtype=np.uint8)
+    assert registry.apply(pixels, "jet", out=out) is out
+    assert np.array_equal(out, cv2.applyColorMap(pixels, cv2.COLORMAP_JET))
+    with pytest.raises(ColorMapError):
+        registry.apply(pixels, "jet", out=np.empty((40, 30), dtype=np.uint8))
+
+
+def test_passthrough_colormaps(registry):
+    pixels = np.random.randint(0, 256, size=(40, 30, 3), dtype=np.uint8)
+    assert registry.apply(pixels, "raw") is pixels
+    assert np.array_equal(registry.apply(pixels, "grayscale"), cv2.cvtColor(pixels, cv2.COLOR_RGB2GRAY))
+    gray = pixels[:, :, 0].copy()
+    assert registry.apply(gray, "GRAYSCALE") is gray
+
+
+def test_resolve(registry):
+    assert registry.resolve("jet") == "COLORMAP_JET"
+    assert registry.resolve(" colormap_jet ") == "COLORMAP_JET"
+    assert registry.resolve("Grayscale") == "GRAYSCALE"
+    with pytest.raises(ColorMapError):
+        registry.resolve("INVALID_COLORMAP")
+
+
+def test_register_interpolates_rgb_colors(registry):
+    name = registry.register("red_to_blue", np.array([[255, 0, 0], [0, 0, 255]]))
+    assert name == "COLORMAP_RED_TO_BLUE"
+    lut = registry.lut("red_to_blue")
+    assert lut.shape == (256, 3)
+    # Stored in BGR order
+    assert lut[0].tolist() == [0, 0, 255]
+    assert lut[255].tolist() == [255, 0, 0]
+    assert not lut.flags.writeable
+
+
+@pytest.mark.parametrize(
+    "name, colors",
+    [("raw", [[0, 0, 0], [1, 1, 1]]), ("one", [[0, 0, 0]]), ("flat", [0, 0, 0]), ("hot", [[0, 0, 0], [0, 0, 300]])],
+)
+def test_register_rejects_invalid_colormaps(registry, name, colors):
+    with pytest.raises(ColorMapError):
+        registry.register(name, np.array(colors))
+
+
+def test_load_file(registry, tmp_path):
+    path = tmp_path / "colormaps.json"
+    path.write_text(json.dumps({"terrain": [[0, 0, 255], [0, 255, 0], [255, 255, 255]]}))
+    assert registry.load_file(str(path)) == ["COLORMAP_TERRAIN"]
+    assert "COLORMAP_TERRAIN" in registry.names()
+
+    path.write_text("[]")
+    with pytest.raises(ColorMapError):
+        registry.load_file(str(path))
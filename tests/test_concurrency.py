@@ -0,0 +1,123 @@
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import asyncio
+import contextvars
+import threading
+
+import pytest
+
+from exceptions.exceptions import ServiceBusyError
+from services.concurrency import BlockingExecutor, heartbeat, prefetch
+
+
+def test_blocking_calls_run_in_parallel():
+    executor = BlockingExecutor(max_workers=4, max_pending=0, queue_timeout=1.0)
+
+    async def run_all():
+        return await asyncio.gather(*(executor.run(time.sleep, 0.2) for _ in range(4)))
+
+    started = time.perf_counter()
+    asyncio.run(run_all())
+    elapsed = time.perf_counter() - started
+    executor.shutdown()
+    assert elapsed < 0.6
+    assert executor.stats()["completed"] == 4
+
+
+def test_saturated_executor_rejects_calls():
+    executor = BlockingExecutor(max_workers=1, max_pending=1, queue_timeout=0.05)
+
+    async def run_all():
+        return await asyncio.gather(
+            *(executor.run(time.sleep, 0.3) for _ in range(3)), return_exceptions=True
+        )
+
+    results = asyncio.run(run_all())
+    executor.shutdown()
+    assert sum(isinstance(result, ServiceBusyError) for result in results) == 1
+    assert executor.stats()["rejected"] == 1
+
+
+def test_cancelled_calls_keep_their_slot_until_they_end():
+    executor = BlockingExecutor(max_workers=1, max_pending=0, queue_timeout=0.05)
+    release = threading.Event()
+
+    async def run_all():
+        task = asyncio.ensure_future(executor.run(release.wait, 5))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.sleep(0.05)
+        # The abandoned call still runs, so it still holds the only slot
+        assert executor.stats()["in_flight"] == 1
+        with pytest.raises(ServiceBusyError):
+            await executor.run(time.sleep, 0)
+
+        release.set()
+        await asyncio.sleep(0.1)
+        assert executor.stats()["in_flight"] == 0
+        return await executor.run(lambda: "free")
+
+    assert asyncio.run(run_all()) == "free"
+    executor.shutdown()
+
+
+def test_context_is_propagated():
+    request_id = contextvars.ContextVar("request_id")
+    executor = BlockingExecutor(max_workers=1, max_pending=0, queue_timeout=1.0)
+
+    async def run():
+        request_id.set("abc")
+        return await executor.run(request_id.get)
+
+    assert asyncio.run(run()) == "abc"
+    executor.shutdown()
+
+
+def test_prefetch_preserves_order():
+    assert list(prefetch(iter(range(100)), depth=3)) == list(range(100))
+
+
+def test_prefetch_reraises_producer_errors():
+    def produce():
+        yield 1
+        raise ValueError("bad chunk")
+
+    items = prefetch(produce())
+    assert next(items) == 1
+    with pytest.raises(ValueError, match="bad chunk"):
+        next(items)
+
+
+def test_prefetch_stops_producer_when_consumer_stops():
+    produced = []
+
+    def produce():
+        for item in range(1000):
+            produced.append(item)
+            yield item
+
+    items = prefetch(produce(), depth=2)
+    next(items)
+    items.close()
+    assert len(produced) < 10
+
+
+def test_heartbeat_beats_until_the_block_ends():
+    beats = []
+
+    def beat():
+        beats.append(time.perf_counter())
+        if len(beats) == 1:
+            raise RuntimeError("lease store unavailable")
+
+    with heartbeat(beat, 0.02):
+        time.sleep(0.15)
+    count = len(beats)
+    time.sleep(0.05)
+    # A failed beat does not stop the next ones
+    assert count >= 4
+    assert len(beats) == count
@@ -8,7 +8,7 @@ import pandas as pd
 from services.image_processing import ImageProcessingService
 from unittest.mock import patch
 from PIL import Image
-from exceptions.exceptions import DataCleanerError
+from exceptions.exceptions import DataCleanerError, ImageProcessingError
 import numpy as np
 
 
@@ -60,3 +60,235 @@ def test_image_to_dataframe():
     df_rgb = ImageProcessingService.image_to_dataframe(rgb_image)
     assert df_rgb.shape == (rgb_data.shape[0], rgb_data.shape[1] * rgb_data.shape[2])
     assert np.array_equal(df_rgb.values, rgb_data.reshape(rgb_data.shape[0], -1))
+
+
+def test_build_pyramid():
+    pixels = np.random.randint(0, 256, size=(101, 40), dtype=np.uint8)
+    depths = np.arange(101, dtype=np.float64)
+    pyramid = ImageProcessingService.build_pyramid(pixels, depths, levels=10, min_width=8)
+
+    assert [level_pixels.shape for _, level_pixels in pyramid] == [(101, 40), (50, 20), (25, 10)]
+    assert np.array_equal(pyramid[1][0], np.arange(0.5, 100, 2.0))
+    assert np.array_equal(pyramid[2][0], np.arange(1.5, 100, 4.0))
+    # INTER_AREA rounds the block mean, halves may go either way
+    assert abs(int(pyramid[1][1][0, 0]) - pixels[0:2, 0:2].mean()) <= 0.5
+
+
+def test_split_pyramid_reassembles_every_level():
+    pixels = np.random.randint(0, 256, size=(98, 40), dtype=np.uint8)
+    depths = np.arange(98, dtype=np.float64)
+    pyramid = ImageProcessingService.build_pyramid(pixels, depths, levels=3, min_width=8)
+    chunks = list(ImageProcessingService.split_pyramid(pyramid, chunk_rows=30))
+
+    # 30 rows are rounded up to a multiple of 4 so that every chunk halves evenly; the coarsest level
+    # ends with the third chunk
+    assert [len(chunk[0][0]) for chunk in chunks] == [32, 32, 32, 2]
+    assert [len(chunk) for chunk in chunks] == [3, 3, 3, 2]
+    for level, (level_depths, level_pixels) in enumerate(pyramid):
+        assert np.array_equal(np.concatenate([chunk[level][0] for chunk in chunks if len(chunk) > level]), level_depths)
+        assert np.array_equal(np.concatenate([chunk[level][1] for chunk in chunks if len(chunk) > level]), level_pixels)
+
+
+def _write_csv(path, rows, width):
+    lines = ["depth," + ",".join(str(column) for column in range(width))]
+    for row in range(rows):
+        values = ["" if row % 7 == 3 and column == 0 else str((row + column) % 256) for column in range(width)]
+        lines.append("{},{}".format(100.0 + row * 0.5, ",".join(values)))
+    path.write_text("\n".join(lines) + "\n")
+
+
+def test_iter_clean_data_drops_missing_rows(tmp_path):
+    csv_path = tmp_path / "img.csv"
+    _write_csv(csv_path, rows=50, width=6)
+    chunks = list(ImageProcessingService(str(csv_path)).iter_clean_data(chunk_rows=20))
+
+    assert [len(chunk) for chunk in chunks] == [17, 17, 9]
+    assert all(chunk[column].dtype == np.uint8 for chunk in chunks for column in chunk.columns[1:])
+    whole = ImageProcessingService(str(csv_path)).clean_data()
+    assert np.array_equal(pd.concat(chunks)["depth"].to_numpy(), whole["depth"].to_numpy())
+
+
+def test_iter_image_chunks_are_block_aligned(tmp_path):
+    csv_path = tmp_path / "img.csv"
+    _write_csv(csv_path, rows=100, width=6)
+    chunks = list(ImageProcessingService(str(csv_path)).iter_image_chunks(chunk_rows=20, block_rows=8))
+
+    assert all(len(depths) % 8 == 0 for depths, _ in chunks[:-1])
+    depths = np.concatenate([depths for depths, _ in chunks])
+    pixels = np.concatenate([pixels for _, pixels in chunks])
+    whole = ImageProcessingService(str(csv_path)).clean_data()
+    assert np.array_equal(depths, whole["depth"].to_numpy())
+    assert np.array_equal(pixels, whole.drop(columns=["depth"]).to_numpy(dtype=np.uint8))
+
+
+def test_iter_clean_data_invalid_pixel(tmp_path):
+    csv_path = tmp_path / "img.csv"
+    csv_path.write_text("depth,0,1\n1.0,3,300\n")
+    with pytest.raises(DataCleanerError):
+        list(ImageProcessingService(str(csv_path)).iter_clean_data(chunk_rows=10))
+
+
+def _depth_ramp(depths, width=12):
+    # Every pixel of a row holds its depth, so misaligned rows and depths show up as value mismatches
+    return np.repeat(np.rint(depths).astype(np.uint8)[:, None], width, axis=1)
+
+
+@pytest.mark.parametrize("method", ["area", "bilinear", "lanczos"])
+def test_resample_keeps_rows_and_depths_aligned(method):
+    depths = np.linspace(0.0, 250.0, 501)
+    resampled_depths, pixels = ImageProcessingService.resample(
+        _depth_ramp(depths), depths, width=6, height=100, method=method
+    )
+    assert pixels.shape == (100, 6)
+    assert resampled_depths.shape == (100,)
+    assert np.abs(pixels[:, 0].astype(float) - resampled_depths).max() <= 1.0
+
+
+@pytest.mark.parametrize("method", ["area", "bilinear", "lanczos"])
+def test_resample_onto_depth_step(method):
+    # Irregularly spaced and unsorted depths
+    generator = np.random.default_rng(7)
+    depths = np.sort(generator.uniform(10.0, 240.0, size=400))
+    depths[[0, -1]] = 10.0, 240.0
+    order = generator.permutation(400)
+    grid, pixels = ImageProcessingService.resample(
+        _depth_ramp(depths)[order], depths[order], depth_step=5.0, method=method
+    )
+    assert np.allclose(grid, np.arange(10.0, 240.1, 5.0))
+    assert pixels.shape == (len(grid), 12)
+    assert np.abs(pixels[:, 0].astype(float) - grid).max() <= 2.0
+
+
+def test_resample_width_only_keeps_depths():
+    depths = np.arange(30, dtype=np.float64)
+    pixels = np.random.randint(0, 256, size=(30, 40, 3), dtype=np.uint8)
+    resampled_depths, resampled = ImageProcessingService.resample(pixels, depths, width=10)
+    assert resampled.shape == (30, 10, 3)
+    assert np.array_equal(resampled_depths, depths)
+
+
+@pytest.mark.parametrize(
+    "kwargs", [{"method": "cubic"}, {"depth_step": 0.0}, {"width": 0}, {"depths": np.arange(3.0)}]
+)
+def test_resample_rejects_invalid_arguments(kwargs):
+    arguments = {"pixels": np.zeros((5, 4), dtype=np.uint8), "depths": np.arange(5.0)}
+    arguments.update(kwargs)
+    with pytest.raises(DataCleanerError):
+        ImageProcessingService.resample(**arguments)
+
+
+def test_decode_raw_image_is_zero_copy():
+    pixels = np.random.randint(0, 256, size=(20, 6, 3), dtype=np.uint8)
+    depths = np.arange(20, dtype="<f8")
+    body = bytearray(depths.tobytes() + pixels.tobytes())
+
+    decoded_depths, rest = ImageProcessingService.split_depths(body, 20)
+    decoded = ImageProcessingService.decode_image(rest, "raw", width=6, channels=3)
+    assert np.array_equal(decoded_depths, depths)
+    assert np.array_equal(decoded, pixels)
+    assert np.shares_memory(decoded, np.frombuffer(body, dtype=np.uint8))
+
+
+def test_decode_npy_image():
+    import io
+
+    pixels = np.asfortranarray(np.random.randint(0, 256, size=(20, 6), dtype=np.uint8))
+    buffer = io.BytesIO()
+    np.save(buffer, pixels)
+    decoded = ImageProcessingService.decode_image(buffer.getvalue(), "npy")
+    assert np.array_equal(decoded, pixels)
+
+    buffer = io.BytesIO()
+    np.save(buffer, pixels.astype(np.float32))
+    with pytest.raises(ImageProcessingError):
+        ImageProcessingService.decode_image(buffer.getvalue(), "npy")
+
+
+def test_decode_png_image():
+    import cv2
+
+    pixels = np.random.randint(0, 256, size=(20, 6, 3), dtype=np.uint8)
+    _, encoded = cv2.imencode(".png", cv2.cvtColor(pixels, cv2.COLOR_RGB2BGR))
+    assert np.array_equal(ImageProcessingService.decode_image(encoded.tobytes(), "png"), pixels)
+    with pytest.raises(ImageProcessingError):
+        ImageProcessingService.decode_image(b"not an image", "png")
+
+
+def test_decode_webp_image():
+    import cv2
+
+    pixels = np.random.randint(0, 256, size=(20, 6, 3), dtype=np.uint8)
+    _, encoded = cv2.imencode(".webp", cv2.cvtColor(pixels, cv2.COLOR_RGB2BGR), [cv2.IMWRITE_WEBP_QUALITY, 101])
+    assert np.array_equal(ImageProcessingService.decode_image(encoded.tobytes(), "webp"), pixels)
+    with pytest.raises(ImageProcessingError, match="WEBP"):
+        ImageProcessingService.decode_image(b"not an image", "webp")
+
+
+@pytest.mark.parametrize(
+    "body, image_format, width",
+    [(b"\x00" * 10, "raw", 4), (b"\x00" * 10, "raw", None), (b"\x00" * 10, "bmp", None)],
+)
+def test_decode_image_rejects_invalid_bodies(body, image_format, width):
+    with pytest.raises(ImageProcessingError):
+        ImageProcessingService.decode_image(body, image_format, width=width)
+
+
+def test_split_depths_rejects_short_body():
+    with pytest.raises(ImageProcessingError):
+        ImageProcessingService.split_depths(b"\x00" * 10, 2)
+
+
+@pytest.mark.parametrize("image_format", ["png", "raw"])
+def test_encode_image_is_lossless(image_format):
+    import cv2
+
+    pixels = np.random.randint(0, 256, size=(20, 6, 3), dtype=np.uint8)
+    encoded = ImageProcessingService.encode_image(pixels, image_format)
+    if image_format == "raw":
+        decoded = np.frombuffer(encoded, dtype=np.uint8).reshape(pixels.shape)
+    else:
+        decoded = cv2.imdecode(np.frombuffer(encoded, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+    assert np.array_equal(decoded, pixels)
+
+
+def test_encode_webp_image():
+    import cv2
+
+    pixels = np.tile(np.arange(0, 240, 2, dtype=np.uint8), (50, 1))
+    encoded = ImageProcessingService.encode_image(pixels, "webp", webp_quality=101)
+    assert encoded[8:12] == b"WEBP"
+    decoded = cv2.imdecode(np.frombuffer(encoded, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    assert np.array_equal(decoded, pixels)
+    with pytest.raises(ImageProcessingError):
+        ImageProcessingService.encode_image(pixels, "gif")
+
+
+def test_columns_to_arrays():
+    data = {"depth": [1.0, 2.0], "0": [1, 2], "1": [3, 4], "image_name": ["a", "a"]}
+    depths, pixels = ImageProcessingService.columns_to_arrays(data)
+    assert np.array_equal(depths, [1.0, 2.0])
+    assert pixels.dtype == np.uint8
+    assert np.array_equal(pixels, [[1, 3], [2, 4]])
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        {"depth": [1.0], "0": [256]},
+        {"depth": [1.0], "0": [-1]},
+        {"depth": [1.0], "0": ["x"]},
+        {"depth": [1.0], "0": [float("nan")]},
+        {"depth": [1.0, 2.0], "0": [1]},
+        {"0": [1]},
+    ],
+)
+def test_columns_to_arrays_rejects_invalid_data(data):
+    with pytest.raises(DataCleanerError):
+        ImageProcessingService.columns_to_arrays(data)
+
+
+def test_frame_to_arrays():
+    frame = pd.DataFrame({"depth": [1.5, 2.5], "0": [10, 20], "1": [30, 40]})
+    depths, pixels = ImageProcessingService.frame_to_arrays(frame)
+    assert np.array_equal(depths, [1.5, 2.5])
+    assert np.array_equal(pixels, np.array([[10, 30], [20, 40]], dtype=np.uint8))
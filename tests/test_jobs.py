@@ -0,0 +1,94 @@
+import os
+import sys
+import threading
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import pytest
+
+from exceptions.exceptions import ServiceBusyError
+from services.jobs import FAILED, QUEUED, RUNNING, SUCCEEDED, IngestJob, IngestJobManager
+
+
+def _wait(job, timeout=5.0):
+    for _ in range(int(timeout / 0.01)):
+        if job.done:
+            return
+        threading.Event().wait(0.01)
+    raise AssertionError(f"Job {job.job_id} did not finish.")
+
+
+def test_job_reports_progress_and_throughput():
+    job = IngestJob("image")
+    assert job.snapshot()["status"] == QUEUED
+
+    job.start()
+    job.start_writing(rows_total=200)
+    job.add_rows(50)
+    snapshot = job.snapshot()
+    assert (snapshot["status"], snapshot["stage"]) == (RUNNING, "write")
+    assert (snapshot["rows_written"], snapshot["rows_total"], snapshot["progress"]) == (50, 200, 0.25)
+    assert snapshot["rows_per_second"] > 0
+
+    job.add_rows(150)
+    job.finish()
+    snapshot = job.snapshot()
+    assert (snapshot["status"], snapshot["progress"], snapshot["error"]) == (SUCCEEDED, 1.0, None)
+
+
+def test_manager_runs_jobs_and_records_failures():
+    manager = IngestJobManager(max_workers=2, max_pending=2, max_finished=10)
+
+    def ingest(job, rows):
+        job.start_writing(rows)
+        job.add_rows(rows)
+
+    def fail(job):
+        job.set_stage("decode")
+        raise ValueError("bad pixels")
+
+    try:
+        succeeded = manager.submit("good", ingest, 10)
+        failed = manager.submit("bad", fail)
+        _wait(succeeded)
+        _wait(failed)
+    finally:
+        manager.shutdown()
+
+    assert manager.get(succeeded.job_id).snapshot()["rows_written"] == 10
+    snapshot = failed.snapshot()
+    assert (snapshot["status"], snapshot["stage"], snapshot["error"]) == (FAILED, "decode", "bad pixels")
+    assert [job["job_id"] for job in manager.list()] == [failed.job_id, succeeded.job_id]
+    assert manager.get("unknown") is None
+
+
+def test_manager_rejects_jobs_beyond_the_queue():
+    manager = IngestJobManager(max_workers=1, max_pending=1, max_finished=10)
+    release = threading.Event()
+    try:
+        running = manager.submit("a", lambda job: release.wait(5))
+        queued = manager.submit("b", lambda job: None)
+        with pytest.raises(ServiceBusyError):
+            manager.submit("c", lambda job: None)
+        release.set()
+        _wait(running)
+        _wait(queued)
+        _wait(manager.submit("d", lambda job: None))
+    finally:
+        release.set()
+        manager.shutdown()
+
+
+def test_manager_keeps_the_latest_finished_jobs():
+    manager = IngestJobManager(max_workers=1, max_pending=10, max_finished=2)
+    try:
+        jobs = []
+        for index in range(4):
+            jobs.append(manager.submit(str(index), lambda job: None))
+            _wait(jobs[-1])
+    finally:
+        manager.shutdown()
+
+    # Finished jobs are pruned when a new job is submitted
+    assert manager.get(jobs[0].job_id) is None
+    assert [job["image_name"] for job in manager.list()] == ["3", "2", "1"]
@@ -0,0 +1,234 @@
+import multiprocessing
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import cv2
+import numpy as np
+import pytest
+from unittest.mock import patch
+
+from exceptions.exceptions import DatabaseQueryError, DatabaseServiceError
+from services.database import SEED_BUSY, SEED_CLAIMED, SEED_READY
+from services.image_processing import ImageProcessingService
+from services.memmap_store import MemmapImageStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return MemmapImageStore(root=str(tmp_path))
+
+
+def make_image(height=64, width=12, start=100.0):
+    depths = start + np.arange(height, dtype=np.float64) * 0.5
+    pixels = np.random.randint(0, 256, size=(height, width), dtype=np.uint8)
+    return depths, pixels
+
+
+def test_round_trip_range(store):
+    depths, pixels = make_image()
+    stats = store.store_image("well", depths, pixels)
+    assert stats.rows == 64
+
+    loaded_depths, loaded_pixels = store.load_image("well", 105.0, 110.0)
+    mask = (depths >= 105.0) & (depths <= 110.0)
+    assert np.array_equal(loaded_depths, depths[mask])
+    assert np.array_equal(loaded_pixels, pixels[mask])
+
+
+def test_range_is_a_view_of_the_memory_map(store):
+    depths, pixels = make_image()
+    store.store_image("well", depths, pixels)
+
+    _, loaded = store.load_image("well", 101.0, 120.0)
+    assert isinstance(loaded.base, np.memmap) or isinstance(loaded, np.memmap)
+    assert not loaded.flags.writeable
+
+
+def test_unsorted_depths_are_sorted(store):
+    depths, pixels = make_image()
+    order = np.random.default_rng(3).permutation(depths.size)
+    store.store_image("well", depths[order], pixels[order])
+
+    loaded_depths, loaded_pixels = store.load_image("well", 0.0, 1000.0)
+    assert np.array_equal(loaded_depths, depths)
+    assert np.array_equal(loaded_pixels, pixels)
+
+
+def test_color_image(store):
+    depths = np.arange(10, dtype=np.float64)
+    pixels = np.random.randint(0, 256, size=(10, 6, 3), dtype=np.uint8)
+    store.store_image("color", depths, pixels)
+
+    _, loaded = store.load_image("color", 2.0, 4.0)
+    assert np.array_equal(loaded, pixels[2:5])
+
+
+def test_missing_image_and_empty_range(store):
+    depths, pixels = make_image()
+    store.store_image("well", depths, pixels)
+
+    assert store.load_image("other", 0.0, 1000.0)[1].shape[0] == 0
+    assert store.load_image("well", 0.0, 1.0)[1].shape[0] == 0
+    with pytest.raises(DatabaseQueryError):
+        store.get_image_data(0.0, 1.0, "COLORMAP_JET", "well")
+
+
+def test_get_image_data_applies_colormap(store):
+    depths, pixels = make_image()
+    store.store_image("well", depths, pixels)
+
+    image = store.get_image_data(100.0, 1000.0, "jet", "well")
+    assert np.array_equal(image, cv2.applyColorMap(pixels, cv2.COLORMAP_JET))
+
+
+def test_replace_image(store, tmp_path):
+    depths, pixels = make_image()
+    store.store_image("well", depths, pixels)
+    _, old = store.load_image("well", 0.0, 1000.0)
+    old_copy = np.array(old)
+
+    new_depths, new_pixels = make_image(height=8, start=0.0)
+    store.store_image("well", new_depths, new_pixels)
+
+    loaded_depths, loaded_pixels = store.load_image("well", 0.0, 1000.0)
+    assert np.array_equal(loaded_depths, new_depths)
+    assert np.array_equal(loaded_pixels, new_pixels)
+    # A reader of the replaced version keeps its rows
+    assert np.array_equal(old, old_copy)
+    # The replaced version is kept until the next upload
+    image_dir = os.path.join(str(tmp_path), "t_images", "i_well")
+    assert len([entry for entry in os.listdir(image_dir) if entry.startswith("v-")]) == 2
+    store.store_image("well", depths, pixels)
+    assert len([entry for entry in os.listdir(image_dir) if entry.startswith("v-")]) == 2
+
+
+def _store_repeatedly(root, value):
+    store = MemmapImageStore(root=root)
+    depths, _ = make_image()
+    for _ in range(20):
+        store.store_image("well", depths, np.full((64, 12), value, dtype=np.uint8))
+
+
+def test_concurrent_processes_publish_one_at_a_time(store, tmp_path):
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=_store_repeatedly, args=(str(tmp_path), value)) for value in (1, 2, 3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert [worker.exitcode for worker in workers] == [0, 0, 0]
+
+    _, pixels = store.load_image("well", 0.0, 1000.0)
+    assert pixels.shape == (64, 12)
+    assert len(np.unique(pixels)) == 1
+
+
+def test_read_retries_a_version_removed_after_it_was_resolved(store, monkeypatch):
+    depths, pixels = make_image()
+    store.store_image("well", depths, pixels)
+    stale = store._current_version("images", "well")
+    store.store_image("well", depths, pixels)
+    store.store_image("well", depths, pixels)
+    assert not os.path.exists(stale)
+
+    current = store._current_version
+    resolved = iter([stale])
+    monkeypatch.setattr(store, "_current_version", lambda *args: next(resolved, None) or current(*args))
+    _, loaded = store.load_image("well", 0.0, 1000.0)
+    assert np.array_equal(loaded, pixels)
+
+
+def test_pyramid_levels_and_select_level(store):
+    depths, pixels = make_image(height=64, width=32)
+    pyramid = ImageProcessingService.build_pyramid(pixels, depths, levels=3, min_width=4)
+    store.store_pyramid("well", pyramid)
+
+    levels = store.image_levels("well")
+    assert [level["level"] for level in levels] == [0, 1, 2]
+    assert [level["height"] for level in levels] == [64, 32, 16]
+    assert store.select_level("well", 100.0, 131.5, target_height=16) == 2
+    assert store.select_level("well", 100.0, 131.5) == 0
+
+    level_depths, level_pixels = store.load_image("well", 0.0, 1000.0, level=1)
+    assert np.array_equal(level_depths, pyramid[1][0])
+    assert np.array_equal(level_pixels, pyramid[1][1])
+
+
+def test_partial_pyramid_keeps_lower_levels(store):
+    depths, pixels = make_image(height=64, width=32)
+    pyramid = ImageProcessingService.build_pyramid(pixels, depths, levels=3, min_width=4)
+    store.store_pyramid("well", pyramid)
+
+    new_level = (pyramid[2][0], np.zeros_like(pyramid[2][1]))
+    store.store_pyramid("well", [new_level], first_level=2)
+
+    assert [level["level"] for level in store.image_levels("well")] == [0, 1, 2]
+    assert np.array_equal(store.load_image("well", 0.0, 1000.0)[1], pixels)
+    assert not store.load_image("well", 0.0, 1000.0, level=2)[1].any()
+
+
+def test_store_pyramid_chunks(store):
+    depths, pixels = make_image(height=64, width=32)
+    chunks = [
+        ImageProcessingService.build_pyramid(pixels[i:i + 16], depths[i:i + 16], levels=2, min_width=4)
+        for i in range(0, 64, 16)
+    ]
+    stats = store.store_pyramid_chunks("well", chunks)
+    assert stats.rows == 64 + 32
+    assert stats.chunks == 4
+
+    levels = store.image_levels("well")
+    assert [level["height"] for level in levels] == [64, 32]
+    assert levels[0]["depth_min"] == 100.0 and levels[0]["depth_max"] == 131.5
+    assert np.array_equal(store.load_image("well", 0.0, 1000.0)[1], pixels)
+
+
+def test_store_pyramid_chunks_rejects_unsorted_chunks(store, tmp_path):
+    depths, pixels = make_image(height=32)
+    chunks = [[(depths[16:], pixels[16:])], [(depths[:16], pixels[:16])]]
+    with pytest.raises(DatabaseServiceError):
+        store.store_pyramid_chunks("well", chunks)
+    assert store.image_levels("well") == []
+    assert os.listdir(os.path.join(str(tmp_path), "t_images", "i_well")) == []
+
+
+def test_names_are_escaped(store, tmp_path):
+    depths, pixels = make_image(height=4)
+    store.store_image("../escape", depths, pixels)
+    assert os.listdir(str(tmp_path)) == ["t_images"]
+    assert np.array_equal(store.load_image("../escape", 0.0, 1000.0)[1], pixels)
+
+
+def test_iter_image_strips(store):
+    depths, pixels = make_image(height=64)
+    store.store_image("well", depths, pixels)
+
+    strips = list(store.iter_image("well", 100.0, 129.5, strip_rows=25))
+    assert [strip_pixels.shape[0] for _, strip_pixels in strips] == [25, 25, 10]
+    assert np.array_equal(np.concatenate([strip_pixels for _, strip_pixels in strips]), pixels[:60])
+    assert list(store.iter_image("well", 0.0, 1.0)) == []
+
+
+def test_seed_claims(store):
+    assert store.claim_seed("well", "v1", stale_after=60) == SEED_CLAIMED
+    assert store.claim_seed("well", "v1", stale_after=60) == SEED_BUSY
+    store.finish_seed("well", "v1", success=True)
+    assert store.claim_seed("well", "v1", stale_after=60) == SEED_READY
+    assert store.claim_seed("well", "v2", stale_after=60) == SEED_CLAIMED
+    store.finish_seed("well", "v2", success=False)
+    assert store.claim_seed("well", "v2", stale_after=60) == SEED_CLAIMED
+    assert store.claim_seed("well", "v2", stale_after=0) == SEED_CLAIMED
+
+
+def test_refreshed_seed_claim_is_not_taken_over(store):
+    with patch("services.memmap_store.time.time", return_value=1000.0):
+        assert store.claim_seed("well", "v1", stale_after=300) == SEED_CLAIMED
+    with patch("services.memmap_store.time.time", return_value=1200.0):
+        store.refresh_seed("well", "v1")
+        store.refresh_seed("well", "v2")
+    with patch("services.memmap_store.time.time", return_value=1400.0):
+        assert store.claim_seed("well", "v1", stale_after=300) == SEED_BUSY
+    with patch("services.memmap_store.time.time", return_value=1600.0):
+        assert store.claim_seed("well", "v1", stale_after=300) == SEED_CLAIMED
@@ -0,0 +1,87 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import numpy as np
+import pytest
+
+from services.metrics import (
+    STAGE_BYTES,
+    STAGE_ERRORS,
+    STAGE_ROWS,
+    STAGE_SECONDS,
+    MetricsRegistry,
+    stage_timer,
+    timed,
+)
+
+
+def _sample(lines, prefix):
+    return next(float(line.rsplit(" ", 1)[1]) for line in lines if line.startswith(prefix))
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("test_seconds", "Test durations.", ["stage"], [0.1, 1.0])
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value, "a")
+
+    lines = registry.render().splitlines()
+    assert lines[:2] == ["# HELP test_seconds Test durations.", "# TYPE test_seconds histogram"]
+    assert 'test_seconds_bucket{stage="a",le="0.1"} 2' in lines
+    assert 'test_seconds_bucket{stage="a",le="1.0"} 3' in lines
+    assert 'test_seconds_bucket{stage="a",le="+Inf"} 4' in lines
+    assert 'test_seconds_count{stage="a"} 4' in lines
+    assert _sample(lines, 'test_seconds_sum{stage="a"}') == pytest.approx(3.65)
+
+
+def test_counter_escapes_label_values():
+    registry = MetricsRegistry()
+    counter = registry.counter("test_total", "Test counter.", ["name"])
+    counter.inc('a"b\\c')
+    counter.inc('a"b\\c', amount=2)
+    assert 'test_total{name="a\\"b\\\\c"} 3.0' in registry.render().splitlines()
+
+
+def test_registry_returns_existing_metric():
+    registry = MetricsRegistry()
+    first = registry.counter("test_total", "Test counter.", [])
+    assert registry.counter("test_total", "Test counter.", []) is first
+
+
+def test_timed_records_duration_rows_and_bytes():
+    before = _count(STAGE_SECONDS, "test_timed")
+
+    @timed("test_timed")
+    def make_image():
+        return np.zeros((12, 5), dtype=np.uint8)
+
+    make_image()
+    assert _count(STAGE_SECONDS, "test_timed") == before + 1
+    assert 'image_pipeline_stage_rows_sum{stage="test_timed"} 12.0' in STAGE_ROWS.samples()
+    assert 'image_pipeline_stage_bytes_sum{stage="test_timed"} 60.0' in STAGE_BYTES.samples()
+
+
+def test_timed_counts_errors():
+    @timed("test_failing")
+    def fail():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        fail()
+    assert 'image_pipeline_stage_errors_total{stage="test_failing"} 1.0' in STAGE_ERRORS.samples()
+    assert _count(STAGE_SECONDS, "test_failing") == 1
+
+
+def test_stage_timer_records_size():
+    with stage_timer("test_block") as measure:
+        measure["size"] = (None, 128)
+    assert _count(STAGE_SECONDS, "test_block") == 1
+    assert 'image_pipeline_stage_bytes_sum{stage="test_block"} 128.0' in STAGE_BYTES.samples()
+    assert not any('stage="test_block"' in line for line in STAGE_ROWS.samples())
+
+
+def _count(histogram, stage):
+    prefix = f'{histogram.name}_count{{stage="{stage}"}}'
+    return next((int(line.rsplit(" ", 1)[1]) for line in histogram.samples() if line.startswith(prefix)), 0)
@@ -0,0 +1,97 @@
+import os
+import sys
+import threading
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import numpy as np
+import pytest
+
+import services.parallel as parallel
+from services.colormaps import ColormapRegistry
+from services.image_processing import ImageProcessingService
+from services.parallel import map_strips, strip_bounds
+
+
+@pytest.fixture
+def strips(monkeypatch):
+    """Split every image into 4 strips, however small."""
+    monkeypatch.setattr(parallel, "IMAGE_PARALLELISM", 4)
+    monkeypatch.setattr(parallel, "PARALLEL_MIN_ROWS", 1)
+
+
+def _serial(monkeypatch, function):
+    with monkeypatch.context() as patch:
+        patch.setattr(parallel, "IMAGE_PARALLELISM", 1)
+        return function()
+
+
+def _assert_identical(first, second):
+    if isinstance(first, (list, tuple)):
+        assert len(first) == len(second)
+        for first_item, second_item in zip(first, second):
+            _assert_identical(first_item, second_item)
+    else:
+        assert first.dtype == second.dtype
+        assert np.array_equal(first, second)
+
+
+def test_strip_bounds_cover_rows_aligned():
+    assert strip_bounds(100, 4) == [(0, 25), (25, 50), (50, 75), (75, 100)]
+    assert strip_bounds(100, 3, align=8) == [(0, 32), (32, 64), (64, 100)]
+    assert strip_bounds(10, 4, align=8) == [(0, 8), (8, 10)]
+    assert strip_bounds(5, 4, align=8) == [(0, 5)]
+
+
+def test_map_strips_returns_results_in_order(strips):
+    threads = set()
+
+    def strip(start, stop):
+        threads.add(threading.current_thread().name)
+        return start, stop
+
+    assert map_strips(strip, 10) == [(0, 2), (2, 5), (5, 7), (7, 10)]
+    assert len(threads) > 1
+    assert map_strips(strip, 10, min_rows=11) == [(0, 10)]
+    assert map_strips(strip, 10, workers=1) == [(0, 10)]
+
+
+def test_map_strips_raises_strip_errors(strips):
+    def strip(start, stop):
+        if start > 0:
+            raise ValueError(f"strip {start}")
+
+    with pytest.raises(ValueError):
+        map_strips(strip, 10)
+
+
+@pytest.mark.parametrize("shape", [(1001, 77), (998, 40, 3)])
+@pytest.mark.parametrize("method", ["area", "bilinear", "lanczos"])
+def test_resample_strips_match_serial(strips, monkeypatch, shape, method):
+    pixels = np.random.randint(0, 256, size=shape, dtype=np.uint8)
+    depths = np.cumsum(np.random.random(shape[0]) * 2)
+    for arguments in ({"width": 50}, {"width": 200}, {"depth_step": 0.7}, {"depth_step": 3.1, "width": 20}):
+        _assert_identical(
+            ImageProcessingService.resample(pixels, depths, method=method, **arguments),
+            _serial(monkeypatch, lambda: ImageProcessingService.resample(pixels, depths, method=method, **arguments)),
+        )
+
+
+@pytest.mark.parametrize("rows", [7, 998, 1001, 4099])
+def test_pyramid_strips_match_serial(strips, monkeypatch, rows):
+    pixels = np.random.randint(0, 256, size=(rows, 64), dtype=np.uint8)
+    depths = np.arange(rows, dtype=np.float64)
+    for levels in (1, 3, 6):
+
+        def build():
+            return ImageProcessingService.build_pyramid(pixels, depths, levels=levels, min_width=4)
+
+        _assert_identical(build(), _serial(monkeypatch, build))
+
+
+@pytest.mark.parametrize("shape", [(999, 30), (999, 30, 3), (999, 30, 4)])
+def test_colormap_strips_match_serial(strips, monkeypatch, shape):
+    registry = ColormapRegistry()
+    pixels = np.random.randint(0, 256, size=shape, dtype=np.uint8)
+    for name in ("COLORMAP_JET", "GRAYSCALE"):
+        _assert_identical(registry.apply(pixels, name), _serial(monkeypatch, lambda: registry.apply(pixels, name)))
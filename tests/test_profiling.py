@@ -0,0 +1,160 @@
+import asyncio
+import os
+import pstats
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from services.concurrency import BlockingExecutor
+from services.profiling import ProfileStore, ProfilingMiddleware, RequestProfile, _current_profile, profiled_call
+
+
+def _busy(n):
+    return sum(range(n))
+
+
+def _function_names(stats):
+    return {name for (_, _, name) in stats.stats}
+
+
+def test_request_profile_merges_calls():
+    profile = RequestProfile("GET", "/image-depth-range")
+    assert profile.stats() is None
+
+    assert profile.run(_busy, 10) == 45
+    profile.run(sorted, [3, 1, 2])
+
+    assert "_busy" in _function_names(profile.stats())
+
+
+def test_profiled_call_uses_current_profile():
+    assert profiled_call(_busy, 4) == 6
+
+    profile = RequestProfile("GET", "/")
+    token = _current_profile.set(profile)
+    try:
+        assert profiled_call(_busy, 4) == 6
+    finally:
+        _current_profile.reset(token)
+    assert "_busy" in _function_names(profile.stats())
+
+
+def test_executor_profiles_blocking_calls_of_the_request():
+    executor = BlockingExecutor(max_workers=2, max_pending=4, queue_timeout=1.0)
+    profile = RequestProfile("GET", "/")
+
+    async def handle():
+        token = _current_profile.set(profile)
+        try:
+            return await executor.run(_busy, 100)
+        finally:
+            _current_profile.reset(token)
+
+    try:
+        assert asyncio.run(handle()) == 4950
+    finally:
+        executor.shutdown()
+    assert "_busy" in _function_names(profile.stats())
+
+
+def test_profile_store_saves_lists_and_prunes(tmp_path):
+    store = ProfileStore(str(tmp_path / "profiles"), max_profiles=2)
+    assert store.list() == []
+
+    ids = []
+    for index in range(3):
+        profile = RequestProfile("GET", f"/path/{index}")
+        profile.run(_busy, 10)
+        ids.append(store.save(profile, 200, 0.01))
+        time.sleep(0.01)
+
+    assert [summary["id"] for summary in store.list()] == [ids[2], ids[1]]
+    assert store.path(ids[0]) is None
+    assert isinstance(pstats.Stats(store.path(ids[2])), pstats.Stats)
+    assert "_busy" in store.report(ids[2], sort="tottime", limit=5)
+    assert sorted(os.listdir(tmp_path / "profiles")) == sorted(
+        [f"{ids[1]}.json", f"{ids[1]}.prof", f"{ids[2]}.json", f"{ids[2]}.prof"]
+    )
+
+
+def test_profile_store_skips_empty_profiles_and_rejects_bad_ids(tmp_path):
+    store = ProfileStore(str(tmp_path), max_profiles=5)
+    assert store.save(RequestProfile("GET", "/"), 200, 0.0) is None
+    assert store.path("../../etc/passwd") is None
+    assert store.report("0" * 32) is None
+
+
+def test_middleware_profiles_requests_with_token_or_sample():
+    middleware = ProfilingMiddleware(app=None, store=None, token="secret", sample_rate=0.0)
+    assert middleware.wants_profile({"headers": [(b"x-profile", b"secret")]})
+    assert not middleware.wants_profile({"headers": [(b"x-profile", b"wrong")]})
+    assert not middleware.wants_profile({"headers": []})
+
+    sampled = ProfilingMiddleware(app=None, store=None, sample_rate=1.0)
+    assert sampled.wants_profile({"headers": [(b"x-profile", b"anything")]})
+
+
+def _asgi_app(blocking_calls_before, blocking_calls_after):
+    async def app(scope, receive, send):
+        for _ in range(blocking_calls_before):
+            profiled_call(_busy, 1000)
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        for _ in range(blocking_calls_after):
+            profiled_call(_busy, 1000)
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    return app
+
+
+def _call_middleware(middleware):
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": "/image", "headers": [(b"x-profile", b"secret")]}
+    asyncio.run(middleware(scope, None, send))
+    return dict(messages[0]["headers"])
+
+
+def test_middleware_names_written_profiles_only(tmp_path):
+    store = ProfileStore(str(tmp_path), max_profiles=5)
+    headers = _call_middleware(ProfilingMiddleware(_asgi_app(1, 0), store=store, token="secret"))
+    profile_id = headers[b"x-profile-id"].decode("latin-1")
+    assert store.path(profile_id) is not None
+
+    # A request without blocking calls has no profile to name
+    headers = _call_middleware(ProfilingMiddleware(_asgi_app(0, 0), store=store, token="secret"))
+    assert b"x-profile-id" not in headers
+    assert len(store.list()) == 1
+
+
+def test_middleware_saves_calls_profiled_after_the_response_started(tmp_path):
+    store = ProfileStore(str(tmp_path), max_profiles=5)
+    headers = _call_middleware(ProfilingMiddleware(_asgi_app(1, 2), store=store, token="secret"))
+    profile_id = headers[b"x-profile-id"].decode("latin-1")
+    stats = pstats.Stats(store.path(profile_id))
+    assert sum(calls for (_, _, name), (_, calls, *_) in stats.stats.items() if name == "_busy") == 3
+
+    # Calls made only while streaming are saved, though no header could name them
+    _call_middleware(ProfilingMiddleware(_asgi_app(0, 1), store=store, token="secret"))
+    assert len(store.list()) == 2
+
+
+def test_profiles_are_only_served_with_a_token(tmp_path, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    import main
+
+    monkeypatch.setattr(main, "profile_store", ProfileStore(str(tmp_path), max_profiles=5))
+    client = TestClient(main.app)
+    monkeypatch.setattr(main, "PROFILE_TOKEN", "")
+    assert client.get("/profiles").status_code == 403
+    assert client.get("/profiles/" + "0" * 32).status_code == 403
+
+    monkeypatch.setattr(main, "PROFILE_TOKEN", "secret")
+    assert client.get("/profiles", headers={"X-Profile-Token": "wrong"}).status_code == 403
+    response = client.get("/profiles", headers={"X-Profile-Token": "secret"})
+    assert response.status_code == 200
+    assert response.json() == {"profiles": []}
@@ -0,0 +1,80 @@
+import os
+import sys
+
+# Add the project root directory to the Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import asyncio
+import time
+from types import SimpleNamespace
+from unittest.mock import Mock, patch
+
+import pytest
+
+import main
+from services.cache import LRUCache
+from services.concurrency import BlockingExecutor
+from services.database import SEED_CLAIMED
+from services.tiles import DepthTileCache
+
+
+# 1. Test Startup Drops The Cached Seed Image
+def test_startup_invalidates_the_cached_seed_image():
+    state = SimpleNamespace(
+        response_cache=LRUCache(max_bytes=1 << 20),
+        tile_cache=DepthTileCache(tile_depth=4, max_bytes=1 << 20),
+        seed_status="pending",
+        seed_error=None,
+    )
+    state.response_cache.put("rendered", b"stale", size=5, tag=main.SEED_IMAGE_NAME)
+    generation = state.response_cache.generation(main.SEED_IMAGE_NAME)
+    state.tile_cache.invalidate = Mock()
+    executor = BlockingExecutor(max_workers=1, max_pending=1, queue_timeout=1)
+
+    try:
+        # Another worker seeded the image, this worker's caches still hold the previous one
+        with patch.object(main, "seed_database", return_value=False):
+            asyncio.run(main.startup_event(Mock(), executor, state))
+    finally:
+        executor.shutdown()
+
+    assert state.seed_status == "ready"
+    assert state.response_cache.get("rendered") is None
+    assert state.response_cache.generation(main.SEED_IMAGE_NAME) != generation
+    state.tile_cache.invalidate.assert_called_once_with("images", main.SEED_IMAGE_NAME)
+
+
+# 2. Test Seeds Renew Their Claim While Loading
+@pytest.mark.parametrize("chunk_rows", [0, 16])
+def test_seed_renews_its_claim_during_the_whole_load(chunk_rows, tmp_path):
+    path = tmp_path / "seed.csv"
+    rows = ["{},{}".format(100 + depth, ",".join(["7"] * 8)) for depth in range(32)]
+    header = "depth," + ",".join("pixel_{}".format(column) for column in range(1, 9))
+    path.write_text(header + "\n" + "\n".join(rows) + "\n")
+
+    database_service = Mock()
+    database_service.claim_seed.return_value = SEED_CLAIMED
+    load_seconds = 0.3
+
+    def slow_load(*args, **kwargs):
+        time.sleep(load_seconds)
+
+    database_service.store_pyramid.side_effect = slow_load
+    database_service.store_pyramid_chunks.side_effect = lambda image_name, chunks, table_name: [
+        slow_load() for _ in chunks
+    ]
+    with patch.object(main, "SEED_FILE", str(path)), patch.object(main, "SEED_CLAIM_TIMEOUT", 0.2), \
+            patch.object(main, "INGEST_CHUNK_ROWS", chunk_rows), patch.object(main, "PYRAMID_LEVELS", 1), \
+            patch.object(main, "DEPTH_STEP", 0):
+        assert main.seed_database(database_service)
+
+    fingerprint = database_service.claim_seed.call_args.args[1]
+    # Renewed every 0.05 s during the 0.3 s load, and no longer once it is finished
+    assert database_service.refresh_seed.call_count >= 3
+    assert {call.args for call in database_service.refresh_seed.call_args_list} == {
+        (main.SEED_IMAGE_NAME, fingerprint)
+    }
+    renewals = database_service.refresh_seed.call_count
+    time.sleep(0.1)
+    assert database_service.refresh_seed.call_count == renewals
+    database_service.finish_seed.assert_called_once_with(main.SEED_IMAGE_NAME, fingerprint, success=True)
@@ -0,0 +1,86 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import numpy as np
+
+from services.database import DatabaseService, create_db_engine
+from services.tiles import DepthTileCache
+
+depths = np.arange(0.0, 100.0, 0.5)
+pixels = np.arange(depths.size * 3, dtype=np.uint32).reshape(-1, 3).astype(np.uint8)
+
+
+class RecordingLoader:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, image_name, depth_min, depth_max):
+        self.calls.append((depth_min, depth_max))
+        mask = (depths >= depth_min) & (depths <= depth_max)
+        return depths[mask], pixels[mask]
+
+
+def expected(depth_min, depth_max):
+    mask = (depths >= depth_min) & (depths <= depth_max)
+    return depths[mask], pixels[mask]
+
+
+def test_window_matches_direct_query():
+    cache = DepthTileCache(tile_depth=10.0, max_bytes=1 << 20)
+    loader = RecordingLoader()
+    for window in [(3.2, 27.5), (0.0, 99.5), (10.0, 10.0), (55.0, 55.2)]:
+        loaded_depths, loaded_pixels = cache.load("images", "a", *window, loader)
+        expected_depths, expected_pixels = expected(*window)
+        assert np.array_equal(loaded_depths, expected_depths)
+        assert np.array_equal(loaded_pixels, expected_pixels)
+
+
+def test_only_missing_tiles_are_fetched():
+    cache = DepthTileCache(tile_depth=10.0, max_bytes=1 << 20)
+    loader = RecordingLoader()
+    cache.load("images", "a", 10.0, 29.0, loader)
+    assert loader.calls == [(10.0, 30.0)]
+
+    # Overlapping pan: tiles 1 and 2 are cached, only tile 3 is fetched.
+    cache.load("images", "a", 15.0, 35.0, loader)
+    assert loader.calls[1:] == [(30.0, 40.0)]
+
+    # Fully cached window: no query at all.
+    cache.load("images", "a", 12.0, 38.0, loader)
+    assert len(loader.calls) == 2
+
+
+def test_wide_windows_bypass_cache():
+    cache = DepthTileCache(tile_depth=1.0, max_bytes=1 << 20, max_tiles=10)
+    loader = RecordingLoader()
+    loaded_depths, _ = cache.load("images", "a", 0.0, 1e9, loader)
+    assert loader.calls == [(0.0, 1e9)]
+    assert loaded_depths.size == depths.size
+    assert cache.tiles.stats()["entries"] == 0
+
+
+def test_store_image_invalidates_tiles():
+    cache = DepthTileCache(tile_depth=10.0, max_bytes=1 << 20)
+    db_service = DatabaseService(engine=create_db_engine("sqlite://"), tile_cache=cache)
+    db_service.store_image("a", depths, pixels)
+    _, first = db_service.load_image("a", 0.0, 20.0)
+
+    db_service.store_image("a", depths, 255 - pixels)
+    _, second = db_service.load_image("a", 0.0, 20.0)
+    assert np.array_equal(second, 255 - first)
+
+
+def test_tiles_expire_after_ttl():
+    now = [0.0]
+    cache = DepthTileCache(tile_depth=10.0, max_bytes=1 << 20, ttl=30.0, clock=lambda: now[0])
+    loader = RecordingLoader()
+    cache.load("images", "a", 10.0, 19.0, loader)
+    cache.load("images", "a", 10.0, 19.0, loader)
+    assert loader.calls == [(10.0, 20.0)]
+
+    # A tile rewritten by another worker is fetched again once it expires
+    now[0] = 31.0
+    cache.load("images", "a", 10.0, 19.0, loader)
+    assert loader.calls == [(10.0, 20.0), (10.0, 20.0)]